@@ -0,0 +1,300 @@
+'''django-deepzoom cache'''
+
+from django.conf import settings
+
+try:
+    from django.core.cache import caches
+except ImportError:
+    from django.core.cache import get_cache as get_django_cache
+else:
+    def get_django_cache(alias):
+        return caches[alias]
+
+from collections import OrderedDict
+import os
+import threading
+
+from .deepzoom import TilePack
+
+
+
+DEFAULT_DEEPZOOM_CACHE = {'tile_bytes': 16 * 1024 * 1024,
+                          'level_bytes': 64 * 1024 * 1024,
+                          'shared_cache': None}
+
+
+class LRUCache(object):
+    """
+    A thread-safe in-memory cache holding at most `max_bytes` bytes of values,
+    evicting the least recently used values first.  Counts hits, misses and
+    evictions.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for key, or default if there is none.
+        """
+        with self._lock:
+            try:
+                value, nbytes = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = (value, nbytes)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, nbytes):
+        """
+        Caches value, taking up nbytes bytes, for key.  Returns whether it was
+        cached; values bigger than the whole cache are not.
+        """
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return False
+            self._items[key] = (value, nbytes)
+            self.bytes += nbytes
+            self._evict()
+            return True
+
+    def delete(self, key):
+        """
+        Removes the value cached for key, if any.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def delete_matching(self, predicate):
+        """
+        Removes the values cached for every key predicate(key) is true for.
+        """
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                self._discard(key)
+
+    def resize(self, max_bytes):
+        """
+        Changes the size of the cache, evicting values if it shrinks.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """
+        Removes every cached value and resets the counters.
+        """
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            key, (value, nbytes) = self._items.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+# /LRUCache
+
+
+class SharedTileCache(object):
+    """
+    Keeps encoded tiles and parsed descriptors of deep zooms in a Django cache,
+    so every process and host using that cache shares them.  Entries are
+    versioned with the fingerprint of the deep zoom's pyramid, which is itself
+    cached per deep zoom as its generation; forgetting the generation retires
+    every entry of the pyramid at once.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_generation(self, slug):
+        """
+        Returns the fingerprint of a deep zoom's current pyramid, if cached.
+        """
+        return self.cache.get(self._get_generation_key(slug))
+
+    def set_generation(self, slug, fingerprint):
+        """
+        Caches the fingerprint of a deep zoom's current pyramid.
+        """
+        self.cache.set(self._get_generation_key(slug), fingerprint)
+
+    def forget(self, slug):
+        """
+        Retires every cached entry of a deep zoom's current pyramid.
+        """
+        self.cache.delete(self._get_generation_key(slug))
+
+    def get_tile(self, slug, fingerprint, level, column, row, tile_format):
+        """
+        Returns (tile, descriptor) of a pyramid generation, fetched together.
+        Either is None if it isn't cached.
+        """
+        tile_key = self._get_tile_key(slug, level, column, row, tile_format)
+        descriptor_key = self._get_descriptor_key(slug)
+        values = self.cache.get_many([tile_key, descriptor_key],
+                                     version=fingerprint)
+        return (values.get(tile_key), values.get(descriptor_key))
+
+    def set_tiles(self, slug, fingerprint, tiles, descriptor=None):
+        """
+        Caches encoded tiles of a pyramid generation, given as a dictionary
+        of {(level, column, row, tile_format): tile}, in one go, along with
+        its parsed descriptor if given.
+        """
+        values = dict((self._get_tile_key(slug, *position), tile)
+                      for (position, tile) in tiles.items())
+        if descriptor is not None:
+            values[self._get_descriptor_key(slug)] = descriptor
+        self.cache.set_many(values, version=fingerprint)
+
+    def _get_generation_key(self, slug):
+        return "deepzoom:%s:generation" % slug
+
+    def _get_descriptor_key(self, slug):
+        return "deepzoom:%s:descriptor" % slug
+
+    def _get_tile_key(self, slug, level, column, row, tile_format):
+        return "deepzoom:%s:%s:%s_%s.%s" % (slug, level, column, row, tile_format)
+# /SharedTileCache
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache_settings():
+    """
+    Returns the `DEEPZOOM_CACHE` settings.
+    Substitutes in default values, if missing.
+    """
+    try:
+        cache_settings = settings.DEEPZOOM_CACHE
+    except AttributeError:
+        cache_settings = DEFAULT_DEEPZOOM_CACHE
+
+    if not isinstance(cache_settings, dict):
+        raise AttributeError("`DEEPZOOM_CACHE` must be a dictionary.")
+
+    return cache_settings
+
+
+def get_cache_size(name):
+    """
+    Returns the size in bytes `DEEPZOOM_CACHE` sets for a cache.
+    Substitutes in default value, if missing.
+    """
+    cache_settings = get_cache_settings()
+    try:
+        return max(int(cache_settings.get(name, DEFAULT_DEEPZOOM_CACHE[name])), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_DEEPZOOM_CACHE[name]
+
+
+def get_cache(name):
+    """
+    Returns the in-process cache, 'tile_bytes' for encoded tiles keyed by
+    (slug, level, column, row, format) or 'level_bytes' for level images keyed
+    by (slug, level), sized from `DEEPZOOM_CACHE`.
+    """
+    max_bytes = get_cache_size(name)
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = LRUCache(max_bytes)
+    if cache.max_bytes != max_bytes:
+        cache.resize(max_bytes)
+    return cache
+
+
+def get_tile_cache():
+    """
+    Returns the in-process cache of encoded tiles.
+    """
+    return get_cache('tile_bytes')
+
+
+def get_level_cache():
+    """
+    Returns the in-process cache of level images.
+    """
+    return get_cache('level_bytes')
+
+
+def get_shared_cache():
+    """
+    Returns the shared tile cache kept in the Django cache `DEEPZOOM_CACHE`
+    names as 'shared_cache', or None if it names none.
+    """
+    alias = get_cache_settings().get('shared_cache')
+    if not alias:
+        return None
+    return SharedTileCache(get_django_cache(alias))
+
+
+#Each opened pack counts as one "byte", so this bounds the number kept open.
+MAX_TILE_PACKS = 64
+
+_tile_packs = LRUCache(MAX_TILE_PACKS)
+
+
+def get_tile_pack(path):
+    """
+    Returns the tile pack at path opened for reading, or None if there is no 
+    pack.  Opened packs are kept for later calls until the file changes, for 
+    up to `MAX_TILE_PACKS` packs.  Packs replaced or evicted are never closed 
+    here, as requests may still be reading them; each is unmapped once the 
+    last of its tiles is released.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    version = (stat.st_size, getattr(stat, "st_mtime_ns", stat.st_mtime),
+               stat.st_ino)
+    opened = _tile_packs.get(path)
+    if opened is not None and opened[0] == version:
+        return opened[1]
+    try:
+        pack = TilePack(path).open()
+    except (IOError, OSError, ValueError):
+        return None
+    _tile_packs.set(path, (version, pack), 1)
+    return pack
+
+
+def forget_deepzoom(slug):
+    """
+    Removes every cached tile and level image of a deepzoom.
+    """
+    for cache in (get_tile_cache(), get_level_cache()):
+        cache.delete_matching(lambda key: key[0] == slug)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.forget(slug)
+
+
+#EOF - django-deepzoom cache
@@ -34,12 +34,31 @@
 #===============================================================================
 
 
+import errno
+import hashlib
+import io
 import math
+import mmap
+from multiprocessing.pool import ThreadPool
 import optparse
 import os
 from PIL import Image as PILImage
+from PIL import ImageChops
+import shutil
+import struct
 import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 import xml.dom.minidom
+from xml.parsers import expat
+from xml.parsers.expat import ExpatError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 NS_DEEPZOOM = "http://schemas.microsoft.com/deepzoom/2008"
 
@@ -56,32 +75,786 @@ image_format_map = {
     "png": "png",
     }
 
+pyramid_mode_map = {
+    "cascade": "cascade",
+    "reference": "reference",
+    "stream": "stream",
+    }
+
+class PillowBackend(object):
+    """Resamples and encodes with Pillow, holding pyramid levels as Pillow
+    images.
+
+    This is also the interface ImageCreator and CollectionCreator call
+    through: other backends subclass it, override what they do differently
+    and are added with `register_backend`. Levels may be any object the
+    backend's own methods understand, but tiles handed to `encode` and
+    images returned by `decode` are Pillow images."""
+    name = "pillow"
+
+    def __init__(self, scratch_dir=None):
+        # Pillow can't keep its bitmaps in a mapped file, so there's no
+        # scratch backing for this backend.
+        self.scratch_dir = None
+
+    def load(self, image):
+        """Returns a (decoded) Pillow image as a level of this backend.
+        Palette and bilevel images are converted to RGB(A): Pillow only
+        resamples those with NEAREST, so halving a region of one wouldn't
+        give the pixels halving the whole image does."""
+        image.load()
+        if image.mode in ("1", "P", "PA"):
+            image = _convert_to_rgb(image)
+        return image
+
+    def get_size(self, image):
+        """Returns the (width, height) of a level."""
+        return image.size
+
+    def get_nbytes(self, image):
+        """Returns about how many bytes of memory a level takes up."""
+        width, height = image.size
+        return width * height * len(image.getbands())
+
+    def reduce(self, image, resample=PILImage.ANTIALIAS):
+        """Halves image, rounding odd dimensions up, which is how the
+        dimensions of each level follow from the level above it. Pixels are
+        averaged in 2x2 blocks; resample is only used where Pillow can't
+        halve the image exactly, so the creator's resize_filter doesn't
+        affect cascaded levels."""
+        width, height = image.size
+        size = ((width + 1) // 2, (height + 1) // 2)
+        try:
+            reduced = image.reduce(2)
+        except (AttributeError, ValueError):
+            # Pillow < 7.0 or a mode `reduce` can't handle, e.g. "P" or "1"
+            reduced = None
+        if reduced is None or reduced.size != size:
+            return image.resize(size, resample)
+        return reduced
+
+    def get_rows(self, image, top, bottom):
+        """Returns the rows [top, bottom) of a level."""
+        return image.crop((0, top, image.size[0], bottom))
+
+    def join_rows(self, upper, lower):
+        """Returns the rows of lower appended to the rows of upper."""
+        width, height = upper.size
+        image = PILImage.new(upper.mode, (width, height + lower.size[1]))
+        image.paste(upper, (0, 0))
+        image.paste(lower, (0, height))
+        return image
+
+    def get_tile(self, image, bounds):
+        """Returns the region of a level at bounds as a Pillow image."""
+        return image.crop(bounds)
+
+    def encode(self, tile, tile_file, tile_format, image_quality):
+        """Encodes a tile in tile_format ("jpg" or "png") to a file object."""
+        if tile_format == "jpg":
+            tile.save(tile_file, "JPEG", quality=int(image_quality * 100))
+        else:
+            tile.save(tile_file, "PNG")
+
+    def decode(self, path):
+        """Returns the image file at path as a Pillow image."""
+        return PILImage.open(path)
+
+
+class NumPyBackend(PillowBackend):
+    """Holds pyramid levels as contiguous NumPy arrays, halves them with a
+    vectorized 2x2 box filter and slices tiles out of them as views.
+
+    Given a scratch_dir, levels are `numpy.memmap` arrays on anonymous
+    scratch files in that directory instead of living on the heap, so the
+    kernel can page them out under memory pressure. The files are unlinked
+    as soon as they're mapped (or, on Windows, when they're unmapped), so
+    nothing is left behind however generation ends."""
+    name = "numpy"
+
+    # Rows halved at a time, which bounds the temporary sums reduce needs
+    reduce_rows = 256
+
+    def __init__(self, scratch_dir=None):
+        self.scratch_dir = scratch_dir
+
+    def allocate(self, shape, dtype):
+        """Returns an uninitialized level array, scratch-backed if configured."""
+        if self.scratch_dir is None or 0 in shape:
+            return numpy.empty(shape, dtype)
+        scratch = tempfile.TemporaryFile(prefix="deepzoom-", dir=self.scratch_dir)
+        try:
+            # the map holds its own handle on the file
+            return numpy.memmap(scratch, dtype=dtype, mode="w+", shape=shape)
+        finally:
+            scratch.close()
+
+    def load(self, image):
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = _convert_to_rgb(image)
+        if self.scratch_dir is None:
+            return numpy.ascontiguousarray(numpy.asarray(image))
+        width, height = image.size
+        first = numpy.asarray(image.crop((0, 0, width, min(height, self.reduce_rows))))
+        array = self.allocate((height,) + first.shape[1:], first.dtype)
+        for top in range(0, height, self.reduce_rows):
+            bottom = min(top + self.reduce_rows, height)
+            array[top:bottom] = numpy.asarray(image.crop((0, top, width, bottom)))
+        return array
+
+    def get_size(self, image):
+        return (image.shape[1], image.shape[0])
+
+    def get_nbytes(self, image):
+        return image.nbytes
+
+    def reduce(self, image, resample=None):
+        """Halves image by averaging 2x2 blocks. Blocks cut short by an odd
+        edge average the pixels they have, like Pillow's `reduce`."""
+        height, width = image.shape[:2]
+        reduced = self.allocate(((height + 1) // 2, (width + 1) // 2)
+                                + image.shape[2:], image.dtype)
+        for top in range(0, height, 2 * self.reduce_rows):
+            bottom = min(top + 2 * self.reduce_rows, height)
+            reduced[top // 2:(bottom + 1) // 2] = _halve(image[top:bottom])
+        return reduced
+
+    def get_rows(self, image, top, bottom):
+        return image[top:bottom]
+
+    def join_rows(self, upper, lower):
+        image = self.allocate((upper.shape[0] + lower.shape[0],)
+                              + upper.shape[1:], upper.dtype)
+        image[:upper.shape[0]] = upper
+        image[upper.shape[0]:] = lower
+        return image
+
+    def get_tile(self, image, bounds):
+        x1, y1, x2, y2 = bounds
+        return PILImage.fromarray(numpy.asarray(image[y1:y2, x1:x2]))
+
+
+backend_map = {
+    "pillow": PillowBackend,
+    "numpy": NumPyBackend,
+    }
+
+def register_backend(name, backend):
+    """Makes a PillowBackend subclass selectable by name."""
+    backend_map[name] = backend
+
+def get_backend(name, scratch_dir=None):
+    """Returns an instance of the backend registered as name, or of the
+    Pillow backend if there is no such backend (or NumPy is missing)."""
+    if name not in backend_map or (name == "numpy" and numpy is None):
+        name = "pillow"
+    return backend_map[name](scratch_dir=scratch_dir)
+
+class SourceReader(object):
+    """Reads the pixels of a source image with Pillow, for formats that can
+    only be decoded whole: the image is decoded the first time any region
+    of it is read and kept for later reads.
+
+    This is also the interface ImageCreator reads sources through: readers
+    of formats that can do better subclass it and are added with
+    `register_source_reader`. Besides the image itself, a source may hold
+    reductions, smaller copies of the image, offered by size in
+    `reductions`. Reductions are stored in the source unless
+    `scaled_reductions` is set, when each is decoded from the image at a
+    smaller scale instead, costing a decode, if a cheaper one, each."""
+    scaled_reductions = False
+
+    def __init__(self, source, image=None):
+        self.source = source
+        if image is None:
+            with PILImage.open(source) as image:
+                self.size = image.size
+                self.mode = image.mode
+        else:
+            self.size = image.size
+            self.mode = image.mode
+        self.reductions = {}
+        self._image = None
+
+    def read_region(self, box, size=None):
+        """Returns the (x1, y1, x2, y2) region of the image, or of its
+        reduction of the given size, as a decoded Pillow image."""
+        if size is not None and size != self.size:
+            return self.get_reduction(size).crop(box)
+        if self._image is None:
+            self._image = PILImage.open(self.source)
+            self._image.load()
+        return self._image.crop(box)
+
+    def get_reduction(self, size):
+        """Returns the reduction of the given size, decoded, or None if the
+        source has no such reduction."""
+        return None
+
+    def get_strips(self, strip_height):
+        """Iterator for horizontal strips of the image, top to bottom."""
+        width, height = self.size
+        for y in range(0, height, strip_height):
+            yield self.read_region((0, y, width, min(y + strip_height, height)))
+
+
+class TiffSourceReader(SourceReader):
+    """Reads TIFF (and BigTIFF) sources a region at a time. Images stored as
+    several strips or tiles are decoded from just the strips or tiles a
+    region touches; Pillow hands compressed images to libtiff whole, so
+    those are decoded whole. Later pages of the file of the same mode and a
+    smaller size, such as the levels of a pyramidal TIFF, are reductions."""
+    def __init__(self, source, image=None):
+        if image is None:
+            with PILImage.open(source) as image:
+                TiffSourceReader.__init__(self, source, image)
+            return
+        SourceReader.__init__(self, source, image)
+        self._frames = {self.size: 0}
+        self._images = {}
+        for frame in range(1, getattr(image, "n_frames", 1)):
+            image.seek(frame)
+            width, height = image.size
+            if (image.mode == self.mode and width < self.size[0]
+                    and height < self.size[1]):
+                self._frames.setdefault(image.size, frame)
+                self.reductions.setdefault(image.size, frame)
+
+    def _open(self, size):
+        """Opens the page of the given size, not decoded yet."""
+        image = PILImage.open(self.source)
+        if self._frames[size]:
+            image.seek(self._frames[size])
+        return image
+
+    def read_region(self, box, size=None):
+        size = size or self.size
+        image = self._images.get(size)
+        if image is not None:
+            return image.crop(box)
+        image = self._open(size)
+        source_tiles = list(image.tile or [])
+        if len(source_tiles) < 2:
+            image.load()
+            self._images[size] = image
+            return image.crop(box)
+        x1, y1, x2, y2 = box
+        region = [t for t in source_tiles if t[1][0] < x2 and t[1][2] > x1
+                  and t[1][1] < y2 and t[1][3] > y1]
+        left = min(t[1][0] for t in region)
+        top = min(t[1][1] for t in region)
+        right = max(t[1][2] for t in region)
+        bottom = max(t[1][3] for t in region)
+        # Decode just the region: shift its tiles up and left and shrink the
+        # image to fit them before Pillow allocates the bitmap on load().
+        image.tile = [(t[0], (t[1][0] - left, t[1][1] - top,
+                              t[1][2] - left, t[1][3] - top)) + tuple(t[2:])
+                      for t in region]
+        _set_size(image, (right - left, bottom - top))
+        image.load()
+        return image.crop((x1 - left, y1 - top, x2 - left, y2 - top))
+
+    def get_reduction(self, size):
+        if size not in self.reductions:
+            return None
+        return self.read_region((0, 0) + size, size)
+
+
+class JpegSourceReader(SourceReader):
+    """Reads JPEG sources, which libjpeg can decode at 1/2, 1/4 or 1/8 of
+    their size for a fraction of the time and memory of a full decode
+    (Pillow's draft mode). Those sizes are offered as scaled reductions,
+    worked out the first time they are asked for."""
+    scaled_reductions = True
+
+    def __init__(self, source, image=None):
+        SourceReader.__init__(self, source, image)
+        del self.reductions
+
+    def __getattr__(self, name):
+        if name != "reductions":
+            raise AttributeError(name)
+        # libjpeg rounds scaled sizes up
+        width, height = self.size
+        self.reductions = {}
+        for scale in (2, 4, 8):
+            if width < scale or height < scale:
+                break
+            self.reductions.setdefault((-(-width // scale),
+                                        -(-height // scale)), scale)
+        return self.reductions
+
+    def get_reduction(self, size):
+        scale = self.reductions.get(size)
+        if scale is None:
+            return None
+        image = PILImage.open(self.source)
+        image.draft(self.mode, (self.size[0] // scale, self.size[1] // scale))
+        image.load()
+        return image
+
+
+source_reader_map = {
+    "JPEG": JpegSourceReader,
+    "TIFF": TiffSourceReader,
+    }
+
+def register_source_reader(format, reader):
+    """Makes a SourceReader subclass read sources Pillow identifies as
+    format."""
+    source_reader_map[format] = reader
+
+def get_source_reader(source):
+    """Returns a reader of the source, of the class registered for its
+    format, or a plain SourceReader."""
+    with PILImage.open(source) as image:
+        return source_reader_map.get(image.format, SourceReader)(source, image)
+
+class TileWriter(object):
+    """Writes encoded tiles to disk.
+
+    Each tile is encoded exactly once, into an in-memory buffer reused by
+    the calling thread, and written with a single write to a file that is
+    closed straight away. With atomic=True the tile is written under a
+    temporary name and renamed into place, so a partly written tile is
+    never visible. Totals of tiles, bytes and seconds spent encoding and
+    writing, by all threads together, are kept for measuring tile output
+    on its own, along with the time from the first write to the last.
+
+    With link_uniform=True, tiles of a single colour are only encoded the
+    first time each colour and size is seen; later ones are hard links to
+    that first file (or, where links aren't possible, copies of its bytes).
+    Tiles are always written to a new file rather than into an existing
+    one, so rewriting a tile never changes the tiles linked to it."""
+    def __init__(self, backend, tile_format="jpg", image_quality=0.95,
+                 atomic=False, link_uniform=False):
+        self.backend = backend
+        self.tile_format = tile_format
+        self.image_quality = image_quality
+        self.atomic = atomic
+        self.link_uniform = link_uniform
+        self.tiles_written = 0
+        self.tiles_linked = 0
+        self.bytes_written = 0
+        self.seconds = 0.0
+        self.first_started = None
+        self.last_finished = None
+        self._uniform_tiles = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, tile, tile_path):
+        """Encodes tile and writes it to tile_path. Returns bytes written."""
+        started = time.time()
+        key = self._get_uniform_key(tile) if self.link_uniform else None
+        canonical = self._uniform_tiles.get(key) if key is not None else None
+        if canonical is not None:
+            canonical_path, data = canonical
+            linked = self._publish(tile_path, data, canonical_path)
+        else:
+            data = self.encode(tile)
+            linked = self._publish(tile_path, data)
+            if key is not None:
+                with self._lock:
+                    self._uniform_tiles.setdefault(key, (tile_path, data))
+        finished = time.time()
+        with self._lock:
+            self.tiles_written += 1
+            self.tiles_linked += linked
+            self.bytes_written += 0 if linked else len(data)
+            self.seconds += finished - started
+            if self.first_started is None or started < self.first_started:
+                self.first_started = started
+            if self.last_finished is None or finished > self.last_finished:
+                self.last_finished = finished
+        return 0 if linked else len(data)
+
+    def _publish(self, tile_path, data, canonical_path=None):
+        """Puts a tile in place, as a link to canonical_path if given and
+        possible. Returns whether it was linked."""
+        path = tile_path
+        if self.atomic:
+            path = "%s.%s-%s.tmp" % (tile_path, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            linked = canonical_path is not None and _link_file(canonical_path, path)
+            if not linked:
+                _write_file(path, data)
+            if self.atomic:
+                _replace(path, tile_path)
+        except:
+            if self.atomic and os.path.exists(path):
+                os.remove(path)
+            raise
+        return linked
+
+    def _get_uniform_key(self, tile):
+        """Returns (mode, size, colour) for a tile of one colour, else None."""
+        extrema = tile.getextrema()
+        if not isinstance(extrema[0], tuple):
+            extrema = (extrema,)
+        for (low, high) in extrema:
+            if low != high:
+                return None
+        return (tile.mode, tile.size, tuple(low for (low, high) in extrema))
+
+    def encode(self, tile):
+        """Returns tile encoded with the backend, as bytes."""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        self.backend.encode(tile, buffer, self.tile_format, self.image_quality)
+        return buffer.getvalue()
+
+    @property
+    def wall_seconds(self):
+        """Seconds from the start of the first write to the end of the last."""
+        if self.first_started is None:
+            return 0.0
+        return self.last_finished - self.first_started
+
+    @property
+    def tiles_per_second(self):
+        """Tile output throughput of all threads writing tiles, over the
+        wall-clock time from the first write to the last."""
+        wall_seconds = self.wall_seconds
+        if not wall_seconds:
+            return 0.0
+        return self.tiles_written / wall_seconds
+
+
+class Checkpoint(object):
+    """Records the tiles of a pyramid as they are finished, in a manifest next
+    to its _files directory, so that an interrupted create() can be resumed.
+    The manifest's first line identifies the source and settings; after it,
+    a line is appended for each finished tile and for each finished level.
+    Only whole lines count, so a line torn by a crash is ignored."""
+
+    # Tiles recorded between flushes of the manifest
+    flush_tiles = 64
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.levels = set()
+        self.tiles = {}
+        self._file = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Reads the manifest left by an earlier run. Returns whether it was
+        recorded for the same fingerprint; nothing is kept from it if not."""
+        try:
+            with open(self.path) as manifest:
+                lines = manifest.read().split("\n")[:-1]
+        except (IOError, OSError):
+            return False
+        if not lines or lines[0] != "deepzoom-checkpoint %s"%self.fingerprint:
+            return False
+        for line in lines[1:]:
+            fields = line.split()
+            try:
+                if len(fields) == 2 and fields[0] == "level":
+                    self.levels.add(int(fields[1]))
+                elif len(fields) == 4 and fields[0] == "tile":
+                    level, column, row = [int(field) for field in fields[1:]]
+                    self.tiles.setdefault(level, set()).add((column, row))
+            except ValueError:
+                continue
+        return True
+
+    def start(self, resumed=False):
+        """Opens the manifest, carrying on from what load() read if resumed
+        and starting it afresh otherwise."""
+        if resumed:
+            self._file = open(self.path, "a")
+            self._file.write("\n")
+        else:
+            self.levels.clear()
+            self.tiles.clear()
+            self._file = open(self.path, "w")
+            self._file.write("deepzoom-checkpoint %s\n"%self.fingerprint)
+        self._file.flush()
+
+    def is_done(self, level, position):
+        """Whether the tile at position, (column, row), is already finished."""
+        return level in self.levels or position in self.tiles.get(level, ())
+
+    def add(self, level, position):
+        """Records a finished tile."""
+        with self._lock:
+            self._file.write("tile %s %s %s\n"%(level, position[0], position[1]))
+            self._pending += 1
+            if self._pending >= self.flush_tiles:
+                self._file.flush()
+                self._pending = 0
+
+    def finish_level(self, level):
+        """Records a finished level."""
+        with self._lock:
+            self._file.write("level %s\n"%level)
+            self._file.flush()
+            self._pending = 0
+            self.levels.add(level)
+            self.tiles.pop(level, None)
+
+    def close(self, finished=False):
+        """Closes the manifest, removing it once the pyramid is finished."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if finished and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress(object):
+    """Reports the progress of creating a pyramid by calling
+    callback(level, tiles_done, tiles_total, bytes_written, elapsed) as tiles
+    are written: for the first tile, then at most once every `interval`
+    seconds, and for the last tile. Tiles an earlier run finished count as
+    done from the start."""
+    def __init__(self, callback, tiles_total, tiles_done=0, interval=0.5):
+        self.callback = callback
+        self.tiles_total = tiles_total
+        self.tiles_done = tiles_done
+        self.bytes_written = 0
+        self.interval = interval
+        self.started = time.time()
+        self._next_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, level, nbytes):
+        """Counts a tile of a level written with nbytes bytes."""
+        with self._lock:
+            self.tiles_done += 1
+            self.bytes_written += nbytes
+            now = time.time()
+            if now >= self._next_report or self.tiles_done >= self.tiles_total:
+                self._next_report = now + self.interval
+                self.callback(level, self.tiles_done, self.tiles_total,
+                              self.bytes_written, now - self.started)
+
+
+class Cancelled(Exception):
+    """Raised by ImageCreator.create() when it was cancelled."""
+
+
+class TilePack(object):
+    """All tiles of a pyramid in a single file, `<name>_files.pack`, in place
+    of a _files directory holding a file per tile.
+
+    The pack starts with a header naming the tile format. Encoded tiles are
+    appended after it back to back, followed by an index of (level, column,
+    row, offset, length) entries and a footer pointing at the index. Adding
+    tiles to a finished pack appends them with a new index and footer, so
+    the tiles the previous index points at are never moved or overwritten.
+    A new pack, or a copy of the pack tiles are added to, is written under a
+    temporary name and renamed into place, so the pack in place always ends
+    in a valid footer, however writing it ends.
+
+    Opened for reading, the pack is mapped into memory and tiles are
+    returned as slices of the mapping, without being copied."""
+    header = struct.Struct("<4sB3s")    # magic, version, tile format
+    entry = struct.Struct("<HIIQI")     # level, column, row, offset, length
+    footer = struct.Struct("<QI4s")     # index offset, entries, magic
+    magic = b"DZTP"
+    version = 1
+
+    def __init__(self, path, tile_format=None):
+        self.path = path
+        self.tile_format = tile_format
+        self.index = {}
+        self._map = None
+        self._view = None
+        self._file = None
+        self._file_path = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Maps the pack into memory and reads its index. Raises ValueError
+        if the file isn't a finished pack."""
+        with open(self.path, "rb") as pack_file:
+            self._map = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.tile_format, self.index = self._read_index(self._map)
+        except:
+            self.close()
+            raise
+        self._view = memoryview(self._map)
+        return self
+
+    def _read_index(self, data):
+        """Returns (tile format, index) read from the bytes of a pack."""
+        size = len(data)
+        if size < self.header.size + self.footer.size:
+            raise ValueError("%s is not a tile pack" % self.path)
+        magic, version, tile_format = self.header.unpack_from(data, 0)
+        offset, count, end_magic = self.footer.unpack_from(
+            data, size - self.footer.size)
+        if (magic != self.magic or end_magic != self.magic
+                or version != self.version
+                or offset + count * self.entry.size != size - self.footer.size):
+            raise ValueError("%s is not a tile pack" % self.path)
+        index = {}
+        for i in range(count):
+            level, column, row, tile_offset, length = self.entry.unpack_from(
+                data, offset + i * self.entry.size)
+            index[(level, column, row)] = (tile_offset, length)
+        return (tile_format.decode("ascii").rstrip("\0"), index)
+
+    def get_tile(self, level, column, row):
+        """Returns the encoded tile as a memoryview slice of the pack, or None
+        if the pack has no such tile."""
+        try:
+            offset, length = self.index[(level, column, row)]
+        except KeyError:
+            return None
+        return self._view[offset:offset + length]
+
+    def start(self, append=False):
+        """Opens the pack for adding tiles: if append, a copy of the existing
+        pack, with its tiles kept, otherwise a new, empty pack."""
+        self._file_path = "%s.%s.tmp" % (self.path, os.getpid())
+        if append:
+            shutil.copyfile(self.path, self._file_path)
+            self._file = open(self._file_path, "r+b")
+            try:
+                self.tile_format, self.index = self._read_index(self._file.read())
+            except:
+                self.abort()
+                raise
+        else:
+            self.index = {}
+            self._file = open(self._file_path, "wb")
+            self._file.write(self.header.pack(self.magic, self.version,
+                                              self.tile_format.encode("ascii")))
+
+    def add(self, key, data):
+        """Appends an encoded tile, key being (level, column, row)."""
+        with self._lock:
+            self.index[key] = (self._file.tell(), len(data))
+            self._file.write(data)
+
+    def link(self, key, canonical_key):
+        """Adds a tile whose bytes are those of the tile at canonical_key."""
+        with self._lock:
+            self.index[key] = self.index[canonical_key]
+
+    def finish(self):
+        """Appends the index and footer and puts the pack in place."""
+        index_offset = self._file.tell()
+        entries = [self.entry.pack(level, column, row, offset, length)
+                   for ((level, column, row), (offset, length))
+                   in sorted(self.index.items())]
+        self._file.write(b"".join(entries))
+        self._file.write(self.footer.pack(index_offset, len(entries),
+                                          self.magic))
+        self._file.close()
+        self._file = None
+        _replace(self._file_path, self.path)
+
+    def abort(self):
+        """Drops the tiles added since start(), leaving the pack as it was."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._file_path)
+
+    def close(self):
+        """Unmaps a pack opened for reading. Slices still in use keep the
+        mapping alive until they are released."""
+        self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+
+class PackWriter(TileWriter):
+    """Writes encoded tiles into a TilePack instead of files. Tiles are still
+    given as the paths they would have as files, `<level>/<column>_<row>.
+    <format>`, which become their keys in the pack; a uniform tile linked to
+    an earlier one is an index entry pointing at the earlier one's bytes."""
+    def __init__(self, pack, backend, tile_format="jpg", image_quality=0.95,
+                 link_uniform=False):
+        TileWriter.__init__(self, backend, tile_format=tile_format,
+                            image_quality=image_quality,
+                            link_uniform=link_uniform)
+        self.pack = pack
+
+    def _publish(self, tile_path, data, canonical_path=None):
+        if canonical_path is not None:
+            self.pack.link(_get_tile_key(tile_path),
+                           _get_tile_key(canonical_path))
+            return True
+        self.pack.add(_get_tile_key(tile_path), data)
+        return False
+
+
 class DZIDescriptor(object):
+    """Describes a Deep Zoom image and the geometry of its tile grid. The
+    dimensions and tile counts of every level, and the tile edges of each
+    level, are worked out in integers once, on first use, and looked up from
+    then on; changing the size or tiling of the descriptor throws them away."""
+    __slots__ = ("_width", "_height", "_tile_size", "_tile_overlap",
+                 "tile_format", "_levels", "_edges")
+
     def __init__(self, width=None, height=None,
                  tile_size=256, tile_overlap=1, tile_format="jpg"):
-        self.width = width
-        self.height = height
-        self.tile_size = tile_size
-        self.tile_overlap = tile_overlap
+        self._width = width
+        self._height = height
+        self._tile_size = tile_size
+        self._tile_overlap = tile_overlap
         self.tile_format = tile_format
-        self._num_levels = None
+        self._levels = self._edges = None
 
-    def open(self, source):
-        """Intialize descriptor from an existing descriptor file."""
-        doc = xml.dom.minidom.parse(source)
-        image = doc.getElementsByTagName("Image")[0]
-        size = doc.getElementsByTagName("Size")[0]
+    def __getstate__(self):
+        # the level tables are left out, they're quickly made again
+        return (self._width, self._height, self._tile_size,
+                self._tile_overlap, self.tile_format)
 
-        self.width = int(size.getAttribute("Width"))
-        self.height = int(size.getAttribute("Height"))
-        self.tile_size = int(image.getAttribute("TileSize"))
-        self.tile_overlap = int(image.getAttribute("Overlap"))
-        self.tile_format = image.getAttribute("Format")
+    def __setstate__(self, state):
+        (self._width, self._height, self._tile_size, self._tile_overlap,
+         self.tile_format) = state
+        self._levels = self._edges = None
 
-    def save(self, destination):
-        """Save descriptor file."""
-        file = open(destination, "w")
+    def _get_setting(name):
+        def get(self):
+            return getattr(self, name)
+        def set(self, value):
+            setattr(self, name, value)
+            self._levels = self._edges = None
+        return property(get, set)
+
+    width = _get_setting("_width")
+    height = _get_setting("_height")
+    tile_size = _get_setting("_tile_size")
+    tile_overlap = _get_setting("_tile_overlap")
+    del _get_setting
+
+    def open(self, source):
+        """Intialize descriptor from an existing descriptor file, given as a
+        path or a file object. Use read_descriptor() to share descriptors
+        that were already read."""
+        if hasattr(source, "read"):
+            data = source.read()
+        else:
+            with open(source, "rb") as descriptor_file:
+                data = descriptor_file.read()
+        (self._width, self._height, self._tile_size, self._tile_overlap,
+         self.tile_format) = _parse_descriptor(data)
+        self._levels = self._edges = None
 
+    def save(self, destination):
+        """Save descriptor file. It is written under a temporary name and
+        renamed into place, so readers never see it half written and the
+        descriptor cache tells the new file from the old one."""
         doc = xml.dom.minidom.Document()
         image = doc.createElementNS(NS_DEEPZOOM, "Image")
         image.setAttribute("xmlns", NS_DEEPZOOM)
@@ -96,54 +869,229 @@ class DZIDescriptor(object):
         descriptor = doc.toxml()#(encoding="UTF-8")
 #        descriptor = doc.toprettyxml(indent="    ", encoding="UTF-8")
 
-        file.write(descriptor)
-        file.close()
+        temp_path = "%s.%s-%s.tmp" % (destination, os.getpid(),
+                                      threading.current_thread().ident)
+        try:
+            with open(temp_path, "w") as file:
+                file.write(descriptor)
+            _replace(temp_path, destination)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _get_levels(self):
+        """Returns the table of levels, ((width, height), (columns, rows))
+        for each, making it first if need be."""
+        if self._levels is None:
+            # the number of halvings, rounded up, that bring the largest
+            # side down to a single pixel
+            max_level = (max(self._width, self._height) - 1).bit_length()
+            size = self._tile_size
+            levels = []
+            for level in range(max_level + 1):
+                halvings = max_level - level
+                width = (self._width + (1 << halvings) - 1) >> halvings
+                height = (self._height + (1 << halvings) - 1) >> halvings
+                levels.append(((width, height),
+                               (-(-width // size), -(-height // size))))
+            self._levels = levels
+            self._edges = [None] * len(levels)
+        return self._levels
+
+    def _get_level(self, level):
+        if level < 0:
+            raise AssertionError("Invalid pyramid level")
+        try:
+            return self._get_levels()[level]
+        except IndexError:
+            raise AssertionError("Invalid pyramid level")
+
+    def _get_level_edges(self, level):
+        """Returns ([(x1, x2)] of each column, [(y1, y2)] of each row) of the
+        tiles of a level, making them first if need be."""
+        # checks the level, and makes the tables, before indexing them
+        width, height = self._get_level(level)[0]
+        edges = self._edges[level]
+        if edges is None:
+            edges = self._edges[level] = (self._get_edges(width),
+                                          self._get_edges(height))
+        return edges
+
+    def _get_edges(self, length):
+        """Returns the (start, end) of each tile along a side of length."""
+        size, overlap = self._tile_size, self._tile_overlap
+        return [(start - overlap if start else 0,
+                 min(start + size + overlap, length))
+                for start in range(0, length, size)]
 
     @property
     def num_levels(self):
         """Number of levels in the pyramid."""
-        if self._num_levels is None:
-            max_dimension = max(self.width, self.height)
-            self._num_levels = int(math.ceil(math.log(max_dimension, 2))) + 1
-        return self._num_levels
+        return len(self._get_levels())
 
     def get_scale(self, level):
         """Scale of a pyramid level."""
-        assert 0 <= level and level < self.num_levels, "Invalid pyramid level"
-        max_level = self.num_levels - 1
-        return math.pow(0.5, max_level - level)
+        self._get_level(level)
+        return math.pow(0.5, self.num_levels - 1 - level)
 
     def get_dimensions(self, level):
         """Dimensions of level (width, height)"""
-        assert 0 <= level and level < self.num_levels, "Invalid pyramid level"
-        scale = self.get_scale(level)
-        width = int(math.ceil(self.width * scale))
-        height = int(math.ceil(self.height * scale))
-        return (width, height)
+        return self._get_level(level)[0]
 
     def get_num_tiles(self, level):
         """Number of tiles (columns, rows)"""
-        assert 0 <= level and level < self.num_levels, "Invalid pyramid level"
-        w, h = self.get_dimensions( level )
-        return (int(math.ceil(float(w) / self.tile_size)),
-                int(math.ceil(float(h) / self.tile_size)))
+        return self._get_level(level)[1]
 
     def get_tile_bounds(self, level, column, row):
         """Bounding box of the tile (x1, y1, x2, y2)"""
-        assert 0 <= level and level < self.num_levels, "Invalid pyramid level"
+        column_edges, row_edges = self._get_level_edges(level)
+        if not (0 <= column < len(column_edges) and 0 <= row < len(row_edges)):
+            raise AssertionError("Invalid tile position")
+        x1, x2 = column_edges[column]
+        y1, y2 = row_edges[row]
+        return (x1, y1, x2, y2)
+
+
+def _parse_descriptor(data):
+    """Returns (width, height, tile_size, tile_overlap, tile_format) of the
+    XML of a descriptor, taken from its first Image and Size elements by a
+    streaming parser, without building a document."""
+    elements = {}
+    def _start_element(name, attributes):
+        if name in ("Image", "Size") and name not in elements:
+            elements[name] = attributes
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = _start_element
+    parser.Parse(data, True)
+    try:
+        image, size = elements["Image"], elements["Size"]
+        return (int(size["Width"]), int(size["Height"]),
+                int(image["TileSize"]), int(image["Overlap"]),
+                image.get("Format", ""))
+    except KeyError as err:
+        raise ValueError("Invalid descriptor, %s is missing" % err)
+
+
+class _CollectionFound(Exception):
+    pass
 
-        offset_x = 0 if column == 0 else self.tile_overlap
-        offset_y = 0 if row    == 0 else self.tile_overlap
-        x = (column * self.tile_size) - offset_x
-        y = (row    * self.tile_size) - offset_y
 
-        level_width, level_height = self.get_dimensions(level)
-        w = self.tile_size + (1 if column == 0 else 2) * self.tile_overlap
-        h = self.tile_size + (1 if row    == 0 else 2) * self.tile_overlap
-        w = min(w, level_width  - x)
-        h = min(h, level_height - y)
+def _read_collection_header(file):
+    """Returns (attributes, header) of the Collection element a collection
+    descriptor file starts with, header being the bytes of the file up to
+    the end of its start tag. The streaming parser stops there, so the
+    items after it are never read."""
+    found = []
+    def _start_element(name, attributes):
+        found.append((name, attributes, parser.CurrentByteIndex))
+        raise _CollectionFound()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = _start_element
+    data = b""
+    while not found:
+        chunk = file.read(4096)
+        data += chunk
+        try:
+            parser.Parse(chunk, not chunk)
+        except _CollectionFound:
+            pass
+        except ExpatError as err:
+            raise ValueError("Invalid collection, %s" % err)
+        if not chunk and not found:
+            raise ValueError("Invalid collection, Collection is missing")
+    name, attributes, start = found[0]
+    if name != "Collection":
+        raise ValueError("Invalid collection, it starts with %s" % name)
+    end = data.find(b">", start)
+    while end < 0:
+        chunk = file.read(4096)
+        if not chunk:
+            raise ValueError("Invalid collection, Collection is cut short")
+        data += chunk
+        end = data.find(b">", start)
+    return (attributes, data[:end + 1])
 
-        return (x, y, x + w, y + h)
+
+class DescriptorCache(object):
+    """Keeps the descriptors of up to `max_entries` files, least recently
+    used ones going first. A descriptor is read again once the size,
+    modification time or inode of its file changes."""
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._descriptors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the descriptor of the file at path, reading it if it
+        isn't cached or changed since. Raises what opening it raises."""
+        stat = os.stat(path)
+        version = (getattr(stat, "st_mtime_ns", stat.st_mtime),
+                   stat.st_size, stat.st_ino)
+        with self._lock:
+            cached = self._descriptors.pop(path, None)
+            if cached is not None and cached[0] == version:
+                self._descriptors[path] = cached
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        descriptor = DZIDescriptor()
+        descriptor.open(path)
+        with self._lock:
+            self._descriptors[path] = (version, descriptor)
+            while len(self._descriptors) > self.max_entries:
+                self._descriptors.popitem(last=False)
+        return descriptor
+
+    def clear(self):
+        """Forgets every descriptor and resets the counters."""
+        with self._lock:
+            self._descriptors.clear()
+            self.hits = self.misses = 0
+
+
+descriptor_cache = DescriptorCache()
+
+
+def read_descriptor(path):
+    """Returns the descriptor of the Deep Zoom image at path from the
+    process-wide descriptor cache. It is shared by every caller, so treat it
+    as read-only."""
+    return descriptor_cache.get(path)
+
+
+def get_generation_path(destination):
+    """Returns the path of the generation file of the Deep Zoom image at
+    destination, next to its _files directory."""
+    return "%s_files.generation" % os.path.splitext(destination)[0]
+
+def read_generation(destination):
+    """Returns the generation of the Deep Zoom image at destination: the
+    fingerprint of the source its pyramid was last finished from, "" while
+    it is being created or updated, or None if no generation was recorded,
+    e.g. for pyramids made by older versions."""
+    try:
+        with open(get_generation_path(destination)) as file:
+            return file.read().strip()
+    except (IOError, OSError):
+        return None
+
+def write_generation(destination, generation=""):
+    """Records the generation of the Deep Zoom image at destination. The
+    default, an empty generation, marks its pyramid as unfinished."""
+    path = get_generation_path(destination)
+    temp_path = "%s.%s-%s.tmp" % (path, os.getpid(),
+                                  threading.current_thread().ident)
+    try:
+        with open(temp_path, "w") as file:
+            file.write(generation)
+        _replace(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 
 class Image(object):
@@ -159,8 +1107,18 @@ class Image(object):
 
 class ImageCreator(object):
     """Creates Deep Zoom images."""
+
+    # Side of the blocks update() compares the old and new sources in
+    diff_block_size = 64
+
+    # Seconds between calls of create()'s progress callback
+    progress_interval = 0.5
+
     def __init__(self, tile_size=256, tile_overlap=1, tile_format="jpg",
-                 image_quality=0.95, resize_filter=None):
+                 image_quality=0.95, resize_filter=None, pyramid_mode="cascade",
+                 workers=1, backend="pillow", scratch_dir=None,
+                 atomic_writes=False, link_uniform_tiles=False,
+                 tile_pack=False, scaled_decode=False):
         self.tile_size = int(tile_size)
         self.tile_format = tile_format
         self.tile_overlap = _clamp(int(tile_overlap), 0, 10)
@@ -168,17 +1126,117 @@ class ImageCreator(object):
         if not tile_format in image_format_map:
             self.tile_format = "jpg"
         self.resize_filter = resize_filter
+        self.pyramid_mode = pyramid_mode
+        if not pyramid_mode in pyramid_mode_map:
+            self.pyramid_mode = "cascade"
+        self.workers = max(int(workers), 1)
+        self.scratch_dir = scratch_dir
+        self.backend = get_backend(backend, scratch_dir)
+        self.atomic_writes = bool(atomic_writes)
+        self.link_uniform_tiles = bool(link_uniform_tiles)
+        self.tile_pack = bool(tile_pack)
+        self.scaled_decode = bool(scaled_decode)
+        self.source_reader = None
+        self.checkpoint = None
+        self.progress = None
+        self.cancel = None
 
     def get_image(self, level):
-        """Returns the bitmap image at the given level."""
+        """Returns the bitmap image at the given level, resized from the
+        smallest reduction of the source at least as big, if it holds any."""
         assert 0 <= level and level < self.descriptor.num_levels, "Invalid pyramid level"
         width, height = self.descriptor.get_dimensions(level)
         # don't transform to what we already have
         if self.descriptor.width == width and self.descriptor.height == height:
-            return self.image
+            return self.backend.load(self.image)
+        source_size = self._get_resize_source_size((width, height))
+        if source_size == (width, height):
+            return self.backend.load(self.source_reader.get_reduction(source_size))
+        image = self.image
+        if source_size != image.size:
+            image = self.source_reader.get_reduction(source_size)
+        return self.backend.load(image.resize((width, height),
+                                              self._get_resample()))
+
+    def _get_resize_source_size(self, size):
+        """Returns the size of the smallest reduction of the source at least
+        as big as size, or of the source itself if there is none."""
+        source_size = (self.descriptor.width, self.descriptor.height)
+        if not self._uses_reductions():
+            return source_size
+        for reduction_size in self.source_reader.reductions:
+            if (size[0] <= reduction_size[0] < source_size[0] and
+                    size[1] <= reduction_size[1] < source_size[1]):
+                source_size = reduction_size
+        return source_size
+
+    def _get_resample(self):
+        """Returns the Pillow filter for the configured resize filter. Levels
+        are only resized with it in "reference" mode; cascaded levels are
+        halved by the backend's box filter."""
         if (self.resize_filter is None) or (self.resize_filter not in resize_filter_map):
-            return self.image.resize((width, height), PILImage.ANTIALIAS)
-        return self.image.resize((width, height), resize_filter_map[self.resize_filter])
+            return PILImage.ANTIALIAS
+        return resize_filter_map[self.resize_filter]
+
+    def get_images(self):
+        """Iterator for the bitmap images of all levels, from the largest level
+        down. Returns (level, image). In "cascade" mode each level is reduced
+        from the one above it, so the full-resolution image is only read once,
+        or read from the source if it holds a reduction of the level's size;
+        in "reference" mode every level is resized from the full-resolution
+        image."""
+        max_level = self.descriptor.num_levels - 1
+        if self.pyramid_mode == "reference":
+            for level in range(max_level, -1, -1):
+                yield (level, self.get_image(level))
+            return
+        # hand the source over so it's released once the next level exists
+        level_image, self.image = self.backend.load(self.image), None
+        for level in range(max_level, -1, -1):
+            self._check_cancelled()
+            if level < max_level:
+                reduction = self._get_reduction(level)
+                if reduction is None:
+                    reduction = self._reduce(level_image)
+                level_image = reduction
+            yield (level, level_image)
+
+    def _uses_reductions(self):
+        """Whether levels are made of the source's reductions: stored ones
+        always, scaled ones with scaled_decode."""
+        return (self.source_reader is not None and
+                (self.scaled_decode or
+                 not self.source_reader.scaled_reductions))
+
+    def _has_reduction(self, level):
+        """Whether levels are made of the source's reductions and it holds
+        one of the size of a level."""
+        return (self._uses_reductions() and
+                self.descriptor.get_dimensions(level) in
+                self.source_reader.reductions)
+
+    def _get_reduction(self, level):
+        """Returns the source's reduction of the size of a level, as a level
+        image, or None if it holds none."""
+        if not self._has_reduction(level):
+            return None
+        return self.backend.load(self.source_reader.get_reduction(
+            self.descriptor.get_dimensions(level)))
+
+    def _reduce(self, image):
+        """Halves a level image into the level below it."""
+        return self.backend.reduce(image, self._get_resample())
+
+    def get_strips(self, source, strip_height):
+        """Iterator for horizontal strips of the source image, top to bottom,
+        read through the source's reader. Sources stored as several strips or
+        tiles (e.g. TIFF) are decoded a band at a time; anything else has to
+        be decoded whole, then sliced. The reader opened by create() is
+        reused for its own source."""
+        reader = self.source_reader
+        if reader is None or reader.source != source:
+            reader = get_source_reader(source)
+        return reader.get_strips(strip_height)
 
     def tiles(self, level):
         """Iterator for all tiles in the given level. Returns (column, row) of a tile."""
@@ -187,9 +1245,36 @@ class ImageCreator(object):
             for row in range(rows):
                 yield (column, row)
 
-    def create(self, source, destination):
-        """Creates Deep Zoom image from source file and saves it to destination."""
+    def create(self, source, destination, backend=None, resume=False,
+               progress=None, cancel=None):
+        """Creates Deep Zoom image from source file and saves it to destination.
+        A backend given here overrides the creator's backend for this call.
+        Progress is recorded in a checkpoint manifest next to the _files
+        directory until the image is finished; with resume=True, tiles an
+        interrupted run of the same source and settings finished are kept.
+        With tile_pack=True the tiles are written into a TilePack instead,
+        which is only put in place once finished and isn't resumed. The
+        source's fingerprint is recorded as the generation of the finished
+        pyramid (see read_generation); while tiles are rewritten in place
+        the pyramid is marked unfinished.
+
+        A progress callback is called with (level, tiles_done, tiles_total,
+        bytes_written, elapsed) as tiles are written, at most once every
+        progress_interval seconds (see Progress). A cancel token, such as a
+        threading.Event, is checked between tiles: once it is set, creation
+        stops, its tiles, checkpoint and any old descriptor are removed (an
+        unfinished pack is dropped, leaving the old one) and Cancelled is
+        raised."""
+        if backend is not None:
+            default_backend = self.backend
+            self.backend = get_backend(backend, self.scratch_dir)
+            try:
+                return self.create(source, destination, resume=resume,
+                                   progress=progress, cancel=cancel)
+            finally:
+                self.backend = default_backend
         self.image = PILImage.open(source)
+        self.source_reader = get_source_reader(source)
         width, height = self.image.size
         self.descriptor = DZIDescriptor(width=width,
                                         height=height,
@@ -199,104 +1284,830 @@ class ImageCreator(object):
         destination = _expand(destination)
         image_name = os.path.splitext(os.path.basename(destination))[0]
         dir_name = os.path.dirname(destination)
-        image_files = _ensure(os.path.join(_ensure(dir_name), "%s_files"%image_name))
+        image_files = os.path.join(_ensure(dir_name), "%s_files"%image_name)
+        self.tile_writer = self._get_tile_writer(image_files)
+        if not self.tile_pack:
+            _ensure(image_files)
+            if os.path.exists(image_files + ".pack"):
+                os.remove(image_files + ".pack")
+        self.checkpoint = None
+        fingerprint = self.get_fingerprint(source)
+        if not self.tile_pack:
+            # The tiles are rewritten in place; a pack is only replaced once
+            # it's finished.
+            write_generation(destination)
+        if fingerprint is not None and not self.tile_pack:
+            self.checkpoint = Checkpoint(os.path.join(dir_name,
+                                         "%s_files.checkpoint"%image_name),
+                                         fingerprint)
+            self.checkpoint.start(resume and self.checkpoint.load())
+        self.cancel = cancel
+        if progress is not None:
+            self.progress = Progress(progress, *self._count_tiles(),
+                                     interval=self.progress_interval)
 
         # Create tiles
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        finished = cancelled = False
+        try:
+            if self.pyramid_mode == "stream":
+                self.image = None
+                self._create_streamed(source, image_files, pool)
+            else:
+                for (level, level_image) in self.get_images():
+                    level_dir = self._get_level_dir(image_files, level)
+                    self._create_tiles(pool, level_image, level, level_dir,
+                                       self.tiles(level))
+                    self._finish_level(level)
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+            self._finish_tiles()
+
+            # Create descriptor
+            self.descriptor.save(destination)
+            write_generation(destination, fingerprint or "")
+            finished = True
+        except Cancelled:
+            cancelled = True
+            raise
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if not finished:
+                self._abort_tiles()
+            if self.checkpoint is not None:
+                self.checkpoint.close(finished or cancelled)
+            if cancelled:
+                self._discard_tiles(image_files, destination)
+            self.progress = self.cancel = None
+
+    def _count_tiles(self):
+        """Returns (tiles_total, tiles_done) of the pyramid, counting the
+        tiles the checkpoint has as finished as done."""
+        tiles_total = tiles_done = 0
         for level in range(self.descriptor.num_levels):
-            level_dir = _ensure(os.path.join(image_files, str(level)))
-            level_image = self.get_image(level)
-            for (column, row) in self.tiles(level):
-                bounds = self.descriptor.get_tile_bounds(level, column, row)
-                tile = level_image.crop(bounds)
-                format = self.descriptor.tile_format
-                tile_path = os.path.join(level_dir,
-                                         "%s_%s.%s"%(column, row, format))
-                tile_file = open(tile_path, "wb")
-                if self.descriptor.tile_format == "jpg":
-                    tile.save(tile_file, "JPEG",
-                              quality=int(self.image_quality * 100))
-                tile.save(tile_file)
-
-        # Create descriptor
+            columns, rows = self.descriptor.get_num_tiles(level)
+            tiles_total += columns * rows
+            if self.checkpoint is not None:
+                if level in self.checkpoint.levels:
+                    tiles_done += columns * rows
+                else:
+                    tiles_done += len(self.checkpoint.tiles.get(level, ()))
+        return (tiles_total, tiles_done)
+
+    def _check_cancelled(self):
+        """Raises Cancelled if the cancel token is set."""
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled()
+
+    def _discard_tiles(self, image_files, destination):
+        """Removes the tiles of a cancelled create(), and the descriptor and
+        generation of the pyramid they were replacing. A pack is left alone,
+        since an unfinished one is never put in place."""
+        if self.tile_pack:
+            return
+        shutil.rmtree(image_files, ignore_errors=True)
+        for path in (destination, get_generation_path(destination)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_tile_writer(self, image_files, append=False):
+        """Returns the writer of the tiles in image_files: a TileWriter, or a
+        PackWriter of its TilePack, appending to it if append, in pack mode."""
+        if not self.tile_pack:
+            return TileWriter(self.backend,
+                              tile_format=self.descriptor.tile_format,
+                              image_quality=self.image_quality,
+                              atomic=self.atomic_writes,
+                              link_uniform=self.link_uniform_tiles)
+        pack = TilePack(image_files + ".pack", self.descriptor.tile_format)
+        pack.start(append)
+        return PackWriter(pack, self.backend,
+                          tile_format=self.descriptor.tile_format,
+                          image_quality=self.image_quality,
+                          link_uniform=self.link_uniform_tiles)
+
+    def _get_level_dir(self, image_files, level):
+        """Returns the directory of a level's tiles, creating it unless the
+        tiles go into a pack."""
+        level_dir = os.path.join(image_files, str(level))
+        if self.tile_pack:
+            return level_dir
+        return _ensure(level_dir)
+
+    def _finish_tiles(self):
+        """Puts the pack the tiles were written into in place, if any."""
+        if isinstance(self.tile_writer, PackWriter):
+            self.tile_writer.pack.finish()
+
+    def _abort_tiles(self):
+        """Drops an unfinished pack of tiles, if any."""
+        if isinstance(self.tile_writer, PackWriter):
+            self.tile_writer.pack.abort()
+
+    def create_descriptor(self, source, destination):
+        """Saves the descriptor of the Deep Zoom image of source to destination
+        without creating any tiles, for serving tiles with create_single_tile
+        as they are asked for."""
+        self.image = PILImage.open(source)
+        width, height = self.image.size
+        self.image = None
+        self.descriptor = DZIDescriptor(width=width,
+                                        height=height,
+                                        tile_size=self.tile_size,
+                                        tile_overlap=self.tile_overlap,
+                                        tile_format=self.tile_format)
+        destination = _expand(destination)
+        image_name = os.path.splitext(os.path.basename(destination))[0]
+        dir_name = os.path.dirname(destination)
+        _ensure(os.path.join(_ensure(dir_name), "%s_files"%image_name))
         self.descriptor.save(destination)
+        write_generation(destination, self.get_fingerprint(source) or "")
+
+    def create_single_tile(self, source, destination, level, column, row,
+                           level_cache=None, cache_key=None):
+        """Creates one tile of the Deep Zoom image of source at destination,
+        straight from the region of the source it covers. Outside "reference"
+        mode the region is halved just like the whole image would be, so the
+        tile is the same as create() makes. The tile is written atomically.
+        Returns its path, or None if the image has no such tile.
+
+        Given a level_cache, an object with get(key), set(key, value, nbytes)
+        and max_bytes such as an LRUCache, whole level images are kept in it
+        under (cache_key, fingerprint, level) and the tile is cropped out of
+        its level instead, as long as the level fits in the cache. With the
+        source's fingerprint in the key, levels of a source since replaced
+        are never used."""
+        image = PILImage.open(source)
+        reader = self.source_reader = get_source_reader(source)
+        width, height = image.size
+        self.descriptor = DZIDescriptor(width=width,
+                                        height=height,
+                                        tile_size=self.tile_size,
+                                        tile_overlap=self.tile_overlap,
+                                        tile_format=self.tile_format)
+        if not 0 <= level < self.descriptor.num_levels:
+            return None
+        columns, rows = self.descriptor.get_num_tiles(level)
+        if not (0 <= column < columns and 0 <= row < rows):
+            return None
+        x1, y1, x2, y2 = self.descriptor.get_tile_bounds(level, column, row)
+        level_image = None
+        if level_cache is not None:
+            level_image = self._get_cached_level(image, level, level_cache,
+                                                 cache_key,
+                                                 self.get_fingerprint(source))
+        if level_image is not None:
+            bounds = (x1, y1, x2, y2)
+        elif self.pyramid_mode == "reference":
+            level_width, level_height = self.descriptor.get_dimensions(level)
+            source_size = self._get_resize_source_size((level_width,
+                                                        level_height))
+            x_scale = float(source_size[0]) / level_width
+            y_scale = float(source_size[1]) / level_height
+            box = (x1 * x_scale, y1 * y_scale, x2 * x_scale, y2 * y_scale)
+            # Only read the source pixels the resize filter reaches, which
+            # are at most 3 level pixels past the box
+            margin = int(math.ceil(3 * max(x_scale, y_scale))) + 2
+            left = max(int(box[0]) - margin, 0)
+            top = max(int(box[1]) - margin, 0)
+            region = reader.read_region((left, top,
+                                         min(int(box[2]) + margin,
+                                             source_size[0]),
+                                         min(int(box[3]) + margin,
+                                             source_size[1])),
+                                        source_size)
+            region = region.resize((x2 - x1, y2 - y1), self._get_resample(),
+                                   box=(box[0] - left, box[1] - top,
+                                        box[2] - left, box[3] - top))
+            level_image = self.backend.load(region)
+            bounds = (0, 0, x2 - x1, y2 - y1)
+        else:
+            # The region's edges fall on whole pixels of every level between
+            # the source, or the nearest reduction of a level above this one
+            # the source holds, and this one, so halving it gives the same
+            # pixels as create() does.
+            base = level
+            max_level = self.descriptor.num_levels - 1
+            while base < max_level and not self._has_reduction(base):
+                base += 1
+            halvings = base - level
+            scale = 2 ** halvings
+            base_width, base_height = self.descriptor.get_dimensions(base)
+            level_image = self.backend.load(reader.read_region(
+                (x1 * scale, y1 * scale, min(x2 * scale, base_width),
+                 min(y2 * scale, base_height)), (base_width, base_height)))
+            for _ in range(halvings):
+                level_image = self._reduce(level_image)
+            bounds = (0, 0, x2 - x1, y2 - y1)
+        image = None
+        tile = self.backend.get_tile(level_image, bounds)
+
+        destination = _expand(destination)
+        image_name = os.path.splitext(os.path.basename(destination))[0]
+        level_dir = _ensure(os.path.join(_ensure(os.path.join(
+            os.path.dirname(destination), "%s_files"%image_name)), str(level)))
+        tile_path = os.path.join(level_dir, "%s_%s.%s"%(column, row,
+                                                        self.descriptor.tile_format))
+        self.tile_writer = TileWriter(self.backend,
+                                      tile_format=self.descriptor.tile_format,
+                                      image_quality=self.image_quality,
+                                      atomic=True)
+        self.tile_writer.write(tile, tile_path)
+        return tile_path
+
+    def _get_cached_level(self, image, level, level_cache, cache_key,
+                          fingerprint):
+        """Returns a level image from level_cache, first making and caching it
+        from the nearest cached level above it or reduction the source holds,
+        or else from the source image, if need be. Levels are cached under
+        (cache_key, fingerprint, level). Returns None if the level is too big
+        for the cache."""
+        width, height = self.descriptor.get_dimensions(level)
+        if width * height * len(image.getbands()) > level_cache.max_bytes:
+            return None
+        level_image = level_cache.get((cache_key, fingerprint, level))
+        if level_image is not None:
+            return level_image
+        max_level = self.descriptor.num_levels - 1
+        if self.pyramid_mode == "reference":
+            self.image = image
+            level_image = self.get_image(level)
+            self.image = None
+            level_cache.set((cache_key, fingerprint, level), level_image,
+                            self.backend.get_nbytes(level_image))
+            return level_image
+
+        above = level
+        level_image = self._get_reduction(level)
+        cached = False
+        while level_image is None and above < max_level:
+            above += 1
+            level_image = level_cache.get((cache_key, fingerprint, above))
+            cached = level_image is not None
+            if not cached:
+                level_image = self._get_reduction(above)
+        if level_image is None:
+            level_image = self.backend.load(image)
+        if not cached:
+            level_cache.set((cache_key, fingerprint, above), level_image,
+                            self.backend.get_nbytes(level_image))
+        while above > level:
+            level_image = self._reduce(level_image)
+            above -= 1
+            level_cache.set((cache_key, fingerprint, above), level_image,
+                            self.backend.get_nbytes(level_image))
+        return level_image
+
+    def get_fingerprint(self, source):
+        """Returns a digest of the source file and the settings its tiles
+        depend on, which changes whenever the pyramid would, or None if
+        source isn't a file on disk."""
+        try:
+            stat = os.stat(source)
+        except (TypeError, OSError):
+            return None
+        # Nanosecond times and the inode tell apart a file replaced by one
+        # of the same size within the same second
+        settings = (stat.st_size,
+                    getattr(stat, "st_mtime_ns", stat.st_mtime),
+                    stat.st_ino, self.tile_size,
+                    self.tile_overlap, self.tile_format, self.image_quality,
+                    self.resize_filter, self.pyramid_mode == "reference")
+        if self.scaled_decode:
+            settings += ("scaled_decode",)
+        return hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()
+
+    def _finish_level(self, level):
+        """Records a level as finished in the checkpoint, if there is one."""
+        if self.checkpoint is not None:
+            self.checkpoint.finish_level(level)
+
+    def update(self, previous_source, source, destination):
+        """Updates the Deep Zoom image at destination, created from
+        previous_source, to show source instead. Only the tiles covering
+        pixels that differ between the two are rewritten; the rest of the
+        pyramid is kept as it is. Falls back to create(), after removing
+        the old tiles, when the sources differ in size or the pyramid was
+        made with other tile settings. Like create(), marks the pyramid
+        unfinished while tiles are rewritten and records its generation once
+        it's done. Returns the number of tiles written."""
+        destination = _expand(destination)
+        image_name = os.path.splitext(os.path.basename(destination))[0]
+        image_files = os.path.join(os.path.dirname(destination),
+                                   "%s_files"%image_name)
+        self.image = PILImage.open(source)
+        self.source_reader = get_source_reader(source)
+        width, height = self.image.size
+        self.descriptor = DZIDescriptor(width=width,
+                                        height=height,
+                                        tile_size=self.tile_size,
+                                        tile_overlap=self.tile_overlap,
+                                        tile_format=self.tile_format)
+        if self.tile_pack:
+            existing = os.path.isfile(image_files + ".pack")
+        else:
+            existing = os.path.isdir(image_files)
+        previous = PILImage.open(previous_source)
+        if (previous.size != self.image.size or not existing
+                or not self._matches_descriptor(destination)):
+            # None of the old tiles belong to the new pyramid
+            shutil.rmtree(image_files, ignore_errors=True)
+            if os.path.isfile(image_files + ".pack"):
+                os.remove(image_files + ".pack")
+            self.create(source, destination)
+            return self.tile_writer.tiles_written
+        regions = self.get_changed_regions(previous, self.image)
+        previous = None
+        self.checkpoint = None
+        fingerprint = self.get_fingerprint(source)
+        if not regions:
+            write_generation(destination, fingerprint or "")
+            return 0
+        write_generation(destination)
+        self.tile_writer = self._get_tile_writer(image_files, append=True)
+
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        finished = False
+        try:
+            for (level, level_image) in self.get_images():
+                level_dir = self._get_level_dir(image_files, level)
+                positions = sorted(self.get_changed_tiles(level, regions))
+                self._create_tiles(pool, level_image, level, level_dir,
+                                   positions)
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+            self._finish_tiles()
+            write_generation(destination, fingerprint or "")
+            finished = True
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if not finished:
+                self._abort_tiles()
+        return self.tile_writer.tiles_written
+
+    def _matches_descriptor(self, destination):
+        """Whether the descriptor at destination describes the pyramid this
+        creator would make of the current image."""
+        try:
+            existing = read_descriptor(destination)
+        except (IOError, OSError, ExpatError, IndexError, ValueError):
+            return False
+        return ((existing.width, existing.height, existing.tile_size,
+                 existing.tile_overlap, existing.tile_format) ==
+                (self.descriptor.width, self.descriptor.height,
+                 self.descriptor.tile_size, self.descriptor.tile_overlap,
+                 self.descriptor.tile_format))
+
+    def get_changed_regions(self, previous, image):
+        """Returns the boxes (x1, y1, x2, y2) of the full-resolution image
+        holding pixels that differ between previous and image, compared
+        block by block in blocks of diff_block_size pixels."""
+        difference = ImageChops.difference(previous.convert("RGBA"),
+                                           image.convert("RGBA"))
+        bands = difference.split()
+        mask = bands[0]
+        for band in bands[1:]:
+            mask = ImageChops.lighter(mask, band)
+        changed = mask.getbbox()
+        if changed is None:
+            return []
+        block = self.diff_block_size
+        regions = []
+        for y in range(changed[1] - changed[1] % block, changed[3], block):
+            for x in range(changed[0] - changed[0] % block, changed[2], block):
+                box = mask.crop((x, y, x + block, y + block)).getbbox()
+                if box is not None:
+                    regions.append((x + box[0], y + box[1],
+                                    x + box[2], y + box[3]))
+        return regions
+
+    def get_changed_tiles(self, level, regions):
+        """Returns the set of tiles, (column, row), of a level whose pixels
+        depend on any of the full-resolution regions."""
+        scale = 2 ** (self.descriptor.num_levels - 1 - level)
+        # a level pixel is the box average of the scale x scale pixels above
+        # it, except in "reference" mode, where the resize filter reaches a
+        # few pixels further
+        margin = 3 if self.pyramid_mode == "reference" else 0
+        width, height = self.descriptor.get_dimensions(level)
+        columns, rows = self.descriptor.get_num_tiles(level)
+        size, overlap = self.tile_size, self.tile_overlap
+        tiles = set()
+        for (x1, y1, x2, y2) in regions:
+            x1 = max(x1 // scale - margin, 0)
+            y1 = max(y1 // scale - margin, 0)
+            x2 = min(-(-x2 // scale) + margin, width)
+            y2 = min(-(-y2 // scale) + margin, height)
+            for column in range(max((x1 - overlap) // size, 0),
+                                min((x2 - 1 + overlap) // size, columns - 1) + 1):
+                for row in range(max((y1 - overlap) // size, 0),
+                                 min((y2 - 1 + overlap) // size, rows - 1) + 1):
+                    tiles.add((column, row))
+        return tiles
+
+    def _create_streamed(self, source, image_files, pool):
+        """Creates the tiles of all levels from horizontal strips of the
+        source, holding only a band about one tile row high per level."""
+        bands = None
+        for level in range(self.descriptor.num_levels):
+            level_dir = self._get_level_dir(image_files, level)
+            bands = _LevelBand(self, level, level_dir, bands)
+        for strip in self.get_strips(source, self.tile_size):
+            bands.push(self.backend.load(strip), pool)
+
+    def _create_tiles(self, pool, level_image, level, level_dir, positions, top=0):
+        """Creates the tiles at positions, (column, row), from a level image
+        whose first row is row `top` of the level. Tiles the checkpoint has
+        as finished are skipped."""
+        checkpoint = self.checkpoint
+        progress = self.progress
+        if checkpoint is not None:
+            positions = (position for position in positions
+                         if not checkpoint.is_done(level, position))
+        def _create_tile(position):
+            self._check_cancelled()
+            column, row = position
+            nbytes = self.create_tile(level_image, level, column, row,
+                                      level_dir, top)
+            if checkpoint is not None:
+                checkpoint.add(level, position)
+            if progress is not None:
+                progress.add(level, nbytes)
+        if pool is None:
+            for position in positions:
+                _create_tile(position)
+            return
+        # Only the (column, row) pairs are queued; each worker crops,
+        # encodes and writes one tile at a time, so no more than
+        # `workers` tiles are ever held in memory at once. Once a tile
+        # fails, the tiles still queued are skipped and the caller
+        # terminates the pool.
+        failed = []
+        def _create_queued_tile(position):
+            if failed:
+                return
+            try:
+                _create_tile(position)
+            except BaseException:
+                failed.append(position)
+                raise
+        for _ in pool.imap_unordered(_create_queued_tile, positions,
+                                     chunksize=16):
+            pass
+
+    def create_tile(self, level_image, level, column, row, level_dir, top=0):
+        """Crops a tile out of the level image and saves it to level_dir.
+        Returns bytes written."""
+        x1, y1, x2, y2 = self.descriptor.get_tile_bounds(level, column, row)
+        tile = self.backend.get_tile(level_image, (x1, y1 - top, x2, y2 - top))
+        format = self.descriptor.tile_format
+        tile_path = os.path.join(level_dir,
+                                 "%s_%s.%s"%(column, row, format))
+        return self.tile_writer.write(tile, tile_path)
+
+
+class _LevelBand(object):
+    """Rolling band of rows of one pyramid level, used in "stream" mode.
+    Rows are pushed in from the level above (or the source), written out as
+    soon as a tile row is complete, halved into the level below in pairs
+    and dropped once neither needs them any more."""
+    def __init__(self, creator, level, level_dir, below=None):
+        self.creator = creator
+        self.level = level
+        self.level_dir = level_dir
+        self.below = below
+        self.width, self.height = creator.descriptor.get_dimensions(level)
+        self.columns, self.rows = creator.descriptor.get_num_tiles(level)
+        self.image = None
+        self.top = 0      # level row of the first buffered row
+        self.row = 0      # next tile row to write
+        self.reduced = 0  # next level row to halve into the level below
+
+    def push(self, strip, pool=None):
+        """Appends the next rows of the level and passes on what it can."""
+        backend = self.creator.backend
+        if self.image is None:
+            self.image = strip
+        else:
+            self.image = backend.join_rows(self.image, strip)
+        bottom = self.top + backend.get_size(self.image)[1]
+        descriptor = self.creator.descriptor
+
+        # Write every tile row that is now complete
+        while self.row < self.rows:
+            if descriptor.get_tile_bounds(self.level, 0, self.row)[3] > bottom:
+                break
+            positions = [(column, self.row) for column in range(self.columns)]
+            self.creator._create_tiles(pool, self.image, self.level,
+                                       self.level_dir, positions, self.top)
+            self.row += 1
+            if self.row == self.rows:
+                self.creator._finish_level(self.level)
+
+        # Halve whole pairs of rows (and a trailing odd row) into the level below
+        if self.below is not None:
+            end = bottom
+            if bottom < self.height:
+                end -= (bottom - self.reduced) % 2
+            if end > self.reduced:
+                rows = backend.get_rows(self.image, self.reduced - self.top,
+                                       end - self.top)
+                self.reduced = end
+                self.below.push(self.creator._reduce(rows), pool)
+
+        # Drop the rows neither the next tile row nor the level below needs
+        keep = bottom
+        if self.row < self.rows:
+            keep = descriptor.get_tile_bounds(self.level, 0, self.row)[1]
+        if self.below is not None:
+            keep = min(keep, self.reduced)
+        if keep >= bottom:
+            self.image = None
+            self.top = bottom
+        elif keep > self.top:
+            self.image = backend.get_rows(self.image, keep - self.top,
+                                         bottom - self.top)
+            self.top = keep
+
+
+# Morton (Z-order) codec tables: _MORTON_SPREAD[b] is the byte b with its
+# bits spread out to the even bits of 16, and _MORTON_COMPACT[b] the
+# (column, row) nibbles of the interleaved bits of the byte b.
+_MORTON_SPREAD = [sum(((b >> i) & 1) << (2 * i) for i in range(8))
+                  for b in range(256)]
+_MORTON_COMPACT = [(sum(((b >> (2 * i)) & 1) << i for i in range(4)),
+                    sum(((b >> (2 * i + 1)) & 1) << i for i in range(4)))
+                   for b in range(256)]
+
+def morton_encode(column, row):
+    """Returns the Z-order (Morton number) of a position, the bits of column
+    and row interleaved, a byte of each at a time."""
+    z_order = 0
+    shift = 0
+    while column or row:
+        z_order |= (_MORTON_SPREAD[column & 0xff] |
+                    _MORTON_SPREAD[row & 0xff] << 1) << shift
+        column >>= 8
+        row >>= 8
+        shift += 16
+    return z_order
+
+def morton_decode(z_order):
+    """Returns the position (column, row) of a Z-order (Morton number), a
+    byte of it at a time."""
+    column = row = 0
+    shift = 0
+    while z_order:
+        column_bits, row_bits = _MORTON_COMPACT[z_order & 0xff]
+        column |= column_bits << shift
+        row |= row_bits << shift
+        z_order >>= 8
+        shift += 4
+    return column, row
+
+def morton_decode_array(z_orders):
+    """Returns the positions of an array of Z-orders below 2**64 as arrays of
+    (columns, rows), decoded all at once with NumPy."""
+    z_orders = numpy.asarray(z_orders, dtype=numpy.uint64)
+    return (_compact_bits(z_orders), _compact_bits(z_orders >> numpy.uint64(1)))
+
+def _compact_bits(bits):
+    """Gathers the even bits of an array of 64-bit integers."""
+    bits = bits & numpy.uint64(0x5555555555555555)
+    for (shift, mask) in ((1, 0x3333333333333333), (2, 0x0f0f0f0f0f0f0f0f),
+                          (4, 0x00ff00ff00ff00ff), (8, 0x0000ffff0000ffff),
+                          (16, 0x00000000ffffffff)):
+        bits = (bits | (bits >> numpy.uint64(shift))) & numpy.uint64(mask)
+    return bits
 
 
 class CollectionCreator(object):
     """Creates Deep Zoom collections."""
     def __init__(self, image_quality=0.95, tile_size=256,
-                 max_level=8, tile_format="jpg", copy_metadata=True):
+                 max_level=8, tile_format="jpg", copy_metadata=True,
+                 backend="pillow", workers=1):
         self.image_quality = image_quality
         self.tile_size = tile_size
         self.max_level = max_level
         self.tile_format = tile_format
         self.copy_metadata = copy_metadata #unused
+        self.workers = max(int(workers), 1)
+        self.backend = get_backend(backend)
+        self.tile_writer = TileWriter(self.backend, tile_format=tile_format,
+                                      image_quality=image_quality)
+
+    # Collections of at least this many items are laid out with NumPy
+    batch_positions = 1024
+    # Tiles are handed to workers in shards of about this many items
+    shard_items = 256
 
     def _get_position(self, z_order):
         """Returns position (column, row) from given Z-order (Morton number.)"""
-        column = 0
-        row = 0
-        for i in range(0, 32, 2):
-            offset = i / 2
-            # column
-            column_offset = i
-            column_mask = 1 << column_offset
-            column_value = (z_order & column_mask) >> column_offset
-            column |= column_value << offset
-            #row
-            row_offset = i + 1
-            row_mask = 1 << row_offset
-            row_value = (z_order & row_mask) >> row_offset
-            row |= row_value << offset
-        return int(column), int(row)
+        return morton_decode(z_order)
 
     def _get_z_order(self, column, row):
         """Returns the Z-order (Morton number) from given position."""
-        z_order = 0
-        for i in range(32):
-            z_order |= (column & 1 << i) << i | (row & 1 << i) << (i + 1)
-        return z_order
+        return morton_encode(column, row)
+
+    def _get_positions(self, z_orders):
+        """Returns the positions of a list of Z-orders as (columns, rows),
+        decoded in one go into NumPy arrays for long lists where NumPy is
+        installed, else into lists."""
+        if numpy is None or len(z_orders) < self.batch_positions:
+            positions = [morton_decode(z_order) for z_order in z_orders]
+            return ([column for (column, row) in positions],
+                    [row for (column, row) in positions])
+        columns, rows = morton_decode_array(z_orders)
+        return (columns.astype(numpy.int64), rows.astype(numpy.int64))
 
     def _get_tile_position(self, z_order, level, tile_size):
         level_size = 2**level
         x, y = self._get_position(z_order)
-        return (int(math.floor((x * level_size) / tile_size)),
-                int(math.floor((y * level_size) / tile_size)))
+        return ((x * level_size) // tile_size, (y * level_size) // tile_size)
 
     def create(self, images, destination):
         """Creates a Deep Zoom collection from a list of images."""
         self._create_pyramid(images, destination)
         self._create_descriptor(images, destination)
 
-    def _create_pyramid(self, images, destination):
-        """Creates a Deep Zoom collection pyramid from a list of images."""
+    def append(self, images, destination):
+        """Appends a list of images to the Deep Zoom collection at
+        destination, creating it if there is none. The new items take the
+        Z-orders from the collection's NextItemId on, only the tiles they
+        fall in are composited again, and their items are spliced into the
+        descriptor, so the cost goes with the number of images appended
+        rather than the size of the collection. Raises ValueError if the
+        collection was made with another tile size, max level or format."""
+        if not os.path.exists(destination):
+            self.create(images, destination)
+            return
+        with open(destination, "rb") as file:
+            attributes, header = _read_collection_header(file)
+        for (name, value) in (("MaxLevel", self.max_level),
+                              ("TileSize", self.tile_size),
+                              ("Format", self.tile_format)):
+            if attributes.get(name) != str(value):
+                raise ValueError("Collection %s is %s, not %s" %
+                                 (name, attributes.get(name), value))
+        try:
+            next_item_id = int(attributes["NextItemId"])
+        except (KeyError, ValueError):
+            raise ValueError("Invalid collection, NextItemId is missing")
+        self._create_pyramid(images, destination, next_item_id)
+        self._append_descriptor(images, destination, header, next_item_id)
+
+    def _create_pyramid(self, images, destination, first_item=0):
+        """Creates a Deep Zoom collection pyramid from a list of images. The
+        items of each tile are pasted into it in memory, so every tile is
+        encoded once, no matter how many items it holds. Tiles don't depend
+        on one another, so shards of them are built by a pool of workers
+        where there is more than one; each tile is still written by exactly
+        one worker from its items in Z-order, so the output is the same."""
         pyramid_path = os.path.splitext(destination)[0] + "_files"
         if not os.path.exists(pyramid_path):
             os.mkdir(pyramid_path)
-
         for level in range(self.max_level + 1):
-            level_size = 2**level
             level_path = pyramid_path + "/" + str(level)
             if not os.path.exists(level_path):
                 os.mkdir(level_path)
 
-            for i in range(len(images)):
-                path = images[i]
-                descriptor = DZIDescriptor()
-                descriptor.open(path)
-                column, row = self._get_tile_position(i, level, self.tile_size)
+        shards = self._get_shards(images, pyramid_path, first_item)
+        if self.workers == 1:
+            for shard in shards:
+                self._create_shard(shard)
+            return
+        pool = ThreadPool(self.workers)
+        try:
+            for _ in pool.imap_unordered(self._create_shard, shards):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_shards(self, images, pyramid_path, first_item=0):
+        """Yields the tiles of a collection pyramid level by level, in
+        shards: lists of (tile_path, sources) holding about `shard_items`
+        items in all, sources being [(source_path, (x, y))] in Z-order.
+        The images are the items from Z-order first_item on."""
+        images = [None] * first_item + list(images)
+        descriptors = [None] * first_item + [read_descriptor(path)
+                                             for path in images[first_item:]]
+        items = list(range(first_item, len(images)))
+        positions = self._get_positions(items)
+        shard = []
+        shard_size = 0
+        for level in range(self.max_level + 1):
+            level_path = pyramid_path + "/" + str(level)
+            tiles = self._get_level_tiles(level, items, positions)
+            for (column, row) in sorted(tiles):
                 tile_path = level_path + "/%s_%s.%s"%(column, row, self.tile_format)
-                if not os.path.exists(tile_path):
-                    tile_image = PILImage.new("RGB", (self.tile_size, self.tile_size))
-                    tile_image.save(tile_path, "JPEG", quality=int(self.image_quality * 100))
-                tile_image = PILImage.open(tile_path)
-                source_path = open(os.path.splitext(path)[0] + "_files/" + str(level) + "/%s_%s.%s"%(0, 0, descriptor.tile_format))
-                source_image = PILImage.open(source_path)
-                images_per_tile = int(math.floor(self.tile_size / level_size))
-                column, row = self._get_position(i)
-                x = (column % images_per_tile) * level_size
-                y = (row % images_per_tile) * level_size
-                tile_image.paste(source_image, (x,y))
-                tile_image.save(tile_path)
+                sources = [(self._get_source_path(images[i], descriptors[i], level),
+                            offset) for (i, offset) in tiles[(column, row)]]
+                shard.append((tile_path, sources))
+                shard_size += len(sources)
+                if shard_size >= self.shard_items:
+                    yield shard
+                    shard = []
+                    shard_size = 0
+        if shard:
+            yield shard
+
+    def _create_shard(self, shard):
+        """Creates a shard of collection tiles, first decoding every
+        thumbnail they need once, then compositing and encoding each."""
+        thumbnails = {}
+        for (tile_path, sources) in shard:
+            for (source_path, offset) in sources:
+                if source_path not in thumbnails:
+                    thumbnail = self.backend.decode(source_path)
+                    thumbnail.load()
+                    thumbnails[source_path] = thumbnail
+        for (tile_path, sources) in shard:
+            self._save_tile(self._composite_tile(tile_path, sources, thumbnails),
+                            tile_path)
+
+    def _get_level_tiles(self, level, items, positions):
+        """Returns {(column, row): [(item, (x, y))]}, the items, by their
+        Z-order, each tile of a level holds and where in the tile they go,
+        in order, given the positions of the items as (columns, rows)."""
+        level_size = 2**level
+        tile_size = self.tile_size
+        images_per_tile = tile_size // level_size
+        columns, rows = positions
+        if numpy is not None and isinstance(columns, numpy.ndarray):
+            return self._get_level_tiles_batch(level_size, images_per_tile,
+                                               items, columns, rows)
+        tiles = {}
+        for (i, column, row) in zip(items, columns, rows):
+            position = ((column * level_size) // tile_size,
+                        (row * level_size) // tile_size)
+            offset = ((column % images_per_tile) * level_size,
+                      (row % images_per_tile) * level_size)
+            tiles.setdefault(position, []).append((i, offset))
+        return tiles
+
+    def _get_level_tiles_batch(self, level_size, images_per_tile, items,
+                               columns, rows):
+        """_get_level_tiles() for positions in NumPy arrays: the tiles and
+        offsets of all items are worked out at once, and the items sorted
+        by tile, keeping their order within each tile."""
+        items = numpy.asarray(items, dtype=numpy.int64)
+        tile_columns = columns * level_size // self.tile_size
+        tile_rows = rows * level_size // self.tile_size
+        xs = (columns % images_per_tile) * level_size
+        ys = (rows % images_per_tile) * level_size
+        keys = tile_rows * (int(tile_columns.max()) + 1) + tile_columns
+        order = numpy.argsort(keys, kind="mergesort")
+        tiles = {}
+        entries = None
+        last_key = None
+        for (key, column, row, i, x, y) in zip(keys[order].tolist(),
+                                               tile_columns[order].tolist(),
+                                               tile_rows[order].tolist(),
+                                               items[order].tolist(),
+                                               xs[order].tolist(),
+                                               ys[order].tolist()):
+            if key != last_key:
+                last_key = key
+                entries = tiles[(column, row)] = []
+            entries.append((i, (x, y)))
+        return tiles
+
+    def _get_source_path(self, path, descriptor, level):
+        """Returns the path of the tile of an item's own pyramid that is its
+        thumbnail at a level of the collection."""
+        return os.path.splitext(path)[0] + "_files/" + str(level) + \
+            "/%s_%s.%s"%(0, 0, descriptor.tile_format)
+
+    def _composite_tile(self, tile_path, sources, thumbnails=None):
+        """Returns a collection tile with the thumbnails at sources, a list
+        of (source_path, (x, y)), pasted in turn onto the tile already at
+        tile_path, or onto a black one. Thumbnails already decoded may be
+        given as {source_path: image}."""
+        if os.path.exists(tile_path):
+            tile_image = self.backend.decode(tile_path)
+            tile_image.load()
+        else:
+            tile_image = PILImage.new("RGB", (self.tile_size, self.tile_size))
+        for (source_path, offset) in sources:
+            if thumbnails is not None and source_path in thumbnails:
+                thumbnail = thumbnails[source_path]
+            else:
+                thumbnail = self.backend.decode(source_path)
+            tile_image.paste(thumbnail, offset)
+        return tile_image
+
+    def _save_tile(self, tile_image, tile_path):
+        """Encodes a collection tile to tile_path."""
+        self.tile_writer.write(tile_image, tile_path)
 
     def _create_descriptor(self, images, destination):
         """Creates a Deep Zoom collection descriptor from a list of images."""
@@ -312,25 +2123,7 @@ class CollectionCreator(object):
 
         next_item_id = 0
         for path in images:
-            descriptor = DZIDescriptor()
-            descriptor.open(path)
-            id = next_item_id
-            n = next_item_id
-            source = path # relative path
-            width = descriptor.width
-            height = descriptor.height
-
-            item = doc.createElementNS(NS_DEEPZOOM, "I")
-            item.setAttribute("Id", str(id))
-            item.setAttribute("N", str(n))
-            item.setAttribute("Source", str(source))
-
-            size = doc.createElementNS(NS_DEEPZOOM, "Size")
-            size.setAttribute("Width", str(width))
-            size.setAttribute("Height", str(height))
-            item.appendChild(size)
-
-            items.appendChild(item)
+            items.appendChild(self._create_item(doc, next_item_id, path))
             next_item_id += 1
 
         collection.setAttribute("NextItemId", str(next_item_id))
@@ -340,10 +2133,80 @@ class CollectionCreator(object):
 
         descriptor = doc.toxml(encoding="UTF-8")
 #        descriptor = doc.toprettyxml(indent="  ", encoding="UTF-8")
-        file = open(destination, "w")
+        file = open(destination, "wb")
         file.write(descriptor)
         file.close()
 
+    def _create_item(self, doc, item_id, path):
+        """Returns the I element of the collection item item_id, the image
+        at path."""
+        descriptor = read_descriptor(path)
+        id = item_id
+        n = item_id
+        source = path # relative path
+        width = descriptor.width
+        height = descriptor.height
+
+        item = doc.createElementNS(NS_DEEPZOOM, "I")
+        item.setAttribute("Id", str(id))
+        item.setAttribute("N", str(n))
+        item.setAttribute("Source", str(source))
+
+        size = doc.createElementNS(NS_DEEPZOOM, "Size")
+        size.setAttribute("Width", str(width))
+        size.setAttribute("Height", str(height))
+        item.appendChild(size)
+        return item
+
+    def _append_descriptor(self, images, destination, header, first_item):
+        """Rewrites the collection descriptor at destination, which starts
+        with header, the bytes up to the end of its Collection start tag,
+        with the items of images, from first_item on, added at the end of
+        its Items. The existing items are copied over as they are, not
+        parsed, and the new descriptor renamed into place."""
+        doc = xml.dom.minidom.Document()
+        new_items = b"".join(self._create_item(doc, first_item + i, path)
+                             .toxml(encoding="UTF-8")
+                             for (i, path) in enumerate(images))
+        next_item_id = first_item + len(images)
+        start = header.index(b'NextItemId="') + len(b'NextItemId="')
+        end = header.index(b'"', start)
+        new_header = header[:start] + str(next_item_id).encode("ascii") + \
+            header[end:]
+
+        size = os.path.getsize(destination)
+        temp_path = "%s.%s-%s.tmp" % (destination, os.getpid(),
+                                      threading.current_thread().ident)
+        try:
+            with open(destination, "rb") as file:
+                # The items end near the end of the file, followed by
+                # just the end of the collection
+                tail_start = max(size - 4096, len(header))
+                file.seek(tail_start)
+                tail = file.read()
+                items_tag = b"</Items>"
+                items_end = tail.rfind(items_tag)
+                if items_end >= 0:
+                    new_items += items_tag
+                else:
+                    items_tag = b"<Items/>"
+                    items_end = tail.rfind(items_tag)
+                    if items_end < 0:
+                        raise ValueError("Invalid collection, Items is missing")
+                    new_items = b"<Items>" + new_items + b"</Items>"
+                with open(temp_path, "wb") as temp_file:
+                    temp_file.write(new_header)
+                    file.seek(len(header))
+                    _copy_bytes(file, temp_file,
+                                tail_start + items_end - len(header))
+                    temp_file.write(new_items)
+                    temp_file.write(tail[items_end + len(items_tag):])
+            _replace(temp_path, destination)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
 
 ################################################################################
 
@@ -355,6 +2218,90 @@ def _ensure(d):
         os.mkdir(d)
     return d
 
+def _halve(pixels):
+    """Averages the 2x2 blocks of an array of rows."""
+    height, width = pixels.shape[:2]
+    even_height, even_width = height - height % 2, width - width % 2
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    sums = pixels.reshape((height, width, channels)).astype(numpy.uint32)
+    halved = numpy.empty(((height + 1) // 2, (width + 1) // 2, channels),
+                         numpy.uint32)
+    blocks = sums[:even_height, :even_width].reshape(
+                even_height // 2, 2, even_width // 2, 2, channels)
+    halved[:even_height // 2, :even_width // 2] = \
+        (blocks.sum(axis=(1, 3)) + 2) // 4
+    if width % 2:
+        edge = sums[:even_height, -1]
+        halved[:even_height // 2, -1] = (edge[0::2] + edge[1::2] + 1) // 2
+    if height % 2:
+        edge = sums[-1, :even_width]
+        halved[-1, :even_width // 2] = (edge[0::2] + edge[1::2] + 1) // 2
+    if width % 2 and height % 2:
+        halved[-1, -1] = sums[-1, -1]
+    return halved.astype(pixels.dtype).reshape(halved.shape[:2]
+                                               + pixels.shape[2:])
+
+def _write_file(path, data):
+    # Replace rather than truncate an existing file: it may be a hard link
+    # shared with other tiles.
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    try:
+        fd = os.open(path, flags, 0o666)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+        os.remove(path)
+        fd = os.open(path, flags, 0o666)
+    try:
+        written = os.write(fd, data)
+        while written < len(data):
+            written += os.write(fd, data[written:])
+    finally:
+        os.close(fd)
+
+def _copy_bytes(source, destination, length):
+    """Copies length bytes from file source to file destination."""
+    while length > 0:
+        data = source.read(min(length, 1 << 20))
+        if not data:
+            raise IOError("%s is cut short" % getattr(source, "name", "File"))
+        destination.write(data)
+        length -= len(data)
+
+def _convert_to_rgb(image):
+    """Returns image converted to RGBA if it has transparency, else to RGB."""
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+def _link_file(source, path):
+    """Hard links path to source. Returns False where that isn't possible."""
+    if not hasattr(os, "link"):
+        return False
+    try:
+        os.link(source, path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            return False
+        os.remove(path)
+        return _link_file(source, path)
+    return True
+
+def _get_tile_key(tile_path):
+    """Returns (level, column, row) of the tile at `<level>/<column>_<row>.<format>`."""
+    level = int(os.path.basename(os.path.dirname(tile_path)))
+    column, row = os.path.splitext(os.path.basename(tile_path))[0].split("_")
+    return (level, int(column), int(row))
+
+# os.rename won't replace an existing file on Windows
+_replace = getattr(os, "replace", os.rename)
+
+def _set_size(image, size):
+    # Pillow 5.3+ keeps the size in `_size` behind a read-only property
+    if hasattr(image, "_size"):
+        image._size = size
+    else:
+        image.size = size
+
 def _clamp(val, min, max):
     if val < min:
         return min
@@ -382,6 +2329,37 @@ def main():
     parser.add_option("-r", "--resize_filter", dest="resize_filter", default="antialias",
                       help="Type of filter for resizing (bicubic, nearest, \
                             bilinear, antialias (best). Default: antialias")
+    parser.add_option("-m", "--pyramid_mode", dest="pyramid_mode", default="cascade",
+                      help="How levels are derived (cascade: halve each level \
+                            from the one above it, reference: resize every \
+                            level from the source, stream: cascade through \
+                            horizontal strips of the source). Default: cascade")
+    parser.add_option("-b", "--backend", dest="backend", default="pillow",
+                      help="Backend resampling and encoding the levels \
+                            (pillow, numpy or a registered one). Default: pillow")
+    parser.add_option("-t", "--scratch_dir", dest="scratch_dir", default=None,
+                      help="Directory of scratch files backing the levels \
+                            (numpy backend only). Default: none, levels are \
+                            kept in memory")
+    parser.add_option("-a", "--atomic_writes", dest="atomic_writes",
+                      action="store_true", default=False,
+                      help="Write each tile under a temporary name and \
+                            rename it into place.")
+    parser.add_option("-u", "--link_uniform_tiles", dest="link_uniform_tiles",
+                      action="store_true", default=False,
+                      help="Encode tiles of a single colour once and hard \
+                            link the rest to it.")
+    parser.add_option("-k", "--tile_pack", dest="tile_pack",
+                      action="store_true", default=False,
+                      help="Write all tiles into a single indexed pack file \
+                            instead of a file per tile.")
+    parser.add_option("-j", "--scaled_decode", dest="scaled_decode",
+                      action="store_true", default=False,
+                      help="Decode JPEG sources at 1/2, 1/4 and 1/8 scale \
+                            for the levels of those sizes.")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=1, help="Number of threads cropping, encoding \
+                                       and writing tiles. Default: 1")
 
     (options, args) = parser.parse_args()
 
@@ -402,7 +2380,15 @@ def main():
     creator = ImageCreator(tile_size=options.tile_size,
                            tile_format=options.tile_format,
                            image_quality=options.image_quality,
-                           resize_filter=options.resize_filter)
+                           resize_filter=options.resize_filter,
+                           pyramid_mode=options.pyramid_mode,
+                           workers=options.workers,
+                           backend=options.backend,
+                           scratch_dir=options.scratch_dir,
+                           atomic_writes=options.atomic_writes,
+                           link_uniform_tiles=options.link_uniform_tiles,
+                           tile_pack=options.tile_pack,
+                           scaled_decode=options.scaled_decode)
     creator.create(source, options.destination)
 
 if __name__ == "__main__":
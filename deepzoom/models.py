@@ -11,12 +11,24 @@ import logging
 import six
 
 from .mixins import ModelDiffMixin
+from .utils import SingleFlight
+from .cache import get_level_cache, forget_deepzoom
 from . import deepzoom
 
 
 
 logger = logging.getLogger("deepzoom.models")
 
+#Coalesces concurrent requests for a deep zoom tile that is not yet created.
+tile_renders = SingleFlight()
+
+
+def lazy_tiles_enabled():
+    """
+    Returns whether deepzoom tiles are created on request instead of on save.
+    """
+    return getattr(settings, 'DEEPZOOM_LAZY_TILES', False) is True
+
 
 class DeepZoom(ModelDiffMixin, models.Model):
     '''
@@ -46,7 +58,15 @@ class DeepZoom(ModelDiffMixin, models.Model):
                                'tile_overlap': 1,
                                'tile_format': "jpg",
                                'image_quality': 0.85,
-                               'resize_filter': "antialias"}
+                               'resize_filter': "antialias",
+                               'pyramid_mode': "cascade",
+                               'workers': 1,
+                               'backend': "pillow",
+                               'scratch_dir': None,
+                               'atomic_writes': False,
+                               'link_uniform_tiles': False,
+                               'tile_pack': False,
+                               'scaled_decode': False}
     
     
     name = models.CharField(max_length=128,
@@ -79,10 +99,9 @@ class DeepZoom(ModelDiffMixin, models.Model):
         return dz_params.get(dz_param, self.DEFAULT_DEEPZOOM_PARAMS[dz_param])
     
     
-    def create_deepzoom_files(self):
+    def get_deepzoom_creator(self):
         """
-        Creates deepzoom image from associated uploaded image.
-        Attempts to load `DEEPZOOM_PARAMS` and `DEEPZOOM_ROOT` from settings.
+        Returns a deep zoom creator initialized from `DEEPZOOM_PARAMS`.
         Substitutues default settings for any missing settings.
         """
         
@@ -102,13 +121,40 @@ class DeepZoom(ModelDiffMixin, models.Model):
         _tile_format = self.get_dz_param('tile_format', dz_params)
         _image_quality = self.get_dz_param('image_quality', dz_params)
         _resize_filter = self.get_dz_param('resize_filter', dz_params)
+        _pyramid_mode = self.get_dz_param('pyramid_mode', dz_params)
+        _workers = self.get_dz_param('workers', dz_params)
+        _backend = self.get_dz_param('backend', dz_params)
+        _scratch_dir = self.get_dz_param('scratch_dir', dz_params)
+        _atomic_writes = self.get_dz_param('atomic_writes', dz_params)
+        _link_uniform_tiles = self.get_dz_param('link_uniform_tiles', dz_params)
+        _tile_pack = self.get_dz_param('tile_pack', dz_params)
+        _scaled_decode = self.get_dz_param('scaled_decode', dz_params)
         
         #Initialize deep zoom creator.
         creator = deepzoom.ImageCreator(tile_size=_tile_size, 
                                         tile_overlap=_tile_overlap, 
                                         tile_format=_tile_format, 
                                         image_quality=_image_quality, 
-                                        resize_filter=_resize_filter)
+                                        resize_filter=_resize_filter, 
+                                        pyramid_mode=_pyramid_mode, 
+                                        workers=_workers, 
+                                        backend=_backend, 
+                                        scratch_dir=_scratch_dir, 
+                                        atomic_writes=_atomic_writes, 
+                                        link_uniform_tiles=_link_uniform_tiles, 
+                                        tile_pack=_tile_pack, 
+                                        scaled_decode=_scaled_decode)
+        return creator
+    
+    
+    def create_deepzoom_files(self, progress=None, cancel=None):
+        """
+        Creates deepzoom image from associated uploaded image.
+        Attempts to load `DEEPZOOM_PARAMS` and `DEEPZOOM_ROOT` from settings.
+        Substitutues default settings for any missing settings.
+        Forwards a `progress` callback and a `cancel` token to the creator.
+        """
+        creator = self.get_deepzoom_creator()
         
         #Try to load deep zoom root, otherwise assign default value.
         try:
@@ -141,8 +187,14 @@ class DeepZoom(ModelDiffMixin, models.Model):
         dz_associated_image = os.path.join(media_root, self.associated_image)
         
         #Process deep zoom image and save to file system.
+        #Only save the descriptor if tiles are created on request.
         try:
-            creator.create(dz_associated_image, dz_absolute_filename)
+            if lazy_tiles_enabled():
+                creator.create_descriptor(dz_associated_image, 
+                                          dz_absolute_filename)
+            else:
+                creator.create(dz_associated_image, dz_absolute_filename, 
+                               resume=True, progress=progress, cancel=cancel)
         except OSError as err:
             print("OS error({0}): {1}".format(err.errno, err.strerror))
         except IOError as err:
@@ -154,12 +206,125 @@ class DeepZoom(ModelDiffMixin, models.Model):
         return(dz_relative_filename, dz_relative_filepath)
     
     
+    def update_deepzoom_files(self, previous_image_path=None):
+        """
+        Updates deepzoom image files in place after the associated uploaded 
+        image was replaced, rewriting only the tiles covering changed pixels.
+        Regenerates all files if the replaced image differs in size, or if 
+        the update fails part way; errors regenerating them are raised.
+        """
+        creator = self.get_deepzoom_creator()
+        dz_absolute_filename = os.path.join(settings.MEDIA_ROOT, 
+                                            self.deepzoom_image)
+        dz_associated_image = os.path.join(settings.MEDIA_ROOT, 
+                                           self.associated_image)
+        #Keep tiles read from here on out of the caches until it's done.
+        deepzoom.write_generation(dz_absolute_filename)
+        forget_deepzoom(self.slug)
+        
+        #Process changed tiles and save them to file system.
+        #Drop all tiles instead if tiles are created on request.
+        try:
+            if lazy_tiles_enabled():
+                shutil.rmtree(self.get_deepzoom_files_path(), 
+                              ignore_errors=True)
+                if os.path.isfile(self.get_deepzoom_pack_path()):
+                    os.remove(self.get_deepzoom_pack_path())
+                creator.create_descriptor(dz_associated_image, 
+                                          dz_absolute_filename)
+            else:
+                try:
+                    creator.update(previous_image_path, dz_associated_image, 
+                                   dz_absolute_filename)
+                except (OSError, IOError):
+                    #Don't leave old and new tiles mixed: regenerate them all.
+                    logger.exception("Deep zoom update failed, recreating!")
+                    creator.create(dz_associated_image, dz_absolute_filename)
+        except:
+            print("Unexpected deep zoom update error:", sys.exc_info())
+            raise
+        finally:
+            #Drop tiles cached from the files while they were rewritten.
+            forget_deepzoom(self.slug)
+    
+    
+    def get_deepzoom_files_path(self):
+        """
+        Returns the absolute path of the deepzoom tile files directory.
+        """
+        return os.path.join(settings.MEDIA_ROOT, 
+                            os.path.splitext(self.deepzoom_image)[0] + "_files")
+    
+    
+    def get_deepzoom_pack_path(self):
+        """
+        Returns the absolute path of the deepzoom tile pack file, which holds 
+        the tiles in place of the tile files directory if `tile_pack` is set.
+        """
+        return self.get_deepzoom_files_path() + ".pack"
+    
+    
+    def get_deepzoom_descriptor(self):
+        """
+        Returns the parsed deepzoom descriptor file, shared through the 
+        process-wide descriptor cache until the file changes.
+        """
+        return deepzoom.read_descriptor(os.path.join(settings.MEDIA_ROOT, 
+                                                     self.deepzoom_image))
+    
+    
+    def get_fingerprint(self):
+        """
+        Returns a digest identifying the current generation of deepzoom tiles,
+        recorded when they were last created or updated, or None while they 
+        are being created or updated.  Deepzooms made before generations were 
+        recorded fall back to a digest of the associated uploaded image and 
+        `DEEPZOOM_PARAMS`, which is None if the uploaded image is missing.
+        """
+        generation = deepzoom.read_generation(
+            os.path.join(settings.MEDIA_ROOT, self.deepzoom_image))
+        if generation is not None:
+            return generation or None
+        creator = self.get_deepzoom_creator()
+        return creator.get_fingerprint(os.path.join(settings.MEDIA_ROOT,
+                                                    self.associated_image))
+    
+    
+    def get_deepzoom_tile(self, level, column, row, tile_format):
+        """
+        Returns the absolute path of a deepzoom tile file, creating the tile 
+        from the associated uploaded image first if it does not exist yet.
+        Concurrent requests for the same missing tile create it only once.
+        Returns None if the deepzoom has no such tile.
+        """
+        tile_path = os.path.join(self.get_deepzoom_files_path(), str(level), 
+                                 "%s_%s.%s" % (column, row, tile_format))
+        if os.path.isfile(tile_path):
+            return tile_path
+        
+        creator = self.get_deepzoom_creator()
+        if tile_format != creator.tile_format:
+            return None
+        dz_absolute_filename = os.path.join(settings.MEDIA_ROOT, 
+                                            self.deepzoom_image)
+        dz_associated_image = os.path.join(settings.MEDIA_ROOT, 
+                                           self.associated_image)
+        level_cache = get_level_cache()
+        if not level_cache.max_bytes:
+            level_cache = None
+        return tile_renders.do(tile_path, creator.create_single_tile, 
+                               dz_associated_image, dz_absolute_filename, 
+                               level, column, row, 
+                               level_cache=level_cache, cache_key=self.slug)
+    
+    
     def delete_deepzoom_files(self):
         """
         Deletes file tree for an entire deepzoom image from storage.
         Ignores any errors from operation.
         """
         _deepzooom_path = os.path.join(settings.MEDIA_ROOT, self.deepzoom_path)
+        forget_deepzoom(self.slug)
         try:
             shutil.rmtree(_deepzooom_path, ignore_errors=True)
         except:
@@ -273,6 +438,61 @@ class UploadedImage(ModelDiffMixin, models.Model):
         return dz
     
     
+    def save(self, *args, **kwargs):
+        """
+        Saves uploaded image.  If saving fails, an image file set aside for 
+        updating the deep zoom in place is put back where it was.
+        """
+        try:
+            super(UploadedImage, self).save(*args, **kwargs)
+        except:
+            previous_image_path = getattr(self, 'previous_image_path', None)
+            if previous_image_path is not None:
+                self.previous_image_path = None
+                self.restore_image_file(previous_image_path)
+            raise
+    
+    
+    def update_deepzoom_image(self, previous_image_path=None):
+        """
+        Updates associated deep zoom image files in place from the replaced 
+        uploaded image, then deletes the replaced image file.  The replaced 
+        image file is kept if the update fails, so it can be retried.
+        """
+        dz = self.associated_deepzoom
+        dz.associated_image = self.uploaded_image.name
+        dz.save()
+        dz.update_deepzoom_files(previous_image_path)
+        self.delete_image_file(previous_image_path)
+        return dz
+    
+    
+    def set_aside_image_file(self, path_of_image_to_set_aside=None):
+        """
+        Moves a replaced uploaded image file out of the way of its replacement,
+        keeping it for comparison.  Returns its new path, or None if it could 
+        not be moved.
+        """
+        set_aside_path = path_of_image_to_set_aside + ".previous"
+        try:
+            os.rename(path_of_image_to_set_aside, set_aside_path)
+        except OSError:
+            logger.exception("Image file set aside failed!")
+            return None
+        return set_aside_path
+    
+    
+    def restore_image_file(self, set_aside_path=None):
+        """
+        Moves an image file set aside by set_aside_image_file() back to its 
+        original path.
+        """
+        try:
+            os.rename(set_aside_path, set_aside_path[:-len(".previous")])
+        except OSError:
+            logger.exception("Image file restore failed!")
+    
+    
     def delete_image_file(self, path_of_image_to_delete=None):
         """
         Deletes uploaded image file from storage.
@@ -1,5 +1,6 @@
 '''django-deepzoom signals'''
 
+from django.conf import settings
 from django.dispatch import receiver
 from django.db.models.signals import pre_save, post_save, pre_delete
 
@@ -21,17 +22,33 @@ from .utils import receiver_subclasses, is_django_version_greater_than
 DJANGO_SAVE_UPDATEABLE = is_django_version_greater_than(1, 4)
 
 
+def incremental_updates_enabled():
+    """
+    Returns whether replaced uploaded images update their deepzoom in place.
+    """
+    return getattr(settings, 'DEEPZOOM_INCREMENTAL_UPDATES', False) is True
+
+
 @receiver_subclasses(pre_save, sender=UploadedImage, _dispatch_uid="d__ui_a_dz")
 def delete__uploadedimage_and_deepzoom(instance, **kwargs):
     """
     If image already exists, but new image uploaded, delete existing image file.
     If deepzoom image is associated with previous uploaded image, delete it.
+    With incremental updates enabled, set the existing image file aside and 
+    keep the deepzoom image for updating in place instead.
     """
     uploaded_field_changed = ('uploaded_image' in instance.changed_fields)
     
     if uploaded_field_changed:
         previous_image = instance.get_field_diff('uploaded_image')[0]
         if previous_image:
+            if (instance.associated_deepzoom is not None and 
+                incremental_updates_enabled()):
+                instance.previous_image_path = \
+                    instance.set_aside_image_file(previous_image.path)
+                if instance.previous_image_path is not None:
+                    instance.create_deepzoom = False
+                    return
             instance.delete_image_file(previous_image.path)
             if (instance.associated_deepzoom is not None):
                 instance.associated_deepzoom.delete()
@@ -53,11 +70,16 @@ def create_update__deepzoom(instance, created, **kwargs):
     """
     Kicks off deepzoom creation sequence by creating a deepzoom instance.
     Associates image to deepzoom with returned deepzoom reference.
+    Updates a kept deepzoom in place from the image file set aside for it.
     """
     uploaded_field_changed = ('uploaded_image' in instance.changed_fields)
     create_deepzoom_changed = ('create_deepzoom' in instance.changed_fields)
+    previous_image_path = getattr(instance, 'previous_image_path', None)
     
-    if instance.create_deepzoom:
+    if previous_image_path is not None:
+        instance.previous_image_path = None
+        instance.update_deepzoom_image(previous_image_path)
+    elif instance.create_deepzoom:
         if (created or uploaded_field_changed or create_deepzoom_changed):
             dz = instance.create_deepzoom_image()
             instance.associated_deepzoom = dz
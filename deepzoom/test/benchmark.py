@@ -0,0 +1,545 @@
+'''django-deepzoom benchmark
+
+Measures the performance of `ImageCreator.create()` and
+`CollectionCreator.create()` over a matrix of fixtures and settings, reporting
+for every case its wall time, CPU time, peak RSS, tiles per second and bytes
+written.  Results can be saved as JSON and compared against the results of an
+earlier run, the baseline; the run fails if any case got slower or bigger than
+the baseline allows.
+
+Every case runs in a process of its own, so peak RSS is the case's own, and is
+repeated to keep the fastest run.  Fixtures are generated once into the
+fixtures directory and reused by later runs.
+
+Usage, from the directory holding the deepzoom package:
+
+    python -m deepzoom.test.benchmark --profile quick --output baseline.json
+    python -m deepzoom.test.benchmark --profile quick --baseline baseline.json
+'''
+
+from __future__ import print_function
+
+import json
+import math
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PIL import Image as PILImage
+
+from deepzoom import deepzoom
+
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+
+TEST_DATA = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                         'test_data')
+
+PHOTO_FIXTURE = os.path.join(TEST_DATA, 'test_img_LANDSCAPE.jpg')
+
+# Format of the source files of each synthetic fixture: photos are JPEG,
+# smooth gradients PNG and incompressible noise uncompressed TIFF.
+FIXTURE_FORMATS = {'photo': 'jpg', 'gradient': 'png', 'noise': 'tif'}
+
+# The settings every case starts from.  A profile then varies one setting at a
+# time over the values it lists, so each case differs from the base case in a
+# single setting.
+BASE_CASE = {'kind': 'image',
+             'fixture': 'photo',
+             'megapixels': 1,
+             'aspect': '4:3',
+             'tile_size': 254,
+             'tile_overlap': 1,
+             'tile_format': 'jpg',
+             'resize_filter': 'antialias',
+             'pyramid_mode': 'cascade',
+             'workers': 1}
+
+PROFILES = {
+    'quick': {'fixture': ['photo', 'gradient', 'noise'],
+              'megapixels': [1, 4],
+              'aspect': ['4:3', '1:1', '8:1'],
+              'tile_size': [254, 510],
+              'tile_overlap': [0, 1, 4],
+              'tile_format': ['jpg', 'png'],
+              'resize_filter': ['nearest', 'bilinear', 'bicubic', 'antialias'],
+              'collection_items': [64],
+              'collection_workers': [1]},
+    'standard': {'fixture': ['photo', 'gradient', 'noise'],
+                 'megapixels': [1, 4, 16, 64],
+                 'aspect': ['4:3', '1:1', '16:9', '1:4', '8:1'],
+                 'tile_size': [126, 254, 510, 1022],
+                 'tile_overlap': [0, 1, 2, 4],
+                 'tile_format': ['jpg', 'png'],
+                 'resize_filter': ['nearest', 'bilinear', 'bicubic', 'antialias'],
+                 'pyramid_mode': ['cascade', 'reference', 'stream'],
+                 'collection_items': [64, 1000],
+                 'collection_workers': [1, 4]},
+    'full': {'fixture': ['photo', 'gradient', 'noise'],
+             'megapixels': [1, 4, 16, 64, 128, 256, 500],
+             'aspect': ['4:3', '1:1', '16:9', '1:4', '8:1'],
+             'tile_size': [126, 254, 510, 1022],
+             'tile_overlap': [0, 1, 2, 4],
+             'tile_format': ['jpg', 'png'],
+             'resize_filter': ['nearest', 'bilinear', 'bicubic', 'antialias'],
+             'pyramid_mode': ['cascade', 'reference', 'stream'],
+             'collection_items': [64, 1000, 10000, 100000],
+             'collection_workers': [1, 4]},
+    }
+
+DEFAULT_PROFILE = 'quick'
+
+# Number of distinct deep zooms the items of a collection case cycle through.
+COLLECTION_SOURCES = 16
+
+
+def get_cases(profile, megapixels=None):
+    """Returns the cases of a profile, optionally limited to fixtures of at
+    most megapixels, each a dictionary of settings including its 'id'."""
+    variations = PROFILES[profile]
+    cases = []
+    ids = set()
+    for setting in sorted(variations):
+        if setting.startswith('collection_'):
+            continue
+        for value in variations[setting]:
+            case = dict(BASE_CASE)
+            case[setting] = value
+            if megapixels is not None and case['megapixels'] > megapixels:
+                continue
+            case['id'] = get_case_id(case)
+            if case['id'] not in ids:
+                ids.add(case['id'])
+                cases.append(case)
+    for items in variations.get('collection_items', []):
+        for workers in variations.get('collection_workers', [1]):
+            case = {'kind': 'collection', 'items': items, 'tile_size': 256,
+                    'tile_format': 'jpg', 'workers': workers}
+            case['id'] = get_case_id(case)
+            cases.append(case)
+    return cases
+
+
+def get_case_id(case):
+    """Returns the name results of a case are kept under."""
+    if case['kind'] == 'collection':
+        return 'collection-%sitems-t%s-%s-w%s' % (
+            case['items'], case['tile_size'], case['tile_format'],
+            case['workers'])
+    if case['fixture'] in FIXTURE_FORMATS:
+        fixture = '%s-%smp-%s' % (case['fixture'], case['megapixels'],
+                                  case['aspect'].replace(':', 'x'))
+    else:
+        fixture = os.path.basename(case['fixture'])
+    return 'image-%s-t%s-o%s-%s-%s-%s-w%s' % (
+        fixture, case['tile_size'], case['tile_overlap'], case['tile_format'],
+        case['resize_filter'], case['pyramid_mode'], case['workers'])
+
+
+def get_fixture_size(megapixels, aspect):
+    """Returns (width, height) of a fixture of megapixels and aspect ('w:h')."""
+    aspect_width, aspect_height = [float(part) for part in aspect.split(':')]
+    pixels = megapixels * 1000000.0
+    width = int(round(math.sqrt(pixels * aspect_width / aspect_height)))
+    return (width, max(int(round(pixels / width)), 1))
+
+
+def get_fixture(fixtures_dir, fixture, megapixels, aspect):
+    """Returns the path of a fixture image, generating it if missing.  A
+    fixture that isn't synthetic is taken to be the path of an image."""
+    if fixture not in FIXTURE_FORMATS:
+        return fixture
+    width, height = get_fixture_size(megapixels, aspect)
+    path = os.path.join(fixtures_dir, '%s-%sx%s.%s' % (
+        fixture, width, height, FIXTURE_FORMATS[fixture]))
+    if not os.path.exists(path):
+        image = make_fixture(fixture, (width, height))
+        # write under a temporary name, so an interrupted run leaves no fixture
+        temp_path = path + '.tmp'
+        image.save(temp_path, format=image_format(path), quality=90)
+        os.rename(temp_path, path)
+    return path
+
+
+def image_format(path):
+    """Returns the Pillow format name for the extension of path."""
+    extension = os.path.splitext(path)[1].lower()
+    return {'.jpg': 'JPEG', '.png': 'PNG', '.tif': 'TIFF'}[extension]
+
+
+def make_fixture(fixture, size):
+    """Returns a synthetic RGB image of size: 'photo' is a real photograph
+    resized to size, 'gradient' smooth ramps and 'noise' random pixels, the
+    best and worst cases for tile compression."""
+    if fixture == 'photo':
+        return PILImage.open(PHOTO_FIXTURE).convert('RGB').resize(
+            size, PILImage.BICUBIC)
+    if fixture == 'gradient':
+        ramp = PILImage.linear_gradient('L')
+        bands = [ramp.resize(size, PILImage.BILINEAR),
+                 ramp.rotate(90).resize(size, PILImage.BILINEAR),
+                 PILImage.radial_gradient('L').resize(size, PILImage.BILINEAR)]
+        return PILImage.merge('RGB', bands)
+    # repeat a block of noise, generating a whole gigapixel of it is too slow
+    block = PILImage.merge('RGB', [PILImage.effect_noise((509, 509), sigma)
+                                   for sigma in (40, 60, 80)])
+    image = PILImage.new('RGB', size)
+    for y in range(0, size[1], block.size[1]):
+        for x in range(0, size[0], block.size[0]):
+            image.paste(block, (x, y))
+    return image
+
+
+def get_collection_fixture(fixtures_dir, tile_size, tile_format):
+    """Returns the paths of the distinct deep zooms collection cases are made
+    of, creating them if missing.  They are big enough for every level of a
+    collection."""
+    collection_dir = os.path.join(fixtures_dir, 'collection-t%s-%s' % (
+        tile_size, tile_format))
+    paths = [os.path.join(collection_dir, 'item%s.dzi' % i)
+             for i in range(COLLECTION_SOURCES)]
+    if all(os.path.exists(path) for path in paths):
+        return paths
+    if not os.path.exists(collection_dir):
+        os.makedirs(collection_dir)
+    photo = PILImage.open(PHOTO_FIXTURE).convert('RGB')
+    creator = deepzoom.ImageCreator(tile_size=tile_size, tile_overlap=0,
+                                    tile_format=tile_format)
+    for i, path in enumerate(paths):
+        image_path = os.path.splitext(path)[0] + '.png'
+        photo.rotate(i * 360.0 / len(paths)).resize((320, 240)).save(image_path)
+        creator.create(image_path, path)
+    return paths
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None
+    where it can't be told."""
+    # Linux carries ru_maxrss over exec, so it would count the parent's memory
+    # too; the high water mark in /proc is the process image's own
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure_output(destination):
+    """Returns (tiles, bytes) written for the deep zoom at destination."""
+    tiles = 0
+    nbytes = os.path.getsize(destination)
+    files_dir = os.path.splitext(destination)[0] + '_files'
+    if os.path.exists(files_dir + '.pack'):
+        pack = deepzoom.TilePack(files_dir + '.pack').open()
+        try:
+            tiles = len(pack.index)
+        finally:
+            pack.close()
+        return (tiles, nbytes + os.path.getsize(files_dir + '.pack'))
+    for root, dirs, files in os.walk(files_dir):
+        for name in files:
+            tiles += 1
+            nbytes += os.path.getsize(os.path.join(root, name))
+    return (tiles, nbytes)
+
+
+def run_case(case, fixtures_dir, work_dir):
+    """Runs a case once in this process and returns its measurements."""
+    if case['kind'] == 'collection':
+        sources = get_collection_fixture(fixtures_dir, case['tile_size'],
+                                         case['tile_format'])
+        images = [sources[i % len(sources)] for i in range(case['items'])]
+        destination = os.path.join(work_dir, 'collection.dxc')
+        creator = deepzoom.CollectionCreator(tile_size=case['tile_size'],
+                                             tile_format=case['tile_format'],
+                                             workers=case['workers'])
+        create = lambda: creator.create(images, destination)
+    else:
+        source = get_fixture(fixtures_dir, case['fixture'],
+                             case['megapixels'], case['aspect'])
+        destination = os.path.join(work_dir, 'image.dzi')
+        creator = deepzoom.ImageCreator(
+            tile_size=case['tile_size'], tile_overlap=case['tile_overlap'],
+            tile_format=case['tile_format'],
+            resize_filter=case['resize_filter'],
+            pyramid_mode=case['pyramid_mode'], workers=case['workers'])
+        create = lambda: creator.create(source, destination)
+
+    start_rss = get_peak_rss()
+    start_cpu = os.times()
+    start = timer()
+    create()
+    wall_time = timer() - start
+    end_cpu = os.times()
+    tiles, nbytes = measure_output(destination)
+    return {'wall_time': wall_time,
+            'cpu_time': (end_cpu[0] - start_cpu[0]) + (end_cpu[1] - start_cpu[1]),
+            'peak_rss': get_peak_rss(),
+            'start_rss': start_rss,
+            'tiles': tiles,
+            'tiles_per_second': tiles / wall_time if wall_time else None,
+            'bytes_written': nbytes}
+
+
+def spawn_case(case, fixtures_dir):
+    """Runs a case in a process of its own and returns its measurements, or
+    {'error': message} if it failed."""
+    work_dir = tempfile.mkdtemp(prefix='deepzoom-benchmark-')
+    package_root = os.path.dirname(os.path.dirname(
+        os.path.abspath(deepzoom.__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_root] + [path for path in [env.get('PYTHONPATH')] if path])
+    command = [sys.executable, '-m', 'deepzoom.test.benchmark',
+               '--run-case', json.dumps(case), '--fixtures', fixtures_dir,
+               '--work-dir', work_dir]
+    try:
+        process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, err = process.communicate()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if process.returncode != 0:
+        lines = err.decode('utf-8', 'replace').strip().splitlines()
+        return {'error': lines[-1] if lines else 'exit status %s' %
+                process.returncode}
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def run_benchmark(cases, fixtures_dir, repeat=3, report=None):
+    """Runs every case repeat times and returns its results, keeping the
+    fastest run of each case along with every run's wall time."""
+    results = []
+    for case in cases:
+        # generate fixtures up front, so they aren't timed or counted
+        if case['kind'] == 'collection':
+            get_collection_fixture(fixtures_dir, case['tile_size'],
+                                   case['tile_format'])
+        else:
+            get_fixture(fixtures_dir, case['fixture'], case['megapixels'],
+                        case['aspect'])
+        runs = [spawn_case(case, fixtures_dir) for i in range(repeat)]
+        errors = [run['error'] for run in runs if 'error' in run]
+        result = {'id': case['id'], 'case': case}
+        if errors:
+            result['error'] = errors[0]
+        else:
+            result.update(min(runs, key=lambda run: run['wall_time']))
+            result['wall_times'] = [run['wall_time'] for run in runs]
+        results.append(result)
+        if report is not None:
+            report(result)
+    return results
+
+
+def get_machine():
+    """Returns a description of the machine and software the run is on,
+    telling which baselines are comparable."""
+    return {'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': _get_cpu_count(),
+            'python': platform.python_version(),
+            'pillow': getattr(PILImage, '__version__',
+                              getattr(PILImage, 'PILLOW_VERSION', None))}
+
+
+def _get_cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def compare(results, baseline, time_tolerance=0.25, rss_tolerance=0.25,
+            time_slack=0.05):
+    """Compares results with those of a baseline run, case by case, and
+    returns a list of regressions, each a message.  A case regresses if it
+    is more than time_tolerance slower or rss_tolerance bigger in peak RSS
+    than in the baseline, writes a different number of tiles, or fails where
+    it didn't.  Slowdowns of less than time_slack seconds are timer noise
+    and never count."""
+    regressions = []
+    baseline_results = dict((result['id'], result)
+                            for result in baseline.get('results', []))
+    for result in results:
+        before = baseline_results.get(result['id'])
+        if before is None or 'error' in before:
+            continue
+        if 'error' in result:
+            regressions.append('%s: failed (%s)' % (result['id'],
+                                                    result['error']))
+            continue
+        if (result['wall_time'] > before['wall_time'] * (1 + time_tolerance)
+                and result['wall_time'] > before['wall_time'] + time_slack):
+            regressions.append('%s: wall time %.3fs, was %.3fs (%+.0f%%)' % (
+                result['id'], result['wall_time'], before['wall_time'],
+                _get_change(result['wall_time'], before['wall_time'])))
+        if (result['peak_rss'] and before['peak_rss'] and
+                result['peak_rss'] > before['peak_rss'] * (1 + rss_tolerance)):
+            regressions.append('%s: peak RSS %s, was %s (%+.0f%%)' % (
+                result['id'], _format_bytes(result['peak_rss']),
+                _format_bytes(before['peak_rss']),
+                _get_change(result['peak_rss'], before['peak_rss'])))
+        if result['tiles'] != before['tiles']:
+            regressions.append('%s: wrote %s tiles, was %s' % (
+                result['id'], result['tiles'], before['tiles']))
+    return regressions
+
+
+def _get_change(value, before):
+    return (float(value) / before - 1) * 100 if before else 0.0
+
+
+def _format_bytes(nbytes):
+    if nbytes is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(nbytes) < 1024:
+            return '%.0f%s' % (nbytes, unit)
+        nbytes /= 1024.0
+    return '%.1fGB' % nbytes
+
+
+def format_result(result, before=None):
+    """Returns a line of the report of a case."""
+    if 'error' in result:
+        return '%-70s FAILED: %s' % (result['id'], result['error'])
+    line = '%-70s %8.3fs %8.3fs cpu %8s rss %9.0f tiles/s %9s' % (
+        result['id'], result['wall_time'], result['cpu_time'],
+        _format_bytes(result['peak_rss']), result['tiles_per_second'] or 0,
+        _format_bytes(result['bytes_written']))
+    if before is not None and 'error' not in before:
+        line += ' %+5.0f%%' % _get_change(result['wall_time'],
+                                          before['wall_time'])
+    return line
+
+
+def main():
+    parser = optparse.OptionParser(usage="Usage: %prog [options]")
+
+    parser.add_option("-p", "--profile", dest="profile", default=DEFAULT_PROFILE,
+                      help="Cases to run (%s). Default: %s" % (
+                          ", ".join(sorted(PROFILES)), DEFAULT_PROFILE))
+    parser.add_option("-m", "--max_megapixels", dest="max_megapixels",
+                      type="float", default=None,
+                      help="Skip image cases of fixtures bigger than this.")
+    parser.add_option("-k", "--case", dest="case_filter", default=None,
+                      help="Only run cases whose id contains this string.")
+    parser.add_option("-i", "--image", dest="images", action="append",
+                      default=[], help="Also run the base case on this real \
+                                        world image. Can be repeated.")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="Runs of each case, the fastest is kept. Default: 3")
+    parser.add_option("-f", "--fixtures", dest="fixtures", default=None,
+                      help="Directory of generated fixtures, kept between \
+                            runs. Default: deepzoom-benchmark-fixtures in the \
+                            temporary directory")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="Save the results as JSON to this file.")
+    parser.add_option("-b", "--baseline", dest="baseline", default=None,
+                      help="Compare the results with those saved to this \
+                            file, failing on regressions.")
+    parser.add_option("-t", "--time_tolerance", dest="time_tolerance",
+                      type="float", default=0.25,
+                      help="Slowdown over the baseline that is a regression. \
+                            Default: 0.25")
+    parser.add_option("-l", "--time_slack", dest="time_slack",
+                      type="float", default=0.05,
+                      help="Slowdown in seconds too small to be a regression, \
+                            whatever the tolerance. Default: 0.05")
+    parser.add_option("-s", "--rss_tolerance", dest="rss_tolerance",
+                      type="float", default=0.25,
+                      help="Peak RSS growth over the baseline that is a \
+                            regression. Default: 0.25")
+    parser.add_option("--run-case", dest="run_case", default=None,
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option("--work-dir", dest="work_dir", default=None,
+                      help=optparse.SUPPRESS_HELP)
+
+    (options, args) = parser.parse_args()
+
+    fixtures_dir = options.fixtures or os.path.join(
+        tempfile.gettempdir(), 'deepzoom-benchmark-fixtures')
+    if not os.path.exists(fixtures_dir):
+        os.makedirs(fixtures_dir)
+
+    if options.run_case:
+        result = run_case(json.loads(options.run_case), fixtures_dir,
+                          options.work_dir)
+        print(json.dumps(result))
+        return
+
+    if options.profile not in PROFILES:
+        parser.error("Unknown profile: %s" % options.profile)
+    cases = get_cases(options.profile, options.max_megapixels)
+    for image in options.images:
+        case = dict(BASE_CASE, fixture=os.path.abspath(image))
+        case['id'] = get_case_id(case)
+        cases.append(case)
+    if options.case_filter:
+        cases = [case for case in cases if options.case_filter in case['id']]
+
+    baseline = None
+    baseline_results = {}
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline_results = dict((result['id'], result)
+                                for result in baseline.get('results', []))
+        if baseline.get('machine') != get_machine():
+            print("Warning: the baseline was run on another machine or "
+                  "software, timings may not compare.")
+
+    report = lambda result: print(format_result(
+        result, baseline_results.get(result['id'])))
+    results = run_benchmark(cases, fixtures_dir, max(options.repeat, 1), report)
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump({'machine': get_machine(), 'profile': options.profile,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, output_file, indent=2,
+                      sort_keys=True)
+
+    failed = [result for result in results if 'error' in result]
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, options.time_tolerance,
+                              options.rss_tolerance, options.time_slack)
+        if regressions:
+            print("\nREGRESSIONS against %s:" % options.baseline)
+            for regression in regressions:
+                print("  " + regression)
+        else:
+            print("\nNo regressions against %s." % options.baseline)
+    if regressions or failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+
+#EOF - django-deepzoom benchmark
@@ -1,8 +1,9 @@
 #django-deepzoom tests
 from django.conf import settings
 from django.test.utils import override_settings
-from django.test import TestCase, SimpleTestCase
-from django.db import models, transaction, IntegrityError
+from django.test import TestCase, SimpleTestCase, RequestFactory
+from django.http import Http404
+from django.db import models, transaction, IntegrityError, DatabaseError
 from django.template import Template, Context, TemplateSyntaxError
 from django.core.files.uploadedfile import SimpleUploadedFile
 
@@ -16,13 +17,22 @@ except ImportError:
 
 from functools import wraps
 import mimetypes as mime
-import os, shutil, string
+import os, pickle, shutil, string, struct, tempfile
+import threading, time
+import unittest
+
+from PIL import Image as PILImage
+from PIL import TiffImagePlugin
 
 import six
 
-from .utils import is_django_version_greater_than
+from .utils import is_django_version_greater_than, SingleFlight
 from .models import UploadedImage, DeepZoom
+from . import deepzoom
+from . import views
+from . import cache
 from .test.models import TestImage
+from .test import benchmark
 
 DJANGO_APP_STARTABLE = is_django_version_greater_than(1, 6)
 
@@ -2473,6 +2483,162 @@ class CreateDeepZoomTestCase(TestCase):
     # /test_update_image__uploaded_image__with_valid_settings_defined
     
     
+    @override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                       DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                       DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS, 
+                       DEEPZOOM_INCREMENTAL_UPDATES = True)
+    def test_update_deepzoom_incrementally_with_edited_uploaded_image(self):
+        """
+        3.16) Tests an edited image file upload of the same size updates the 
+            associated deepzoom in place, rewriting only the changed tiles.
+        """
+        test_object_name = 'test_img_3.16'
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_PORTRAIT)).convert('RGB')
+        image_path = os.path.join(settings.MEDIA_ROOT, 'original.png')
+        source.save(image_path)
+        image = simulate_uploaded_file(image_path)
+        
+        try:
+            with transaction.atomic():
+                test_img = TestImage.objects.create(uploaded_image=image, 
+                                                    name=test_object_name, 
+                                                    create_deepzoom=True)
+        except AttributeError:
+            try:
+                test_img = TestImage.objects.create(uploaded_image=image, 
+                                                    name=test_object_name, 
+                                                    create_deepzoom=True)
+            except:
+                raise
+        
+        test_dz = test_img.associated_deepzoom
+        files_dir = os.path.join(settings.MEDIA_ROOT, test_dz.deepzoom_path, 
+                                 test_dz.slug + '_files')
+        max_level = str(max(int(level) for level in os.listdir(files_dir)))
+        kept_tile = os.path.join(files_dir, max_level, '0_0.png')
+        edited_tile = os.path.join(files_dir, max_level, '1_1.png')
+        kept_inode = os.stat(kept_tile).st_ino
+        with open(edited_tile, 'rb') as tile_file:
+            orig_edited_tile = tile_file.read()
+        
+        for x in range(440, 480):
+            for y in range(620, 660):
+                source.putpixel((x, y), (255, 0, 0))
+        new_image_path = os.path.join(settings.MEDIA_ROOT, 'edited.png')
+        source.save(new_image_path)
+        test_img.uploaded_image = simulate_uploaded_file(new_image_path)
+        test_img.save()
+        
+        new_test_img = TestImage.objects.get(name=test_object_name)
+        self.assertEqual(new_test_img.associated_deepzoom, test_dz)
+        self.assertEqual(DeepZoom.objects.count(), 1)
+        self.assertFalse(new_test_img.create_deepzoom)
+        self.assertEqual(new_test_img.associated_deepzoom.associated_image, 
+                         new_test_img.uploaded_image.name)
+        self.assertFalse(os.path.exists(new_test_img.uploaded_image.path + 
+                                        '.previous'))
+        self.assertEqual(os.stat(kept_tile).st_ino, kept_inode)
+        with open(edited_tile, 'rb') as tile_file:
+            self.assertNotEqual(tile_file.read(), orig_edited_tile)
+        reSet(settings.MEDIA_ROOT)
+    # /test_update_deepzoom_incrementally_with_edited_uploaded_image
+    
+    
+    @override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                       DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                       DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS, 
+                       DEEPZOOM_INCREMENTAL_UPDATES = True)
+    def test_failed_save_restores_image_set_aside(self):
+        """
+        3.17) Tests an image file set aside for an incremental update is put 
+            back in place when saving the replacement upload fails.
+        """
+        test_object_name = 'test_img_3.17'
+        image = simulate_uploaded_file(os.path.join(settings.TEST_ROOT, 
+                                                    TEST_IMAGE_PORTRAIT))
+        test_img = TestImage.objects.create(uploaded_image=image, 
+                                            name=test_object_name, 
+                                            create_deepzoom=True)
+        image_path = test_img.uploaded_image.path
+        with open(image_path, 'rb') as image_file:
+            image_data = image_file.read()
+        
+        def _save_table(*args, **kwargs):
+            raise DatabaseError('save failed')
+        test_img._save_table = _save_table
+        test_img.uploaded_image = simulate_uploaded_file(
+            os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE))
+        def _save():
+            with transaction.atomic():
+                test_img.save()
+        self.assertRaises(DatabaseError, _save)
+        
+        self.assertFalse(os.path.exists(image_path + '.previous'))
+        self.assertIsNone(test_img.previous_image_path)
+        new_test_img = TestImage.objects.get(name=test_object_name)
+        self.assertEqual(new_test_img.uploaded_image.path, image_path)
+        with open(image_path, 'rb') as image_file:
+            self.assertEqual(image_file.read(), image_data)
+        reSet(settings.MEDIA_ROOT)
+    # /test_failed_save_restores_image_set_aside
+    
+    
+    @override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                       DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                       DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS, 
+                       DEEPZOOM_INCREMENTAL_UPDATES = True)
+    def test_failed_incremental_update_recreates_deepzoom(self):
+        """
+        3.18) Tests an incremental update that fails part way regenerates all 
+            deepzoom files rather than leave old and new tiles mixed.
+        """
+        test_object_name = 'test_img_3.18'
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_PORTRAIT)).convert('RGB')
+        image_path = os.path.join(settings.MEDIA_ROOT, 'original.png')
+        source.save(image_path)
+        test_img = TestImage.objects.create(
+            uploaded_image=simulate_uploaded_file(image_path), 
+            name=test_object_name, create_deepzoom=True)
+        
+        test_dz = test_img.associated_deepzoom
+        files_dir = os.path.join(settings.MEDIA_ROOT, test_dz.deepzoom_path, 
+                                 test_dz.slug + '_files')
+        max_level = str(max(int(level) for level in os.listdir(files_dir)))
+        edited_tile = os.path.join(files_dir, max_level, '1_1.png')
+        
+        def _update(creator, previous, source, destination):
+            with open(edited_tile, 'wb') as tile_file:
+                tile_file.write(b'partial')
+            raise IOError("disk full")
+        for x in range(440, 480):
+            for y in range(620, 660):
+                source.putpixel((x, y), (255, 0, 0))
+        new_image_path = os.path.join(settings.MEDIA_ROOT, 'edited.png')
+        source.save(new_image_path)
+        update = deepzoom.ImageCreator.update
+        deepzoom.ImageCreator.update = _update
+        try:
+            test_img.uploaded_image = simulate_uploaded_file(new_image_path)
+            test_img.save()
+        finally:
+            deepzoom.ImageCreator.update = update
+        
+        uploaded_path = TestImage.objects.get(
+            name=test_object_name).uploaded_image.path
+        self.assertFalse(os.path.exists(uploaded_path + '.previous'))
+        expected_dzi = os.path.join(settings.MEDIA_ROOT, 'expected.dzi')
+        test_dz.get_deepzoom_creator().create(new_image_path, expected_dzi)
+        with open(os.path.join(settings.MEDIA_ROOT, 'expected_files', 
+                               max_level, '1_1.png'), 'rb') as tile_file:
+            expected_tile = tile_file.read()
+        with open(edited_tile, 'rb') as tile_file:
+            self.assertEqual(tile_file.read(), expected_tile)
+        reSet(settings.MEDIA_ROOT)
+    # /test_failed_incremental_update_recreates_deepzoom
+    
+    
     def suite():
         tests = ['test_create_deepzoom_without_DEEPZOOM_ROOT_defined', 
                  'test_create_deepzoom_with_blank_DEEPZOOM_ROOT_defined', 
@@ -2503,7 +2669,10 @@ class CreateDeepZoomTestCase(TestCase):
                  'test_create_portrait_deepzoom_with_valid_settings_defined', 
                  'test_create_square_deepzoom_with_valid_settings_defined', 
                  'test_create_deepzoom_with_maxchars__name__defined', 
-                 'test_update_deepzoom_image__name__with_valid_settings_defined']
+                 'test_update_deepzoom_image__name__with_valid_settings_defined', 
+                 'test_update_deepzoom_incrementally_with_edited_uploaded_image', 
+                 'test_failed_save_restores_image_set_aside', 
+                 'test_failed_incremental_update_recreates_deepzoom']
 
         return unittest.TestSuite(list(map(CreateDeepZoomTestCase, tests)))
 # /CreateDeepZoomTestCase
@@ -2926,4 +3095,2191 @@ class DeepZoomSecondTemplateTagTestCase(TestCase):
 # /DeepZoomSecondTemplateTagTestCase
 
 
+def list_tiles(_files_dir=None):
+    '''
+    Returns the sorted relative paths of all tiles beneath a `_files` directory.
+    '''
+    _tiles = []
+    for _root, _dirs, _files in os.walk(_files_dir):
+        for _file in _files:
+            _tiles.append(os.path.relpath(os.path.join(_root, _file), _files_dir))
+    return sorted(_tiles)
+# /list_tiles
+
+
+def write_tiled_tiff(_write_path=None, _images=None, _tile_size=64):
+    '''
+    Writes RGB images as the pages of an uncompressed, tiled TIFF file, like 
+    the levels of a pyramidal TIFF.
+    '''
+    _out = bytearray(six.b('II*\x00\x00\x00\x00\x00'))
+    _next_ifd = 4
+    for _image in _images:
+        _width, _height = _image.size
+        _offsets, _counts = [], []
+        for _y in range(0, _height, _tile_size):
+            for _x in range(0, _width, _tile_size):
+                _tile = _image.crop((_x, _y, _x + _tile_size, 
+                                     _y + _tile_size)).tobytes()
+                _offsets.append(len(_out))
+                _counts.append(len(_tile))
+                _out += _tile
+        _bits = len(_out)
+        _out += struct.pack('<3H', 8, 8, 8)
+        _offsets_at = len(_out)
+        _out += struct.pack('<%dI' % len(_offsets), *_offsets)
+        _counts_at = len(_out)
+        _out += struct.pack('<%dI' % len(_counts), *_counts)
+        _tags = [(256, 4, 1, _width), (257, 4, 1, _height), (258, 3, 3, _bits), 
+                 (259, 3, 1, 1), (262, 3, 1, 2), (277, 3, 1, 3), (284, 3, 1, 1), 
+                 (322, 4, 1, _tile_size), (323, 4, 1, _tile_size), 
+                 (324, 4, len(_offsets), _offsets_at), 
+                 (325, 4, len(_counts), _counts_at)]
+        struct.pack_into('<I', _out, _next_ifd, len(_out))
+        _out += struct.pack('<H', len(_tags))
+        for (_tag, _type, _count, _value) in _tags:
+            if _type == 3 and _count == 1:
+                _out += struct.pack('<HHIHH', _tag, _type, _count, _value, 0)
+            else:
+                _out += struct.pack('<HHII', _tag, _type, _count, _value)
+        _next_ifd = len(_out)
+        _out += struct.pack('<I', 0)
+    with open(_write_path, 'wb') as _tiff_file:
+        _tiff_file.write(bytes(_out))
+# /write_tiled_tiff
+
+
+class ImageCreatorTestCase(SimpleTestCase):
+    '''
+    7.) Class tests the deep zoom generator directly.
+    '''
+    def setUp(self):
+        self.dest_root = os.path.join(settings.MEDIA_ROOT, 'image_creator')
+        if not os.path.isdir(self.dest_root):
+            os.makedirs(self.dest_root)
+    
+    
+    def tearDown(self):
+        reSet(settings.MEDIA_ROOT)
+    
+    
+    def create_deepzoom(self, _name, _image=TEST_IMAGE_LANDSCAPE, **kwargs):
+        '''
+        Generates a deep zoom of a test image and returns its `_files` directory.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, _image)
+        dzi_path = os.path.join(self.dest_root, _name + '.dzi')
+        creator = deepzoom.ImageCreator(**kwargs)
+        creator.create(image_path, dzi_path)
+        return os.path.join(self.dest_root, _name + '_files')
+    
+    
+    def test_cascade_and_reference_modes_produce_same_pyramid(self):
+        '''
+        7.1) Tests the default cascade mode produces the same tiles, with the 
+            same dimensions, as the per-level reference mode.
+        '''
+        cascade_dir = self.create_deepzoom('cascade')
+        reference_dir = self.create_deepzoom('reference', 
+                                             pyramid_mode="reference")
+        cascade_tiles = list_tiles(cascade_dir)
+        self.assertEqual(cascade_tiles, list_tiles(reference_dir))
+        for tile in cascade_tiles:
+            cascade_tile = PILImage.open(os.path.join(cascade_dir, tile))
+            reference_tile = PILImage.open(os.path.join(reference_dir, tile))
+            self.assertEqual(cascade_tile.size, reference_tile.size)
+    # /test_cascade_and_reference_modes_produce_same_pyramid
+    
+    
+    def test_cascade_mode_reduces_each_level_from_the_one_above(self):
+        '''
+        7.2) Tests cascade mode yields every level largest first, at descriptor 
+            dimensions, and releases the source image.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        creator = deepzoom.ImageCreator()
+        creator.image = PILImage.open(image_path)
+        creator.descriptor = deepzoom.DZIDescriptor(
+                                        width=TEST_IMAGE_PORTRAIT_WIDTH, 
+                                        height=TEST_IMAGE_PORTRAIT_HEIGHT)
+        levels = []
+        for level, level_image in creator.get_images():
+            self.assertEqual(level_image.size, 
+                             creator.descriptor.get_dimensions(level))
+            levels.append(level)
+        self.assertEqual(levels, 
+                         list(reversed(range(creator.descriptor.num_levels))))
+        self.assertEqual(creator.image, None)
+    # /test_cascade_mode_reduces_each_level_from_the_one_above
+    
+    
+    def test_unrecognized_pyramid_mode_defaults_to_cascade(self):
+        '''
+        7.3) Tests an unrecognized pyramid mode falls back to cascade.
+        '''
+        creator = deepzoom.ImageCreator(pyramid_mode="bogus")
+        self.assertEqual(creator.pyramid_mode, "cascade")
+    # /test_unrecognized_pyramid_mode_defaults_to_cascade
+    
+    
+    def test_parallel_workers_produce_identical_tiles(self):
+        '''
+        7.4) Tests tiles written by several workers are byte-identical to the 
+            tiles written serially.
+        '''
+        serial_dir = self.create_deepzoom('serial', tile_size=64)
+        parallel_dir = self.create_deepzoom('parallel', tile_size=64, workers=4)
+        self.assertSameTiles(serial_dir, parallel_dir)
+    # /test_parallel_workers_produce_identical_tiles
+    
+    
+    def assertSameTiles(self, first_dir, second_dir):
+        '''
+        Asserts two `_files` directories hold byte-identical tiles.
+        '''
+        first_tiles = list_tiles(first_dir)
+        self.assertEqual(first_tiles, list_tiles(second_dir))
+        for tile in first_tiles:
+            with open(os.path.join(first_dir, tile), 'rb') as first_file:
+                with open(os.path.join(second_dir, tile), 'rb') as second_file:
+                    self.assertEqual(first_file.read(), second_file.read())
+    
+    
+    def test_stream_mode_matches_cascade_mode(self):
+        '''
+        7.5) Tests stream mode writes the same tiles as cascade mode for a 
+            source that has to be decoded whole.
+        '''
+        cascade_dir = self.create_deepzoom('cascade', tile_size=64)
+        stream_dir = self.create_deepzoom('stream', tile_size=64, 
+                                          pyramid_mode="stream")
+        self.assertSameTiles(cascade_dir, stream_dir)
+    # /test_stream_mode_matches_cascade_mode
+    
+    
+    def test_stream_mode_reads_striped_source_in_strips(self):
+        '''
+        7.6) Tests stream mode decodes a striped TIFF source one strip at a 
+            time, through the reader create() opened, and still writes the 
+            same tiles as cascade mode.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        tiff_path = os.path.join(self.dest_root, 'striped.tif')
+        write_libtiff = TiffImagePlugin.WRITE_LIBTIFF
+        TiffImagePlugin.WRITE_LIBTIFF = True
+        try:
+            PILImage.open(image_path).save(tiff_path, tiffinfo={278: 16})
+        finally:
+            TiffImagePlugin.WRITE_LIBTIFF = write_libtiff
+        
+        creator = deepzoom.ImageCreator(tile_size=64)
+        strips = list(creator.get_strips(tiff_path, 64))
+        self.assertEqual([strip.size[1] for strip in strips], 
+                         [64] * 8 + [TEST_IMAGE_LANDSCAPE_HEIGHT - 64 * 8])
+        self.assertTrue(all(strip.size[0] == TEST_IMAGE_LANDSCAPE_WIDTH 
+                            for strip in strips))
+        
+        cascade_dir = self.create_deepzoom('cascade', tiff_path, 
+                                           tile_size=64)
+        readers = []
+        def _get_source_reader(source):
+            readers.append(source)
+            return get_source_reader(source)
+        get_source_reader = deepzoom.get_source_reader
+        deepzoom.get_source_reader = _get_source_reader
+        try:
+            stream_dir = self.create_deepzoom('stream', tiff_path, tile_size=64, 
+                                              pyramid_mode="stream")
+        finally:
+            deepzoom.get_source_reader = get_source_reader
+        # the strips are read through the reader create() opened
+        self.assertEqual(readers, [tiff_path])
+        self.assertSameTiles(cascade_dir, stream_dir)
+    # /test_stream_mode_reads_striped_source_in_strips
+    
+    
+    @unittest.skipIf(deepzoom.numpy is None, "NumPy is not installed.")
+    def test_numpy_backend_matches_pillow_backend(self):
+        '''
+        7.7) Tests the NumPy backend, selected per call, writes the same tiles as 
+            the Pillow backend in cascade and stream modes.
+        '''
+        pillow_dir = self.create_deepzoom('pillow', tile_size=64, tile_overlap=2)
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        creator = deepzoom.ImageCreator(tile_size=64, tile_overlap=2)
+        creator.create(image_path, os.path.join(self.dest_root, 'numpy.dzi'), 
+                       backend="numpy")
+        self.assertEqual(creator.backend.name, "pillow")
+        self.assertSameTiles(pillow_dir, 
+                             os.path.join(self.dest_root, 'numpy_files'))
+        stream_dir = self.create_deepzoom('stream', tile_size=64, tile_overlap=2, 
+                                          pyramid_mode="stream", backend="numpy")
+        self.assertSameTiles(pillow_dir, stream_dir)
+    # /test_numpy_backend_matches_pillow_backend
+    
+    
+    @unittest.skipIf(deepzoom.numpy is None, "NumPy is not installed.")
+    def test_numpy_backend_levels_match_descriptor_geometry(self):
+        '''
+        7.8) Tests NumPy backend levels are arrays with descriptor dimensions.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        creator = deepzoom.ImageCreator(backend="numpy")
+        creator.image = PILImage.open(image_path)
+        creator.descriptor = deepzoom.DZIDescriptor(
+                                        width=TEST_IMAGE_PORTRAIT_WIDTH, 
+                                        height=TEST_IMAGE_PORTRAIT_HEIGHT)
+        for level, level_image in creator.get_images():
+            width, height = creator.descriptor.get_dimensions(level)
+            self.assertEqual(level_image.shape, (height, width, 3))
+            self.assertTrue(level_image.flags['C_CONTIGUOUS'])
+    # /test_numpy_backend_levels_match_descriptor_geometry
+    
+    
+    @unittest.skipIf(deepzoom.numpy is None, "NumPy is not installed.")
+    def test_scratch_backed_levels_leave_no_scratch_files(self):
+        '''
+        7.9) Tests NumPy backend levels backed by scratch files write the same 
+            tiles and leave no scratch files behind on success or failure.
+        '''
+        scratch_dir = os.path.join(self.dest_root, 'scratch')
+        os.makedirs(scratch_dir)
+        creator = deepzoom.ImageCreator(backend="numpy", scratch_dir=scratch_dir)
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        level_image = creator.backend.load(PILImage.open(image_path))
+        self.assertTrue(isinstance(level_image, deepzoom.numpy.memmap))
+        self.assertTrue(isinstance(creator.backend.reduce(level_image), 
+                                   deepzoom.numpy.memmap))
+        del level_image
+        
+        memory_dir = self.create_deepzoom('memory', tile_size=64, 
+                                          backend="numpy")
+        scratch_dzi_dir = self.create_deepzoom('scratch', tile_size=64, 
+                                               backend="numpy", 
+                                               scratch_dir=scratch_dir)
+        self.assertSameTiles(memory_dir, scratch_dzi_dir)
+        self.assertEqual(os.listdir(scratch_dir), [])
+        
+        def fail(*args):
+            raise IOError("Disk full")
+        creator.create_tile = fail
+        with self.assertRaises(IOError):
+            creator.create(os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE), 
+                           os.path.join(self.dest_root, 'failed.dzi'))
+        self.assertEqual(os.listdir(scratch_dir), [])
+    # /test_scratch_backed_levels_leave_no_scratch_files
+    
+    
+    def test_jpeg_tiles_are_encoded_once(self):
+        '''
+        7.10) Tests each JPEG tile holds a single encoded image.
+        '''
+        files_dir = self.create_deepzoom('jpeg', tile_size=128)
+        for tile in list_tiles(files_dir):
+            with open(os.path.join(files_dir, tile), 'rb') as tile_file:
+                data = tile_file.read()
+            self.assertEqual(data.count(b'\xff\xd8\xff'), 1)
+            self.assertTrue(data.endswith(b'\xff\xd9'))
+    # /test_jpeg_tiles_are_encoded_once
+    
+    
+    def test_atomic_tile_writes(self):
+        '''
+        7.11) Tests atomic tile writes leave only finished tiles behind, the 
+            same as direct writes, and count what they wrote.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        creator = deepzoom.ImageCreator(tile_size=64, atomic_writes=True, 
+                                        workers=2)
+        creator.create(image_path, os.path.join(self.dest_root, 'atomic.dzi'))
+        atomic_dir = os.path.join(self.dest_root, 'atomic_files')
+        direct_dir = self.create_deepzoom('direct', tile_size=64)
+        self.assertSameTiles(direct_dir, atomic_dir)
+        
+        tiles = list_tiles(atomic_dir)
+        writer = creator.tile_writer
+        self.assertEqual(writer.tiles_written, len(tiles))
+        self.assertEqual(writer.bytes_written, 
+                         sum(os.path.getsize(os.path.join(atomic_dir, tile)) 
+                             for tile in tiles))
+        self.assertTrue(writer.tiles_per_second > 0)
+        self.assertTrue(0 < writer.wall_seconds)
+        self.assertEqual(writer.tiles_per_second, 
+                         writer.tiles_written / writer.wall_seconds)
+        
+        # Writes overlapping in time count once towards the throughput
+        writer = deepzoom.TileWriter(deepzoom.get_backend('pillow'))
+        def _publish(tile_path, data, canonical_path=None):
+            time.sleep(0.2)
+            return False
+        writer.encode = lambda tile: b'tile'
+        writer._publish = _publish
+        tile = PILImage.new('RGB', (4, 4), (1, 2, 3))
+        threads = [threading.Thread(target=writer.write, 
+                                    args=(tile, 'tile%s' % i)) 
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(writer.seconds >= 0.8)
+        self.assertTrue(writer.wall_seconds < 0.6)
+        self.assertTrue(writer.tiles_per_second > 4 / 0.6)
+    # /test_atomic_tile_writes
+    
+    
+    def test_uniform_tiles_are_linked(self):
+        '''
+        7.12) Tests tiles of a single colour are encoded once and linked, 
+            giving the same pyramid as encoding each of them.
+        '''
+        canvas = PILImage.new('RGB', (900, 700), (255, 255, 255))
+        with PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                        TEST_IMAGE_LANDSCAPE)) as _image:
+            canvas.paste(_image.convert('RGB').resize((200, 150)), (10, 10))
+        canvas_path = os.path.join(self.dest_root, 'canvas.png')
+        canvas.save(canvas_path)
+        
+        creator = deepzoom.ImageCreator(tile_size=64, link_uniform_tiles=True, 
+                                        workers=2)
+        creator.create(canvas_path, os.path.join(self.dest_root, 'linked.dzi'))
+        linked_dir = os.path.join(self.dest_root, 'linked_files')
+        plain_dir = self.create_deepzoom('plain', canvas_path, tile_size=64)
+        self.assertSameTiles(plain_dir, linked_dir)
+        
+        tiles = list_tiles(linked_dir)
+        links = [tile for tile in tiles 
+                 if os.stat(os.path.join(linked_dir, tile)).st_nlink > 1]
+        writer = creator.tile_writer
+        self.assertTrue(writer.tiles_linked > 0)
+        self.assertEqual(writer.tiles_written, len(tiles))
+        if hasattr(os, 'link'):
+            self.assertTrue(len(links) > writer.tiles_linked)
+    # /test_uniform_tiles_are_linked
+    
+    
+    def test_rewriting_a_linked_tile_leaves_its_links_alone(self):
+        '''
+        7.13) Tests writing over a linked tile replaces it rather than 
+            writing through to the tiles linked to it.
+        '''
+        first_path = os.path.join(self.dest_root, 'first.png')
+        second_path = os.path.join(self.dest_root, 'second.png')
+        writer = deepzoom.TileWriter(deepzoom.get_backend('pillow'), 
+                                     tile_format='png', link_uniform=True)
+        blank = PILImage.new('RGB', (16, 16), (0, 0, 0))
+        writer.write(blank, first_path)
+        writer.write(blank, second_path)
+        with open(first_path, 'rb') as first_file:
+            blank_data = first_file.read()
+        
+        writer.write(PILImage.new('RGB', (16, 16), (9, 9, 9)), second_path)
+        with open(first_path, 'rb') as first_file:
+            self.assertEqual(first_file.read(), blank_data)
+        with PILImage.open(second_path) as second:
+            self.assertEqual(second.getpixel((0, 0)), (9, 9, 9))
+    # /test_rewriting_a_linked_tile_leaves_its_links_alone
+    
+    
+    def test_update_rewrites_only_changed_tiles(self):
+        '''
+        7.14) Tests updating a deep zoom from an edited source rewrites only 
+            the tiles covering the edit, giving the same pyramid as creating 
+            it again, in every pyramid mode.
+        '''
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        original_path = os.path.join(self.dest_root, 'original.png')
+        source.save(original_path)
+        for x in range(600, 640):
+            for y in range(400, 430):
+                source.putpixel((x, y), (255, 0, 0))
+        edited_path = os.path.join(self.dest_root, 'edited.png')
+        source.save(edited_path)
+        
+        for pyramid_mode in ('cascade', 'reference', 'stream'):
+            kwargs = {'tile_size': 64, 'tile_overlap': 2, 
+                      'pyramid_mode': pyramid_mode}
+            updated_dzi = os.path.join(self.dest_root, 'updated.dzi')
+            deepzoom.ImageCreator(**kwargs).create(original_path, updated_dzi)
+            creator = deepzoom.ImageCreator(**kwargs)
+            rewritten = creator.update(original_path, edited_path, updated_dzi)
+            updated_dir = os.path.join(self.dest_root, 'updated_files')
+            created_dir = self.create_deepzoom('created', edited_path, **kwargs)
+            self.assertSameTiles(created_dir, updated_dir)
+            self.assertTrue(0 < rewritten < len(list_tiles(created_dir)) / 4)
+            self.assertEqual(creator.update(edited_path, edited_path, 
+                                            updated_dzi), 0)
+            shutil.rmtree(updated_dir)
+            shutil.rmtree(created_dir)
+    # /test_update_rewrites_only_changed_tiles
+    
+    
+    def test_update_with_resized_source_creates_again(self):
+        '''
+        7.15) Tests updating a deep zoom from a source of another size 
+            generates the whole pyramid again, leaving none of the old tiles.
+        '''
+        updated_dzi = os.path.join(self.dest_root, 'updated.dzi')
+        deepzoom.ImageCreator(tile_size=64).create(
+            os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE), updated_dzi)
+        creator = deepzoom.ImageCreator(tile_size=64)
+        rewritten = creator.update(
+            os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE), 
+            os.path.join(settings.TEST_ROOT, TEST_IMAGE_SQUARE), updated_dzi)
+        created_dir = self.create_deepzoom('created', TEST_IMAGE_SQUARE, 
+                                           tile_size=64)
+        self.assertEqual(rewritten, len(list_tiles(created_dir)))
+        self.assertSameTiles(created_dir, 
+                             os.path.join(self.dest_root, 'updated_files'))
+        descriptor = deepzoom.DZIDescriptor()
+        descriptor.open(updated_dzi)
+        self.assertEqual((descriptor.width, descriptor.height), 
+                         (TEST_IMAGE_SQUARE_WIDTH, TEST_IMAGE_SQUARE_HEIGHT))
+    # /test_update_with_resized_source_creates_again
+    
+    
+    def interrupt_create(self, creator, image_path, dzi_path, after_tiles):
+        '''
+        Runs a creator that fails after writing a number of tiles.
+        '''
+        create_tile = creator.create_tile
+        created = []
+        def _create_tile(*args):
+            if len(created) == after_tiles:
+                raise RuntimeError('interrupted')
+            created.append(args)
+            return create_tile(*args)
+        creator.create_tile = _create_tile
+        self.assertRaises(RuntimeError, creator.create, image_path, dzi_path)
+    
+    
+    def test_interrupted_create_resumes_from_checkpoint(self):
+        '''
+        7.16) Tests an interrupted deep zoom leaves a checkpoint behind, and 
+            resuming it writes only the missing tiles and removes it.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'resumed.dzi')
+        checkpoint_path = os.path.join(self.dest_root, 
+                                       'resumed_files.checkpoint')
+        self.interrupt_create(deepzoom.ImageCreator(tile_size=32), 
+                              image_path, dzi_path, 300)
+        self.assertTrue(os.path.isfile(checkpoint_path))
+        self.assertFalse(os.path.exists(dzi_path))
+        
+        creator = deepzoom.ImageCreator(tile_size=32)
+        creator.create(image_path, dzi_path, resume=True)
+        resumed_dir = os.path.join(self.dest_root, 'resumed_files')
+        created_dir = self.create_deepzoom('created', tile_size=32)
+        self.assertSameTiles(created_dir, resumed_dir)
+        self.assertEqual(creator.tile_writer.tiles_written, 
+                         len(list_tiles(created_dir)) - 300)
+        self.assertFalse(os.path.exists(checkpoint_path))
+    # /test_interrupted_create_resumes_from_checkpoint
+    
+    
+    def test_resume_ignores_checkpoint_of_other_settings(self):
+        '''
+        7.17) Tests resuming with other settings than the interrupted run 
+            starts over, and torn checkpoint lines are ignored.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'resumed.dzi')
+        checkpoint_path = os.path.join(self.dest_root, 
+                                       'resumed_files.checkpoint')
+        self.interrupt_create(deepzoom.ImageCreator(tile_size=32), 
+                              image_path, dzi_path, 100)
+        with open(checkpoint_path, 'a') as checkpoint_file:
+            checkpoint_file.write('tile 0 0 0')
+        
+        checkpoint = deepzoom.Checkpoint(checkpoint_path, 'other')
+        self.assertFalse(checkpoint.load())
+        with open(checkpoint_path) as checkpoint_file:
+            fingerprint = checkpoint_file.readline().split()[1]
+        checkpoint = deepzoom.Checkpoint(checkpoint_path, fingerprint)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(sum(len(tiles) for tiles in checkpoint.tiles.values()), 
+                         100)
+        self.assertFalse(checkpoint.is_done(0, (0, 0)))
+        
+        creator = deepzoom.ImageCreator(tile_size=32, image_quality=0.5)
+        creator.create(image_path, dzi_path, resume=True)
+        resumed_dir = os.path.join(self.dest_root, 'resumed_files')
+        self.assertEqual(creator.tile_writer.tiles_written, 
+                         len(list_tiles(resumed_dir)))
+        self.assertFalse(os.path.exists(checkpoint_path))
+    # /test_resume_ignores_checkpoint_of_other_settings
+    
+    
+    def test_single_tiles_match_created_tiles(self):
+        '''
+        7.18) Tests tiles created one at a time from the source are the same 
+            as the tiles of the whole pyramid, and that tiles outside the 
+            pyramid aren't created.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        created_dir = self.create_deepzoom('created', TEST_IMAGE_PORTRAIT, 
+                                           tile_size=64, tile_overlap=2)
+        single_dzi = os.path.join(self.dest_root, 'single.dzi')
+        creator = deepzoom.ImageCreator(tile_size=64, tile_overlap=2)
+        creator.create_descriptor(image_path, single_dzi)
+        self.assertTrue(os.path.isfile(single_dzi))
+        single_dir = os.path.join(self.dest_root, 'single_files')
+        self.assertEqual(list_tiles(single_dir), [])
+        
+        for tile in list_tiles(created_dir):
+            level, name = os.path.split(tile)
+            column, row = os.path.splitext(name)[0].split('_')
+            creator.create_single_tile(image_path, single_dzi, int(level), 
+                                       int(column), int(row))
+        self.assertSameTiles(created_dir, single_dir)
+        self.assertEqual(creator.create_single_tile(image_path, single_dzi, 
+                                                    10, 8, 0), None)
+        self.assertEqual(creator.create_single_tile(image_path, single_dzi, 
+                                                    11, 0, 0), None)
+    # /test_single_tiles_match_created_tiles
+    
+    
+    def test_single_tiles_from_cached_levels_match_created_tiles(self):
+        '''
+        7.19) Tests tiles cropped out of cached levels are the same as the 
+            tiles of the whole pyramid, and levels too big aren't cached.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        created_dir = self.create_deepzoom('created', TEST_IMAGE_PORTRAIT, 
+                                           tile_size=64, tile_overlap=2)
+        single_dzi = os.path.join(self.dest_root, 'single.dzi')
+        level_cache = cache.LRUCache(TEST_IMAGE_PORTRAIT_WIDTH * 
+                                     TEST_IMAGE_PORTRAIT_HEIGHT * 3 // 2)
+        creator = deepzoom.ImageCreator(tile_size=64, tile_overlap=2)
+        for tile in list_tiles(created_dir):
+            level, name = os.path.split(tile)
+            column, row = os.path.splitext(name)[0].split('_')
+            creator.create_single_tile(image_path, single_dzi, int(level), 
+                                       int(column), int(row), 
+                                       level_cache=level_cache, 
+                                       cache_key='portrait')
+        self.assertSameTiles(created_dir, 
+                             os.path.join(self.dest_root, 'single_files'))
+        fingerprint = creator.get_fingerprint(image_path)
+        self.assertFalse(('portrait', fingerprint, 10) in level_cache)
+        self.assertTrue(('portrait', fingerprint, 9) in level_cache)
+        self.assertTrue(level_cache.hits > level_cache.misses)
+    # /test_single_tiles_from_cached_levels_match_created_tiles
+    
+    
+    def assertSamePackedTiles(self, _files_dir, _pack_path):
+        '''
+        Asserts a tile pack holds the same tiles as a `_files` directory.
+        '''
+        pack = deepzoom.TilePack(_pack_path).open()
+        tiles = list_tiles(_files_dir)
+        self.assertEqual(len(pack.index), len(tiles))
+        for tile in tiles:
+            tile_path = os.path.join(_files_dir, tile)
+            with open(tile_path, 'rb') as tile_file:
+                self.assertEqual(pack.get_tile(*deepzoom._get_tile_key(tile_path)), 
+                                 tile_file.read())
+        pack.close()
+    
+    
+    def test_tile_pack_matches_tile_files(self):
+        '''
+        7.20) Tests a tile pack holds the same tiles as the tile files, in 
+            every pyramid mode and with parallel workers, and no tile files 
+            are written.
+        '''
+        for pyramid_mode in ('cascade', 'stream'):
+            kwargs = {'tile_size': 64, 'tile_overlap': 2, 'workers': 4, 
+                      'pyramid_mode': pyramid_mode}
+            created_dir = self.create_deepzoom('created', **kwargs)
+            packed_dir = self.create_deepzoom('packed', tile_pack=True, 
+                                              link_uniform_tiles=True, **kwargs)
+            self.assertFalse(os.path.exists(packed_dir))
+            self.assertSamePackedTiles(created_dir, packed_dir + '.pack')
+            shutil.rmtree(created_dir)
+        
+        self.create_deepzoom('packed', tile_size=64)
+        self.assertFalse(os.path.exists(packed_dir + '.pack'))
+    # /test_tile_pack_matches_tile_files
+    
+    
+    def test_update_appends_to_tile_pack(self):
+        '''
+        7.21) Tests updating a packed deep zoom appends only the changed tiles, 
+            giving the same tiles as creating it again, while readers of the 
+            pack as it was keep reading the previous tiles, and that the pack 
+            stays readable while it is updated and as it was if that fails.
+        '''
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        original_path = os.path.join(self.dest_root, 'original.png')
+        source.save(original_path)
+        for x in range(600, 640):
+            for y in range(400, 430):
+                source.putpixel((x, y), (255, 0, 0))
+        edited_path = os.path.join(self.dest_root, 'edited.png')
+        source.save(edited_path)
+        
+        kwargs = {'tile_size': 64, 'tile_overlap': 2, 'tile_pack': True}
+        updated_dzi = os.path.join(self.dest_root, 'updated.dzi')
+        pack_path = os.path.join(self.dest_root, 'updated_files.pack')
+        deepzoom.ImageCreator(**kwargs).create(original_path, updated_dzi)
+        previous_pack = deepzoom.TilePack(pack_path).open()
+        previous_tile = previous_pack.get_tile(10, 9, 6).tobytes()
+        previous_size = os.path.getsize(pack_path)
+        
+        creator = deepzoom.ImageCreator(**kwargs)
+        rewritten = creator.update(original_path, edited_path, updated_dzi)
+        self.assertTrue(0 < rewritten < len(previous_pack.index) / 4)
+        self.assertTrue(os.path.getsize(pack_path) > previous_size)
+        self.assertEqual(previous_pack.get_tile(10, 9, 6), previous_tile)
+        previous_pack.close()
+        
+        created_dir = self.create_deepzoom('created', edited_path, 
+                                           tile_size=64, tile_overlap=2)
+        self.assertSamePackedTiles(created_dir, pack_path)
+        
+        with open(pack_path, 'rb') as pack_file:
+            pack = pack_file.read()
+        def _add(tile_pack, key, data):
+            add(tile_pack, key, data)
+            tile_pack._file.flush()
+            deepzoom.TilePack(pack_path).open().close()
+            raise IOError("disk full")
+        add = deepzoom.TilePack.add
+        deepzoom.TilePack.add = _add
+        try:
+            self.assertRaises(IOError, creator.update, edited_path, 
+                              original_path, updated_dzi)
+        finally:
+            deepzoom.TilePack.add = add
+        with open(pack_path, 'rb') as pack_file:
+            self.assertEqual(pack_file.read(), pack)
+        self.assertFalse([name for name in os.listdir(self.dest_root) 
+                          if name.endswith('.tmp')])
+    # /test_update_appends_to_tile_pack
+    
+    
+    def test_tiled_tiff_source_is_read_by_region(self):
+        '''
+        7.22) Tests regions of a tiled TIFF source are decoded from just the 
+            tiles they touch, and its smaller pages are offered as reductions.
+        '''
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        reduced = source.reduce(2)
+        tiff_path = os.path.join(self.dest_root, 'tiled.tif')
+        write_tiled_tiff(tiff_path, [source, reduced], 64)
+        
+        reader = deepzoom.get_source_reader(tiff_path)
+        self.assertTrue(isinstance(reader, deepzoom.TiffSourceReader))
+        self.assertEqual(reader.reductions, {reduced.size: 1})
+        for box in ((0, 0, 64, 64), (100, 70, 300, 333), (650, 500, 700, 522)):
+            self.assertEqual(reader.read_region(box).tobytes(), 
+                             source.crop(box).tobytes())
+        self.assertEqual(reader._images, {})
+        self.assertEqual(reader.get_reduction(reduced.size).tobytes(), 
+                         reduced.tobytes())
+        self.assertEqual(reader.get_reduction((10, 10)), None)
+        
+        image_path = os.path.join(self.dest_root, 'plain.png')
+        PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                   TEST_IMAGE_PORTRAIT)).save(image_path)
+        reader = deepzoom.get_source_reader(image_path)
+        self.assertEqual(type(reader), deepzoom.SourceReader)
+        self.assertEqual(reader.read_region((5, 5, 20, 30)).size, (15, 25))
+    # /test_tiled_tiff_source_is_read_by_region
+    
+    
+    def test_pyramidal_tiff_reductions_make_lower_levels(self):
+        '''
+        7.23) Tests lower levels are taken from the reductions of a pyramidal 
+            TIFF source, by create() and single tiles alike.
+        '''
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        plain_path = os.path.join(self.dest_root, 'plain.png')
+        source.save(plain_path)
+        reduced = source.reduce(2)
+        tiff_path = os.path.join(self.dest_root, 'pyramid.tif')
+        write_tiled_tiff(tiff_path, [source, reduced, reduced.reduce(2)], 64)
+        kwargs = {'tile_size': 64, 'tile_overlap': 2, 'tile_format': 'png'}
+        plain_dir = self.create_deepzoom('plain', plain_path, **kwargs)
+        for pyramid_mode in ('cascade', 'stream'):
+            pyramid_dir = self.create_deepzoom(pyramid_mode, tiff_path, 
+                                               pyramid_mode=pyramid_mode, 
+                                               **kwargs)
+            self.assertSameTiles(plain_dir, pyramid_dir)
+        
+        reduced.paste((255, 0, 0), (0, 0, 40, 40))
+        write_tiled_tiff(tiff_path, [source, reduced], 64)
+        marked_dir = self.create_deepzoom('marked', tiff_path, **kwargs)
+        tile = PILImage.open(os.path.join(marked_dir, '9', '0_0.png'))
+        self.assertEqual(tile.getpixel((10, 10))[:3], (255, 0, 0))
+        tile = PILImage.open(os.path.join(marked_dir, '8', '0_0.png'))
+        self.assertEqual(tile.getpixel((10, 10))[:3], (255, 0, 0))
+        
+        single_dzi = os.path.join(self.dest_root, 'single.dzi')
+        creator = deepzoom.ImageCreator(**kwargs)
+        for tile in list_tiles(marked_dir):
+            level, name = os.path.split(tile)
+            column, row = os.path.splitext(name)[0].split('_')
+            creator.create_single_tile(tiff_path, single_dzi, int(level), 
+                                       int(column), int(row))
+        self.assertSameTiles(marked_dir, 
+                             os.path.join(self.dest_root, 'single_files'))
+    # /test_pyramidal_tiff_reductions_make_lower_levels
+    
+    
+    def test_scaled_decode_makes_lower_levels_of_jpeg(self):
+        '''
+        7.24) Tests the scaled decodes of a JPEG source are the lower levels 
+            only with scaled_decode, by create() and single tiles alike.
+        '''
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        jpeg_path = os.path.join(self.dest_root, 'source.jpg')
+        source.save(jpeg_path, quality=90)
+        decoded = PILImage.open(jpeg_path)
+        decoded.load()
+        plain_path = os.path.join(self.dest_root, 'decoded.png')
+        decoded.save(plain_path)
+        
+        opened = []
+        def _open(*args, **kwargs):
+            image = open_image(*args, **kwargs)
+            opened.append(image)
+            return image
+        open_image = PILImage.open
+        deepzoom.PILImage.open = _open
+        try:
+            reader = deepzoom.get_source_reader(jpeg_path)
+            self.assertTrue(isinstance(reader, deepzoom.JpegSourceReader))
+            # the scaled sizes are worked out without opening the source
+            reductions = reader.reductions
+        finally:
+            deepzoom.PILImage.open = open_image
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(opened[0].fp, None)
+        descriptor = deepzoom.DZIDescriptor(width=source.size[0], 
+                                            height=source.size[1])
+        top = descriptor.num_levels - 1
+        self.assertEqual(sorted(reductions), 
+                         sorted(descriptor.get_dimensions(top - halvings) 
+                                for halvings in (1, 2, 3)))
+        reduced = reader.get_reduction(descriptor.get_dimensions(top - 1))
+        self.assertEqual(reduced.size, descriptor.get_dimensions(top - 1))
+        
+        kwargs = {'tile_size': 64, 'tile_overlap': 2, 'tile_format': 'png'}
+        plain_dir = self.create_deepzoom('plain', plain_path, **kwargs)
+        full_dir = self.create_deepzoom('full', jpeg_path, **kwargs)
+        self.assertSameTiles(plain_dir, full_dir)
+        
+        scaled_dir = self.create_deepzoom('scaled', jpeg_path, 
+                                          scaled_decode=True, **kwargs)
+        tile = PILImage.open(os.path.join(scaled_dir, str(top - 1), '0_0.png'))
+        self.assertEqual(tile.tobytes(), reduced.crop((0, 0, 66, 66)).tobytes())
+        reference_dir = self.create_deepzoom('reference', jpeg_path, 
+                                             scaled_decode=True, 
+                                             pyramid_mode='reference', 
+                                             **kwargs)
+        tile = PILImage.open(os.path.join(reference_dir, str(top - 1), 
+                                          '0_0.png'))
+        self.assertEqual(tile.tobytes(), reduced.crop((0, 0, 66, 66)).tobytes())
+        
+        single_dzi = os.path.join(self.dest_root, 'single.dzi')
+        creator = deepzoom.ImageCreator(scaled_decode=True, **kwargs)
+        for tile in list_tiles(scaled_dir):
+            level, name = os.path.split(tile)
+            column, row = os.path.splitext(name)[0].split('_')
+            creator.create_single_tile(jpeg_path, single_dzi, int(level), 
+                                       int(column), int(row))
+        self.assertSameTiles(scaled_dir, 
+                             os.path.join(self.dest_root, 'single_files'))
+    # /test_scaled_decode_makes_lower_levels_of_jpeg
+    
+    
+    def test_progress_is_reported_at_intervals(self):
+        '''
+        7.25) Tests the progress callback is called for the first and last 
+            tile and at most once an interval in between, counting tiles an 
+            interrupted run finished as done.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'progress.dzi')
+        reports = []
+        creator = deepzoom.ImageCreator(tile_size=32, workers=4)
+        creator.progress_interval = 0
+        creator.create(image_path, dzi_path, 
+                       progress=lambda *report: reports.append(report))
+        tiles = list_tiles(os.path.join(self.dest_root, 'progress_files'))
+        self.assertEqual([report[1] for report in reports], 
+                         list(range(1, len(tiles) + 1)))
+        self.assertTrue(all(report[2] == len(tiles) for report in reports))
+        self.assertEqual(reports[-1][3], creator.tile_writer.bytes_written)
+        self.assertEqual(reports[-1][0], 0)
+        
+        reports = []
+        self.interrupt_create(deepzoom.ImageCreator(tile_size=32), 
+                              image_path, dzi_path, 300)
+        creator = deepzoom.ImageCreator(tile_size=32)
+        creator.progress_interval = 3600
+        creator.create(image_path, dzi_path, resume=True, 
+                       progress=lambda *report: reports.append(report))
+        self.assertEqual([report[1:3] for report in reports], 
+                         [(301, len(tiles)), (len(tiles), len(tiles))])
+    # /test_progress_is_reported_at_intervals
+    
+    
+    def test_cancelled_create_removes_partial_output(self):
+        '''
+        7.26) Tests setting the cancel token stops creation between tiles, 
+            removing its tiles, checkpoint and descriptor, in every pyramid 
+            mode, and leaves the old pack of a packed deep zoom in place.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'cancelled.dzi')
+        cancel = threading.Event()
+        def _progress(level, tiles_done, tiles_total, bytes_written, elapsed):
+            if tiles_done == 100:
+                cancel.set()
+        for pyramid_mode in ('cascade', 'reference', 'stream'):
+            for workers in (1, 4):
+                cancel.clear()
+                creator = deepzoom.ImageCreator(tile_size=32, workers=workers, 
+                                                pyramid_mode=pyramid_mode)
+                creator.progress_interval = 0
+                creator.create(image_path, dzi_path)
+                self.assertRaises(deepzoom.Cancelled, creator.create, 
+                                  image_path, dzi_path, progress=_progress, 
+                                  cancel=cancel)
+                self.assertTrue(creator.tile_writer.tiles_written < 110)
+                self.assertEqual(os.listdir(self.dest_root), [])
+        
+        creator = deepzoom.ImageCreator(tile_size=32, tile_pack=True)
+        creator.create(image_path, dzi_path)
+        pack_path = os.path.join(self.dest_root, 'cancelled_files.pack')
+        with open(pack_path, 'rb') as pack_file:
+            pack = pack_file.read()
+        cancel.set()
+        self.assertRaises(deepzoom.Cancelled, creator.create, image_path, 
+                          dzi_path, cancel=cancel)
+        with open(pack_path, 'rb') as pack_file:
+            self.assertEqual(pack_file.read(), pack)
+        self.assertEqual(sorted(os.listdir(self.dest_root)), 
+                         ['cancelled.dzi', 'cancelled_files.generation', 
+                          'cancelled_files.pack'])
+        self.assertEqual(deepzoom.read_generation(dzi_path), 
+                         creator.get_fingerprint(image_path))
+    # /test_cancelled_create_removes_partial_output
+    
+    
+    def test_descriptor_tile_grid_geometry(self):
+        '''
+        7.27) Tests the descriptor's level tables: levels of exact powers of 
+            two, tile bounds, invalid levels and tiles refused, tables made 
+            again when the size changes, and pickling.
+        '''
+        self.assertEqual(deepzoom.DZIDescriptor(width=2 ** 29, 
+                                                height=1).num_levels, 30)
+        self.assertEqual(deepzoom.DZIDescriptor(width=2 ** 29 + 1, 
+                                                height=1).num_levels, 31)
+        self.assertEqual(deepzoom.DZIDescriptor(width=1, height=1).num_levels, 1)
+        
+        descriptor = deepzoom.DZIDescriptor(width=700, height=522, 
+                                            tile_size=64, tile_overlap=2)
+        self.assertEqual(descriptor.get_dimensions(8), (175, 131))
+        self.assertEqual(descriptor.get_num_tiles(8), (3, 3))
+        self.assertEqual(descriptor.get_tile_bounds(8, 1, 2), (62, 126, 130, 131))
+        creator = deepzoom.ImageCreator(tile_size=64, tile_overlap=2)
+        creator.descriptor = descriptor
+        for level in range(descriptor.num_levels):
+            width, height = descriptor.get_dimensions(level)
+            for (column, row) in creator.tiles(level):
+                x = column * 64 - (2 if column else 0)
+                y = row * 64 - (2 if row else 0)
+                self.assertEqual(descriptor.get_tile_bounds(level, column, row), 
+                                 (x, y, min(x + 64 + (2 if column else 0) + 2, 
+                                            width), 
+                                  min(y + 64 + (2 if row else 0) + 2, height)))
+        self.assertRaises(AssertionError, descriptor.get_dimensions, 11)
+        self.assertRaises(AssertionError, descriptor.get_num_tiles, -1)
+        # the tables are made by now, and still checked
+        for (level, column, row) in ((-1, 0, 0), (11, 0, 0), (8, -1, 0), 
+                                     (8, 0, -1), (8, 3, 0), (8, 0, 3)):
+            self.assertRaises(AssertionError, descriptor.get_tile_bounds, 
+                              level, column, row)
+        
+        descriptor.width = 1400
+        self.assertEqual(descriptor.num_levels, 12)
+        self.assertEqual(descriptor.get_dimensions(11), (1400, 522))
+        self.assertFalse(hasattr(descriptor, '__dict__'))
+        
+        copy = pickle.loads(pickle.dumps(descriptor, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copy.width, copy.height, copy.tile_size, 
+                          copy.tile_overlap, copy.tile_format), 
+                         (1400, 522, 64, 2, 'jpg'))
+        self.assertEqual(copy.get_tile_bounds(11, 3, 0), 
+                         descriptor.get_tile_bounds(11, 3, 0))
+    # /test_descriptor_tile_grid_geometry
+    
+    
+    def test_descriptors_are_parsed_and_cached(self):
+        '''
+        7.28) Tests descriptors are parsed without a DOM, shared through the 
+            descriptor cache until their file changes, and evicted least 
+            recently used first.
+        '''
+        dzi_path = os.path.join(self.dest_root, 'cached.dzi')
+        deepzoom.DZIDescriptor(width=700, height=522, tile_size=64, 
+                               tile_overlap=2, tile_format='png').save(dzi_path)
+        descriptor = deepzoom.DZIDescriptor()
+        with open(dzi_path, 'rb') as dzi_file:
+            descriptor.open(dzi_file)
+        self.assertEqual((descriptor.width, descriptor.height, 
+                          descriptor.tile_size, descriptor.tile_overlap, 
+                          descriptor.tile_format), (700, 522, 64, 2, 'png'))
+        self.assertEqual(os.listdir(self.dest_root), ['cached.dzi'])
+        
+        cache = deepzoom.DescriptorCache(max_entries=2)
+        descriptor = cache.get(dzi_path)
+        self.assertTrue(cache.get(dzi_path) is descriptor)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        deepzoom.DZIDescriptor(width=701, height=522).save(dzi_path)
+        self.assertEqual(cache.get(dzi_path).width, 701)
+        
+        paths = [os.path.join(self.dest_root, '%s.dzi' % i) for i in range(2)]
+        for path in paths:
+            shutil.copy(dzi_path, path)
+            cache.get(path)
+        cache.get(dzi_path)
+        self.assertEqual(cache.misses, 5)
+        cache.get(paths[1])
+        self.assertEqual(cache.misses, 5)
+        
+        invalid_path = os.path.join(self.dest_root, 'invalid.dzi')
+        with open(invalid_path, 'w') as invalid_file:
+            invalid_file.write('<Image TileSize="254" Overlap="1"/>')
+        self.assertRaises(ValueError, cache.get, invalid_path)
+        with open(invalid_path, 'w') as invalid_file:
+            invalid_file.write('<Image')
+        self.assertRaises(deepzoom.ExpatError, cache.get, invalid_path)
+    # /test_descriptors_are_parsed_and_cached
+    
+    
+    def test_palette_source_tiles_match(self):
+        '''
+        7.29) Tests a palette source gives the same tiles created whole, one 
+            at a time, in stream mode and with the NumPy backend.
+        '''
+        image_path = os.path.join(self.dest_root, 'palette.png')
+        PILImage.open(os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+                      ).convert('P').save(image_path)
+        created_dir = self.create_deepzoom('created', image_path, 
+                                           tile_size=64, tile_overlap=2, 
+                                           tile_format='png')
+        single_dzi = os.path.join(self.dest_root, 'single.dzi')
+        creator = deepzoom.ImageCreator(tile_size=64, tile_overlap=2, 
+                                        tile_format='png')
+        for tile in list_tiles(created_dir):
+            level, name = os.path.split(tile)
+            column, row = os.path.splitext(name)[0].split('_')
+            creator.create_single_tile(image_path, single_dzi, int(level), 
+                                       int(column), int(row))
+        self.assertSameTiles(created_dir, 
+                             os.path.join(self.dest_root, 'single_files'))
+        stream_dir = self.create_deepzoom('stream', image_path, tile_size=64, 
+                                          tile_overlap=2, tile_format='png', 
+                                          pyramid_mode="stream")
+        self.assertSameTiles(created_dir, stream_dir)
+        if deepzoom.numpy is not None:
+            numpy_dir = self.create_deepzoom('numpy', image_path, tile_size=64, 
+                                             tile_overlap=2, tile_format='png', 
+                                             backend="numpy")
+            self.assertSameTiles(created_dir, numpy_dir)
+    # /test_palette_source_tiles_match
+    
+    
+    def test_fingerprint_changes_with_replaced_source(self):
+        '''
+        7.30) Tests the fingerprint of a source changes when it is replaced 
+            by a file of the same size within the same second.
+        '''
+        image_path = os.path.join(self.dest_root, 'source.tif')
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_PORTRAIT)).convert('RGB')
+        source.save(image_path)
+        modified = int(time.time()) * 10 ** 9
+        os.utime(image_path, ns=(modified, modified + 1000))
+        creator = deepzoom.ImageCreator()
+        fingerprint = creator.get_fingerprint(image_path)
+        self.assertEqual(creator.get_fingerprint(image_path), fingerprint)
+        
+        edited_path = os.path.join(self.dest_root, 'edited.tif')
+        source.putpixel((0, 0), (255, 0, 0))
+        source.save(edited_path)
+        self.assertEqual(os.path.getsize(edited_path), 
+                         os.path.getsize(image_path))
+        os.utime(edited_path, ns=(modified, modified + 2000))
+        os.rename(edited_path, image_path)
+        self.assertNotEqual(creator.get_fingerprint(image_path), fingerprint)
+    # /test_fingerprint_changes_with_replaced_source
+    
+    
+    def test_failed_tile_stops_parallel_workers(self):
+        '''
+        7.31) Tests a tile that fails to be written stops the other workers 
+            straight away, rather than after the tiles already queued.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'failed.dzi')
+        attempts = []
+        def _write(tile_writer, tile, tile_path):
+            attempts.append(tile_path)
+            raise IOError("disk full")
+        write = deepzoom.TileWriter.write
+        deepzoom.TileWriter.write = _write
+        try:
+            for pyramid_mode in ('cascade', 'stream'):
+                attempts = []
+                creator = deepzoom.ImageCreator(tile_size=32, workers=4, 
+                                                pyramid_mode=pyramid_mode)
+                self.assertRaises(IOError, creator.create, image_path, 
+                                  dzi_path)
+                self.assertTrue(0 < len(attempts) <= 4)
+                self.assertFalse(os.path.exists(dzi_path))
+        finally:
+            deepzoom.TileWriter.write = write
+    # /test_failed_tile_stops_parallel_workers
+    
+    
+    def test_generation_is_recorded_when_pyramid_is_finished(self):
+        '''
+        7.32) Tests the source's fingerprint is recorded as the generation of 
+            a pyramid once it is created or updated, that it is marked 
+            unfinished meanwhile, and dropped along with a cancelled one.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        dzi_path = os.path.join(self.dest_root, 'generation.dzi')
+        creator = deepzoom.ImageCreator(tile_size=64)
+        fingerprint = creator.get_fingerprint(image_path)
+        self.assertEqual(deepzoom.read_generation(dzi_path), None)
+        generations = []
+        def _progress(*report):
+            generations.append(deepzoom.read_generation(dzi_path))
+        creator.progress_interval = 0
+        creator.create(image_path, dzi_path, progress=_progress)
+        self.assertEqual(set(generations), set(['']))
+        self.assertEqual(deepzoom.read_generation(dzi_path), fingerprint)
+        
+        source = PILImage.open(image_path).convert('RGB')
+        edited_path = os.path.join(self.dest_root, 'edited.png')
+        source.putpixel((0, 0), (255, 0, 0))
+        source.save(edited_path)
+        write = deepzoom.TileWriter.write
+        def _write(tile_writer, tile, tile_path):
+            generations.append(deepzoom.read_generation(dzi_path))
+            return write(tile_writer, tile, tile_path)
+        generations = []
+        deepzoom.TileWriter.write = _write
+        try:
+            creator.update(image_path, edited_path, dzi_path)
+        finally:
+            deepzoom.TileWriter.write = write
+        self.assertEqual(set(generations), set(['']))
+        self.assertEqual(deepzoom.read_generation(dzi_path), 
+                         creator.get_fingerprint(edited_path))
+        
+        cancel = threading.Event()
+        cancel.set()
+        self.assertRaises(deepzoom.Cancelled, creator.create, image_path, 
+                          dzi_path, cancel=cancel)
+        self.assertEqual(deepzoom.read_generation(dzi_path), None)
+        self.assertEqual(os.listdir(self.dest_root), ['edited.png'])
+    # /test_generation_is_recorded_when_pyramid_is_finished
+    
+    
+    def suite():
+        tests = ['test_cascade_and_reference_modes_produce_same_pyramid', 
+                 'test_cascade_mode_reduces_each_level_from_the_one_above', 
+                 'test_unrecognized_pyramid_mode_defaults_to_cascade', 
+                 'test_parallel_workers_produce_identical_tiles', 
+                 'test_stream_mode_matches_cascade_mode', 
+                 'test_stream_mode_reads_striped_source_in_strips', 
+                 'test_numpy_backend_matches_pillow_backend', 
+                 'test_numpy_backend_levels_match_descriptor_geometry', 
+                 'test_scratch_backed_levels_leave_no_scratch_files', 
+                 'test_jpeg_tiles_are_encoded_once', 
+                 'test_atomic_tile_writes', 
+                 'test_uniform_tiles_are_linked', 
+                 'test_rewriting_a_linked_tile_leaves_its_links_alone', 
+                 'test_update_rewrites_only_changed_tiles', 
+                 'test_update_with_resized_source_creates_again', 
+                 'test_interrupted_create_resumes_from_checkpoint', 
+                 'test_resume_ignores_checkpoint_of_other_settings', 
+                 'test_single_tiles_match_created_tiles', 
+                 'test_single_tiles_from_cached_levels_match_created_tiles', 
+                 'test_tile_pack_matches_tile_files', 
+                 'test_update_appends_to_tile_pack', 
+                 'test_tiled_tiff_source_is_read_by_region', 
+                 'test_pyramidal_tiff_reductions_make_lower_levels', 
+                 'test_scaled_decode_makes_lower_levels_of_jpeg', 
+                 'test_progress_is_reported_at_intervals', 
+                 'test_cancelled_create_removes_partial_output', 
+                 'test_descriptor_tile_grid_geometry', 
+                 'test_descriptors_are_parsed_and_cached', 
+                 'test_palette_source_tiles_match', 
+                 'test_fingerprint_changes_with_replaced_source', 
+                 'test_failed_tile_stops_parallel_workers', 
+                 'test_generation_is_recorded_when_pyramid_is_finished']
+
+        return unittest.TestSuite(list(map(ImageCreatorTestCase, tests)))
+# /ImageCreatorTestCase
+
+
+class BackendConformanceMixin(object):
+    '''
+    8.) Conformance tests every resampling/encoding backend must pass.  Mix 
+        into a test case that sets `backend_name` to a registered backend.
+    '''
+    backend_name = None
+    
+    def setUp(self):
+        self.backend = deepzoom.get_backend(self.backend_name)
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        self.image = PILImage.open(image_path)
+        self.image.load()
+    
+    
+    def test_backend_is_registered(self):
+        '''
+        8.1) Tests the backend is selectable by its name.
+        '''
+        self.assertTrue(self.backend_name in deepzoom.backend_map)
+        self.assertEqual(self.backend.name, self.backend_name)
+        creator = deepzoom.ImageCreator(backend=self.backend_name)
+        self.assertEqual(creator.backend.name, self.backend_name)
+    # /test_backend_is_registered
+    
+    
+    def test_load_keeps_image_size(self):
+        '''
+        8.2) Tests a loaded level has the size of the image.
+        '''
+        level = self.backend.load(self.image.copy())
+        self.assertEqual(self.backend.get_size(level), self.image.size)
+    # /test_load_keeps_image_size
+    
+    
+    def test_reduce_halves_rounding_up(self):
+        '''
+        8.3) Tests reduce halves levels, rounding odd dimensions up, and keeps 
+            uniform colour.
+        '''
+        for size in [(8, 6), (7, 5), (1, 1), (2, 1)]:
+            image = PILImage.new("RGB", size, (200, 100, 50))
+            level = self.backend.reduce(self.backend.load(image))
+            self.assertEqual(self.backend.get_size(level), 
+                             ((size[0] + 1) // 2, (size[1] + 1) // 2))
+            tile = self.backend.get_tile(level, (0, 0) + self.backend.get_size(level))
+            self.assertEqual(tile.getextrema(), ((200, 200), (100, 100), (50, 50)))
+    # /test_reduce_halves_rounding_up
+    
+    
+    def test_rows_split_and_join(self):
+        '''
+        8.4) Tests a level split into rows and joined back is unchanged.
+        '''
+        width, height = self.image.size
+        level = self.backend.load(self.image.copy())
+        joined = self.backend.join_rows(self.backend.get_rows(level, 0, 100), 
+                                        self.backend.get_rows(level, 100, height))
+        self.assertEqual(self.backend.get_size(joined), (width, height))
+        tile = self.backend.get_tile(joined, (0, 0, width, height))
+        self.assertEqual(list(tile.getdata()), list(self.image.getdata()))
+    # /test_rows_split_and_join
+    
+    
+    def test_get_tile_matches_crop(self):
+        '''
+        8.5) Tests a tile is a Pillow image of the pixels within its bounds.
+        '''
+        bounds = (255, 0, 512, 257)
+        level = self.backend.load(self.image.copy())
+        tile = self.backend.get_tile(level, bounds)
+        self.assertEqual(tile.size, (257, 257))
+        self.assertEqual(list(tile.getdata()), 
+                         list(self.image.crop(bounds).getdata()))
+    # /test_get_tile_matches_crop
+    
+    
+    def test_encode_and_decode_tiles(self):
+        '''
+        8.6) Tests tiles encode to files that decode to the same size, and 
+            losslessly for PNG.
+        '''
+        tile = self.image.crop((0, 0, 64, 48))
+        tile_dir = os.path.join(settings.MEDIA_ROOT, 'backend_tiles')
+        if not os.path.isdir(tile_dir):
+            os.makedirs(tile_dir)
+        try:
+            for tile_format in deepzoom.image_format_map:
+                tile_path = os.path.join(tile_dir, "0_0." + tile_format)
+                with open(tile_path, "wb") as tile_file:
+                    self.backend.encode(tile, tile_file, tile_format, 0.9)
+                decoded = self.backend.decode(tile_path)
+                self.assertEqual(decoded.size, tile.size)
+                if tile_format == "png":
+                    self.assertEqual(list(decoded.getdata()), list(tile.getdata()))
+        finally:
+            reSet(settings.MEDIA_ROOT)
+    # /test_encode_and_decode_tiles
+    
+    
+    def test_nbytes_counts_level_pixels(self):
+        '''
+        8.7) Tests a level's size in memory is counted from its pixels.
+        '''
+        level = self.backend.load(self.image.convert('RGB'))
+        width, height = self.image.size
+        self.assertEqual(self.backend.get_nbytes(level), width * height * 3)
+    # /test_nbytes_counts_level_pixels
+# /BackendConformanceMixin
+
+
+class PillowBackendTestCase(BackendConformanceMixin, SimpleTestCase):
+    '''
+    8.a) Runs the backend conformance tests against the Pillow backend.
+    '''
+    backend_name = "pillow"
+# /PillowBackendTestCase
+
+
+@unittest.skipIf(deepzoom.numpy is None, "NumPy is not installed.")
+class NumPyBackendTestCase(BackendConformanceMixin, SimpleTestCase):
+    '''
+    8.b) Runs the backend conformance tests against the NumPy backend.
+    '''
+    backend_name = "numpy"
+# /NumPyBackendTestCase
+
+
+class RegisterBackendTestCase(SimpleTestCase):
+    '''
+    9.) Class tests registering third-party backends.
+    '''
+    def tearDown(self):
+        deepzoom.backend_map.pop("recording", None)
+        reSet(settings.MEDIA_ROOT)
+    
+    
+    def test_registered_backend_is_called_through(self):
+        '''
+        9.1) Tests a registered backend encodes every tile ImageCreator writes.
+        '''
+        encoded = []
+        class RecordingBackend(deepzoom.PillowBackend):
+            name = "recording"
+            def encode(self, tile, tile_file, tile_format, image_quality):
+                encoded.append(tile.size)
+                super(RecordingBackend, self).encode(tile, tile_file, 
+                                                     tile_format, image_quality)
+        deepzoom.register_backend("recording", RecordingBackend)
+        
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_SQUARE)
+        dzi_path = os.path.join(settings.MEDIA_ROOT, 'recording', 'square.dzi')
+        creator = deepzoom.ImageCreator(tile_size=128, backend="recording")
+        creator.create(image_path, dzi_path)
+        tiles = list_tiles(os.path.join(settings.MEDIA_ROOT, 'recording', 
+                                        'square_files'))
+        self.assertEqual(len(encoded), len(tiles))
+    # /test_registered_backend_is_called_through
+    
+    
+    def test_unregistered_backend_falls_back_to_pillow(self):
+        '''
+        9.2) Tests an unregistered backend name falls back to Pillow.
+        '''
+        self.assertEqual(deepzoom.get_backend("bogus").name, "pillow")
+    # /test_unregistered_backend_falls_back_to_pillow
+# /RegisterBackendTestCase
+
+
+
+@override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                   DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                   DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS, 
+                   DEEPZOOM_LAZY_TILES = True)
+class LazyTileViewTestCase(TestCase):
+    '''
+    10.) Class tests creating deep zoom tiles on request.
+    '''
+    def setUp(self):
+        self.factory = RequestFactory()
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        image = simulate_uploaded_file(image_path)
+        self.test_img = TestImage.objects.create(uploaded_image=image, 
+                                                 name='test_img_10', 
+                                                 create_deepzoom=True)
+        self.test_dz = self.test_img.associated_deepzoom
+        self.files_dir = self.test_dz.get_deepzoom_files_path()
+    
+    
+    def tearDown(self):
+        cache.get_tile_cache().clear()
+        cache.get_level_cache().clear()
+        reSet(settings.MEDIA_ROOT)
+    
+    
+    def get_tile(self, level, column, row, tile_format='png', slug=None):
+        '''
+        Requests a tile from the tile view.
+        '''
+        slug = slug or self.test_dz.slug
+        request = self.factory.get('/%s_files/%s/%s_%s.%s' % 
+                                   (slug, level, column, row, tile_format))
+        return views.deepzoom_tile(request, passed_slug=slug, level=str(level), 
+                                   column=str(column), row=str(row), 
+                                   tile_format=tile_format)
+    
+    
+    def test_saving_deepzoom_creates_no_tiles(self):
+        '''
+        10.1) Tests saving a deep zoom with lazy tiles saves its descriptor only.
+        '''
+        dz_file = os.path.join(settings.MEDIA_ROOT, self.test_dz.deepzoom_image)
+        self.assertTrue(os.path.isfile(dz_file))
+        self.assertEqual(list_tiles(self.files_dir), [])
+    # /test_saving_deepzoom_creates_no_tiles
+    
+    
+    def test_requested_tile_is_created_and_saved(self):
+        '''
+        10.2) Tests a requested tile is created, saved and served, and served 
+            from the saved file afterwards.
+        '''
+        response = self.get_tile(10, 1, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(list_tiles(self.files_dir), [os.path.join('10', '1_1.png')])
+        with open(os.path.join(self.files_dir, '10', '1_1.png'), 'rb') as tile_file:
+            self.assertEqual(response.content, tile_file.read())
+        
+        create_single_tile = deepzoom.ImageCreator.create_single_tile
+        deepzoom.ImageCreator.create_single_tile = None
+        try:
+            self.assertEqual(self.get_tile(10, 1, 1).content, response.content)
+        finally:
+            deepzoom.ImageCreator.create_single_tile = create_single_tile
+    # /test_requested_tile_is_created_and_saved
+    
+    
+    def test_missing_tiles_are_not_found(self):
+        '''
+        10.3) Tests tiles outside the deep zoom, in another format or of an 
+            unknown deep zoom are not found.
+        '''
+        self.assertRaises(Http404, self.get_tile, 10, 99, 0)
+        self.assertRaises(Http404, self.get_tile, 99, 0, 0)
+        self.assertRaises(Http404, self.get_tile, 0, 0, 0, 'jpg')
+        self.assertRaises(Http404, self.get_tile, 0, 0, 0, 'png', 'unknown')
+        self.assertEqual(list_tiles(self.files_dir), [])
+    # /test_missing_tiles_are_not_found
+    
+    
+    def test_concurrent_calls_are_coalesced(self):
+        '''
+        10.4) Tests concurrent calls for the same key run once and share the 
+            result.
+        '''
+        single_flight = SingleFlight()
+        calls = []
+        def render(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return key.upper()
+        results = []
+        def request():
+            results.append(single_flight.do('tile', render, 'tile'))
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, ['tile'])
+        self.assertEqual(results, ['TILE'] * 8)
+        self.assertEqual(single_flight.do('tile', render, 'tile'), 'TILE')
+        self.assertEqual(len(calls), 2)
+    # /test_concurrent_calls_are_coalesced
+    
+    
+    def test_served_tiles_are_cached_until_deepzoom_is_deleted(self):
+        '''
+        10.5) Tests served tiles are kept in the tile cache, and the levels 
+            they were cropped from in the level cache, until the deep zoom is 
+            deleted.
+        '''
+        tile_cache = cache.get_tile_cache()
+        level_cache = cache.get_level_cache()
+        content = self.get_tile(8, 0, 0).content
+        self.assertTrue((self.test_dz.slug, self.test_dz.get_fingerprint(), 8) 
+                        in level_cache)
+        os.remove(os.path.join(self.files_dir, '8', '0_0.png'))
+        self.assertEqual(self.get_tile(8, 0, 0).content, content)
+        self.assertEqual(tile_cache.hits, 1)
+        self.assertEqual(tile_cache.bytes, len(content))
+        
+        self.test_dz.delete()
+        self.assertEqual(len(tile_cache), 0)
+        self.assertEqual(len(level_cache), 0)
+        self.assertRaises(Http404, self.get_tile, 8, 0, 0)
+    # /test_served_tiles_are_cached_until_deepzoom_is_deleted
+    
+    
+    def test_cached_tiles_of_replaced_image_are_not_served(self):
+        '''
+        10.6) Tests tiles and levels cached before the uploaded image was 
+            replaced and its deep zoom updated, e.g. in another process, are 
+            neither served nor used to create the tiles of the new image.
+        '''
+        content = self.get_tile(8, 0, 0).content
+        etag = self.get_tile(8, 0, 0)['ETag']
+        self.assertEqual(cache.get_tile_cache().hits, 1)
+        
+        image_path = os.path.join(settings.MEDIA_ROOT, 
+                                  self.test_dz.associated_image)
+        edited_path = image_path + '.edited.png'
+        PILImage.open(image_path).rotate(180).save(edited_path)
+        os.rename(edited_path, image_path)
+        shutil.rmtree(self.files_dir)
+        self.test_dz.get_deepzoom_creator().create_descriptor(
+            image_path, os.path.join(settings.MEDIA_ROOT, 
+                                     self.test_dz.deepzoom_image))
+        
+        response = self.get_tile(8, 0, 0)
+        self.assertNotEqual(response.content, content)
+        self.assertNotEqual(response['ETag'], etag)
+        dzi_path = os.path.join(settings.MEDIA_ROOT, 'expected.dzi')
+        tile_path = self.test_dz.get_deepzoom_creator().create_single_tile(
+            image_path, dzi_path, 8, 0, 0)
+        with open(tile_path, 'rb') as tile_file:
+            self.assertEqual(response.content, tile_file.read())
+        with open(os.path.join(self.files_dir, '8', '0_0.png'), 'rb') as tile_file:
+            self.assertEqual(response.content, tile_file.read())
+    # /test_cached_tiles_of_replaced_image_are_not_served
+    
+    
+    def suite():
+        tests = ['test_saving_deepzoom_creates_no_tiles', 
+                 'test_requested_tile_is_created_and_saved', 
+                 'test_missing_tiles_are_not_found', 
+                 'test_concurrent_calls_are_coalesced', 
+                 'test_served_tiles_are_cached_until_deepzoom_is_deleted', 
+                 'test_cached_tiles_of_replaced_image_are_not_served']
+
+        return unittest.TestSuite(list(map(LazyTileViewTestCase, tests)))
+# /LazyTileViewTestCase
+
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    '''
+    11.) Class tests the in-process LRU cache.
+    '''
+    def test_least_recently_used_values_are_evicted(self):
+        '''
+        11.1) Tests the cache keeps within its size by evicting the least 
+            recently used values, and accounts for their bytes.
+        '''
+        lru_cache = cache.LRUCache(10)
+        lru_cache.set('a', 'A', 4)
+        lru_cache.set('b', 'B', 4)
+        self.assertEqual(lru_cache.get('a'), 'A')
+        lru_cache.set('c', 'C', 4)
+        self.assertEqual(lru_cache.get('b'), None)
+        self.assertEqual(lru_cache.get('a'), 'A')
+        self.assertEqual(lru_cache.get('c'), 'C')
+        self.assertEqual(lru_cache.bytes, 8)
+        self.assertEqual(lru_cache.evictions, 1)
+        
+        lru_cache.set('a', 'AA', 6)
+        self.assertEqual(lru_cache.bytes, 10)
+        self.assertEqual(len(lru_cache), 2)
+        lru_cache.resize(6)
+        self.assertEqual(lru_cache.get('c'), None)
+        self.assertEqual(lru_cache.bytes, 6)
+    # /test_least_recently_used_values_are_evicted
+    
+    
+    def test_hits_misses_and_oversized_values(self):
+        '''
+        11.2) Tests hits and misses are counted and values bigger than the 
+            cache aren't cached.
+        '''
+        lru_cache = cache.LRUCache(10)
+        self.assertFalse(lru_cache.set('big', 'BIG', 11))
+        self.assertTrue(lru_cache.set('small', 'SMALL', 10))
+        self.assertEqual(lru_cache.get('big', 'missing'), 'missing')
+        self.assertEqual(lru_cache.get('small'), 'SMALL')
+        self.assertEqual((lru_cache.hits, lru_cache.misses), (1, 1))
+        lru_cache.delete('small')
+        self.assertEqual((len(lru_cache), lru_cache.bytes), (0, 0))
+    # /test_hits_misses_and_oversized_values
+    
+    
+    def test_concurrent_use_keeps_accounts(self):
+        '''
+        11.3) Tests concurrent use from many threads keeps the byte and 
+            lookup counts right.
+        '''
+        lru_cache = cache.LRUCache(1000)
+        def use(thread):
+            for i in range(500):
+                key = (thread, i % 50)
+                if lru_cache.get(key) is None:
+                    lru_cache.set(key, i, 1 + i % 7)
+        threads = [threading.Thread(target=use, args=(thread,)) 
+                   for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(lru_cache.hits + lru_cache.misses, 8 * 500)
+        self.assertTrue(lru_cache.bytes <= 1000)
+        self.assertEqual(lru_cache.bytes, 
+                         sum(lru_cache._items[key][1] for key in lru_cache._items))
+    # /test_concurrent_use_keeps_accounts
+    
+    
+    @override_settings(DEEPZOOM_CACHE = {'tile_bytes': 1000})
+    def test_caches_are_sized_from_settings(self):
+        '''
+        11.4) Tests the caches are sized from `DEEPZOOM_CACHE`, with defaults 
+            for missing sizes.
+        '''
+        self.assertEqual(cache.get_tile_cache().max_bytes, 1000)
+        self.assertEqual(cache.get_level_cache().max_bytes, 
+                         cache.DEFAULT_DEEPZOOM_CACHE['level_bytes'])
+    # /test_caches_are_sized_from_settings
+    
+    
+    def suite():
+        tests = ['test_least_recently_used_values_are_evicted', 
+                 'test_hits_misses_and_oversized_values', 
+                 'test_concurrent_use_keeps_accounts', 
+                 'test_caches_are_sized_from_settings']
+
+        return unittest.TestSuite(list(map(LRUCacheTestCase, tests)))
+# /LRUCacheTestCase
+
+
+
+SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}, 
+                 'deepzoom_locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 
+                                     'LOCATION': 'deepzoom-tests'}, 
+                 'deepzoom_files': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 
+                                    'LOCATION': os.path.join(tempfile.gettempdir(), 
+                                                             'deepzoom-tests-cache')}}
+
+@override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                   DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                   DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS, 
+                   CACHES = SHARED_CACHES)
+class SharedTileCacheTestCase(TestCase):
+    '''
+    12.) Class tests sharing tiles through a Django cache.
+    '''
+    def setUp(self):
+        self.factory = RequestFactory()
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        image = simulate_uploaded_file(image_path)
+        self.test_img = TestImage.objects.create(uploaded_image=image, 
+                                                 name='test_img_12', 
+                                                 create_deepzoom=True)
+        self.test_dz = self.test_img.associated_deepzoom
+        self.files_dir = self.test_dz.get_deepzoom_files_path()
+    
+    
+    def tearDown(self):
+        from django.core.cache import caches
+        for alias in ('deepzoom_locmem', 'deepzoom_files'):
+            caches[alias].clear()
+        reSet(settings.MEDIA_ROOT)
+    
+    
+    def get_tile(self, level, column, row, tile_format='png'):
+        '''
+        Requests a tile from the tile view.
+        '''
+        slug = self.test_dz.slug
+        request = self.factory.get('/%s_files/%s/%s_%s.%s' % 
+                                   (slug, level, column, row, tile_format))
+        return views.deepzoom_tile(request, passed_slug=slug, level=str(level), 
+                                   column=str(column), row=str(row), 
+                                   tile_format=tile_format)
+    
+    
+    def for_each_cache(test):
+        '''
+        Runs a test once with each shared cache backend and the in-process 
+        tile cache turned off.
+        '''
+        @wraps(test)
+        def run(self):
+            for alias in ('deepzoom_locmem', 'deepzoom_files'):
+                if alias != 'deepzoom_locmem':
+                    self.test_img.delete()
+                    self.tearDown()
+                    self.setUp()
+                with override_settings(DEEPZOOM_CACHE = {'tile_bytes': 0, 
+                                                         'shared_cache': alias}):
+                    test(self)
+        return run
+    
+    
+    @for_each_cache
+    def test_tiles_are_shared_with_neighbours(self):
+        '''
+        12.1) Tests a served tile and its neighbours are kept in the shared 
+            cache and served from it without touching the database or disk.
+        '''
+        contents = {}
+        for (column, row) in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            with open(os.path.join(self.files_dir, '10', '%s_%s.png' % 
+                                   (column, row)), 'rb') as tile_file:
+                contents[(column, row)] = tile_file.read()
+        self.assertEqual(self.get_tile(10, 0, 0).content, contents[(0, 0)])
+        shutil.rmtree(self.files_dir)
+        with self.assertNumQueries(0):
+            for (column, row) in contents:
+                self.assertEqual(self.get_tile(10, column, row).content, 
+                                 contents[(column, row)])
+            self.assertRaises(Http404, self.get_tile, 10, 2, 0)
+            self.assertRaises(Http404, self.get_tile, 11, 0, 0)
+            self.assertRaises(Http404, self.get_tile, 10, 0, 0, 'jpg')
+    # /test_tiles_are_shared_with_neighbours
+    
+    
+    @for_each_cache
+    def test_tiles_are_versioned_by_generation(self):
+        '''
+        12.2) Tests shared tiles are cached under the fingerprint of their 
+            pyramid and retired when the deep zoom is forgotten.
+        '''
+        shared_cache = cache.get_shared_cache()
+        slug = self.test_dz.slug
+        content = self.get_tile(9, 0, 0).content
+        fingerprint = self.test_dz.get_fingerprint()
+        self.assertEqual(shared_cache.get_generation(slug), fingerprint)
+        self.assertEqual(shared_cache.get_tile(slug, fingerprint, 9, 0, 0, 
+                                               'png')[0][0], content)
+        self.assertEqual(shared_cache.get_tile(slug, 'other', 9, 0, 0, 'png'), 
+                         (None, None))
+        
+        with override_settings(DEEPZOOM_PARAMS = dict(VALID_DEEPZOOM_PARAMS, 
+                                                      image_quality=0.5)):
+            #The pyramid on disk is still the one made with the old settings.
+            self.assertEqual(self.test_dz.get_fingerprint(), fingerprint)
+        
+        cache.forget_deepzoom(slug)
+        self.assertEqual(shared_cache.get_generation(slug), None)
+        self.assertEqual(self.get_tile(9, 0, 0).content, content)
+    # /test_tiles_are_versioned_by_generation
+    
+    
+    @for_each_cache
+    def test_tiles_read_during_update_are_not_kept(self):
+        '''
+        12.3) Tests tiles served while a deep zoom is updated are not cached, 
+            and are unversioned, until the update is done.
+        '''
+        served = []
+        def _update(creator, previous_source, source, destination):
+            self.assertEqual(self.test_dz.get_fingerprint(), None)
+            with both_caches:
+                served.append(self.get_tile(10, 0, 0).content)
+            return update(creator, previous_source, source, destination)
+        #Turn the in-process tile cache back on, next to the shared cache.
+        both_caches = override_settings(DEEPZOOM_CACHE = {
+            'shared_cache': settings.DEEPZOOM_CACHE['shared_cache']})
+        fingerprint = self.test_dz.get_fingerprint()
+        source = PILImage.open(self.test_img.uploaded_image.path)
+        edited_path = os.path.join(settings.MEDIA_ROOT, 'edited.png')
+        source.point(lambda value: 255 - value).save(edited_path)
+        update = deepzoom.ImageCreator.update
+        deepzoom.ImageCreator.update = _update
+        try:
+            with override_settings(DEEPZOOM_INCREMENTAL_UPDATES = True):
+                self.test_img.uploaded_image = simulate_uploaded_file(edited_path)
+                self.test_img.save()
+        finally:
+            deepzoom.ImageCreator.update = update
+        
+        with open(os.path.join(self.files_dir, '10', '0_0.png'), 'rb') as tile_file:
+            content = tile_file.read()
+        self.assertNotEqual(served, [content])
+        self.assertNotEqual(self.test_dz.get_fingerprint(), fingerprint)
+        with both_caches:
+            self.assertEqual(self.get_tile(10, 0, 0).content, content)
+            cache.get_tile_cache().clear()
+    # /test_tiles_read_during_update_are_not_kept
+    
+    
+    def suite():
+        tests = ['test_tiles_are_shared_with_neighbours', 
+                 'test_tiles_are_versioned_by_generation', 
+                 'test_tiles_read_during_update_are_not_kept']
+
+        return unittest.TestSuite(list(map(SharedTileCacheTestCase, tests)))
+# /SharedTileCacheTestCase
+
+
+
+@override_settings(UPLOADEDIMAGE_ROOT = VALID_UPLOADEDIMAGE_ROOT, 
+                   DEEPZOOM_ROOT = VALID_DEEPZOOM_ROOT, 
+                   DEEPZOOM_PARAMS = VALID_DEEPZOOM_PARAMS)
+class TileResponseTestCase(TestCase):
+    '''
+    13.) Class tests the caching headers and bodies of served deep zoom files.
+    '''
+    def setUp(self):
+        self.factory = RequestFactory()
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_LANDSCAPE)
+        image = simulate_uploaded_file(image_path)
+        self.test_img = TestImage.objects.create(uploaded_image=image, 
+                                                 name='test_img_13', 
+                                                 create_deepzoom=True)
+        self.test_dz = self.test_img.associated_deepzoom
+        self.tile_path = os.path.join(self.test_dz.get_deepzoom_files_path(), 
+                                      '10', '0_0.png')
+    
+    
+    def tearDown(self):
+        cache.get_tile_cache().clear()
+        reSet(settings.MEDIA_ROOT)
+    
+    
+    def get_tile(self, method='get', query='', **headers):
+        '''
+        Requests tile 10/0_0 from the tile view.
+        '''
+        slug = self.test_dz.slug
+        request = getattr(self.factory, method)(
+            '/%s_files/10/0_0.png%s' % (slug, query), **headers)
+        return views.deepzoom_tile(request, passed_slug=slug, level='10', 
+                                   column='0', row='0', tile_format='png')
+    
+    
+    def test_conditional_requests_are_not_modified(self):
+        '''
+        13.1) Tests tiles carry validators, and requests with a matching 
+            `If-None-Match` or a recent `If-Modified-Since` are answered with 
+            304 Not Modified.
+        '''
+        response = self.get_tile()
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(response['Cache-Control'], views.REVALIDATE_CACHE_CONTROL)
+        
+        response = self.get_tile(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, six.b(''))
+        response = self.get_tile(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response = self.get_tile(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+    # /test_conditional_requests_are_not_modified
+    
+    
+    def test_versioned_requests_are_immutable(self):
+        '''
+        13.2) Tests requests naming the current pyramid as their version may 
+            be cached forever, and others, or any while the pyramid is being 
+            updated, must be revalidated.
+        '''
+        fingerprint = self.test_dz.get_fingerprint()
+        response = self.get_tile(query='?v=' + fingerprint)
+        self.assertEqual(response['Cache-Control'], views.IMMUTABLE_CACHE_CONTROL)
+        response = self.get_tile(query='?v=old')
+        self.assertEqual(response['Cache-Control'], views.REVALIDATE_CACHE_CONTROL)
+        
+        dzi_path = os.path.join(settings.MEDIA_ROOT, self.test_dz.deepzoom_image)
+        deepzoom.write_generation(dzi_path)
+        response = self.get_tile(query='?v=' + fingerprint)
+        self.assertEqual(response['Cache-Control'], views.REVALIDATE_CACHE_CONTROL)
+        deepzoom.write_generation(dzi_path, fingerprint)
+        response = self.get_tile(query='?v=' + fingerprint)
+        self.assertEqual(response['Cache-Control'], views.IMMUTABLE_CACHE_CONTROL)
+    # /test_versioned_requests_are_immutable
+    
+    
+    def test_head_and_descriptor_requests(self):
+        '''
+        13.3) Tests HEAD requests are answered without a body, other methods 
+            aren't allowed, and descriptors are served too.
+        '''
+        response = self.get_tile(method='head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, six.b(''))
+        self.assertEqual(int(response['Content-Length']), 
+                         os.path.getsize(self.tile_path))
+        self.assertEqual(self.get_tile(method='post').status_code, 405)
+        
+        slug = self.test_dz.slug
+        request = self.factory.get('/%s.dzi' % slug)
+        response = views.deepzoom_descriptor(request, passed_slug=slug)
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        with open(os.path.join(settings.MEDIA_ROOT, 
+                               self.test_dz.deepzoom_image), 'rb') as dzi_file:
+            self.assertEqual(response.content, dzi_file.read())
+        self.assertRaises(Http404, views.deepzoom_descriptor, request, 
+                          passed_slug='unknown')
+    # /test_head_and_descriptor_requests
+    
+    
+    def test_files_are_handed_to_front_end_server(self):
+        '''
+        13.4) Tests `DEEPZOOM_SENDFILE` hands tile files to the front-end 
+            server instead of sending them, and is ignored if unknown.
+        '''
+        with override_settings(DEEPZOOM_SENDFILE = 'X-Accel-Redirect'):
+            response = self.get_tile()
+            self.assertEqual(response.content, six.b(''))
+            self.assertEqual(response['X-Accel-Redirect'], 
+                             settings.MEDIA_URL + os.path.relpath(
+                                 self.tile_path, settings.MEDIA_ROOT))
+            etag = response['ETag']
+        with override_settings(DEEPZOOM_SENDFILE = 'x-sendfile'):
+            response = self.get_tile()
+            self.assertEqual(response['X-Sendfile'], self.tile_path)
+            self.assertEqual(self.get_tile(HTTP_IF_NONE_MATCH=etag).status_code, 
+                             304)
+        with override_settings(DEEPZOOM_SENDFILE = 'unknown'):
+            response = self.get_tile()
+            self.assertEqual(response['ETag'], etag)
+            with open(self.tile_path, 'rb') as tile_file:
+                self.assertEqual(response.content, tile_file.read())
+    # /test_files_are_handed_to_front_end_server
+    
+    
+    @override_settings(DEEPZOOM_PARAMS = dict(VALID_DEEPZOOM_PARAMS, 
+                                              tile_pack=True))
+    def test_tiles_are_served_from_tile_pack(self):
+        '''
+        13.5) Tests the tiles of a deep zoom saved as a tile pack are served 
+            from the pack, also if `DEEPZOOM_SENDFILE` is set, and a pack 
+            replaced while its tiles are read can still be read.
+        '''
+        image_path = os.path.join(settings.TEST_ROOT, TEST_IMAGE_PORTRAIT)
+        image = simulate_uploaded_file(image_path)
+        test_img = TestImage.objects.create(uploaded_image=image, 
+                                            name='test_img_13_pack', 
+                                            create_deepzoom=True)
+        self.test_dz = test_img.associated_deepzoom
+        pack_path = self.test_dz.get_deepzoom_pack_path()
+        self.assertFalse(os.path.exists(self.test_dz.get_deepzoom_files_path()))
+        pack = cache.get_tile_pack(pack_path)
+        self.assertTrue(pack is cache.get_tile_pack(pack_path))
+        
+        response = self.get_tile()
+        self.assertEqual(response.content, pack.get_tile(10, 0, 0))
+        with override_settings(DEEPZOOM_SENDFILE = 'X-Sendfile'):
+            response = self.get_tile()
+            self.assertFalse(response.has_header('X-Sendfile'))
+            self.assertEqual(response.content, pack.get_tile(10, 0, 0))
+        self.assertRaises(Http404, views.deepzoom_tile, 
+                          self.factory.get('/'), passed_slug=self.test_dz.slug, 
+                          level='10', column='9', row='0', tile_format='png')
+        
+        content = pack.get_tile(10, 0, 0).tobytes()
+        replaced_path = pack_path + '.replaced'
+        shutil.copyfile(pack_path, replaced_path)
+        os.rename(replaced_path, pack_path)
+        replaced = cache.get_tile_pack(pack_path)
+        self.assertFalse(replaced is pack)
+        self.assertEqual(pack.get_tile(10, 0, 0), content)
+        self.assertEqual(replaced.get_tile(10, 0, 0), content)
+    # /test_tiles_are_served_from_tile_pack
+    
+    
+    def suite():
+        tests = ['test_conditional_requests_are_not_modified', 
+                 'test_versioned_requests_are_immutable', 
+                 'test_head_and_descriptor_requests', 
+                 'test_files_are_handed_to_front_end_server', 
+                 'test_tiles_are_served_from_tile_pack']
+
+        return unittest.TestSuite(list(map(TileResponseTestCase, tests)))
+# /TileResponseTestCase
+
+
+class BenchmarkTestCase(SimpleTestCase):
+    '''
+    14.) Class tests the benchmark cases, measurements and baseline comparison.
+    '''
+    def setUp(self):
+        self.dest_root = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.dest_root, ignore_errors=True)
+    
+    
+    def test_cases_vary_one_setting_at_a_time(self):
+        '''
+        14.1) Tests each case of a profile differs from the base case in a 
+            single setting, and fixtures have the megapixels and aspect asked.
+        '''
+        cases = benchmark.get_cases('quick')
+        self.assertEqual(len(cases), len(set(case['id'] for case in cases)))
+        for case in cases:
+            if case['kind'] == 'image':
+                changed = [key for key in benchmark.BASE_CASE 
+                           if case[key] != benchmark.BASE_CASE[key]]
+                self.assertTrue(len(changed) <= 1)
+        self.assertEqual(len([case for case in cases 
+                              if case['kind'] == 'collection']), 1)
+        self.assertTrue(all(case.get('megapixels', 0) <= 1 
+                            for case in benchmark.get_cases('full', 1)))
+        
+        width, height = benchmark.get_fixture_size(2, '16:9')
+        self.assertTrue(abs(width * height - 2000000) < width)
+        self.assertTrue(abs(float(width) / height - 16.0 / 9) < 0.01)
+    # /test_cases_vary_one_setting_at_a_time
+    
+    
+    def test_run_case_measures_output(self):
+        '''
+        14.2) Tests a case run counts the tiles and bytes it wrote.
+        '''
+        case = dict(benchmark.BASE_CASE, megapixels=0.05, fixture='noise')
+        work_dir = os.path.join(self.dest_root, 'work')
+        os.mkdir(work_dir)
+        result = benchmark.run_case(case, self.dest_root, work_dir)
+        tiles = list_tiles(os.path.join(work_dir, 'image_files'))
+        self.assertEqual(result['tiles'], len(tiles))
+        self.assertTrue(result['bytes_written'] > 
+                        sum(os.path.getsize(os.path.join(work_dir, 
+                                                         'image_files', tile)) 
+                            for tile in tiles))
+        self.assertTrue(result['wall_time'] > 0)
+        self.assertTrue(result['tiles_per_second'] > 0)
+    # /test_run_case_measures_output
+    
+    
+    def test_regressions_against_baseline(self):
+        '''
+        14.3) Tests slowdowns, peak RSS growth, tile count changes and new 
+            failures are regressions, and timer noise isn't.
+        '''
+        result = {'id': 'case', 'wall_time': 1.0, 'peak_rss': 100, 'tiles': 10}
+        baseline = {'results': [result]}
+        self.assertEqual(benchmark.compare([result], baseline), [])
+        for change in ({'wall_time': 1.3}, {'peak_rss': 130}, {'tiles': 11}, 
+                       {'error': 'TypeError'}):
+            regressions = benchmark.compare([dict(result, **change)], baseline)
+            self.assertEqual(len(regressions), 1)
+        
+        fast = dict(result, wall_time=0.01)
+        self.assertEqual(benchmark.compare([dict(fast, wall_time=0.03)], 
+                                           {'results': [fast]}), [])
+        self.assertEqual(benchmark.compare([dict(result, id='new')], baseline), 
+                         [])
+    # /test_regressions_against_baseline
+    
+    
+    def suite():
+        tests = ['test_cases_vary_one_setting_at_a_time', 
+                 'test_run_case_measures_output', 
+                 'test_regressions_against_baseline']
+
+        return unittest.TestSuite(list(map(BenchmarkTestCase, tests)))
+# /BenchmarkTestCase
+
+
+class CollectionCreatorTestCase(SimpleTestCase):
+    '''
+    15.) Class tests the creation of deep zoom collections.
+    '''
+    def setUp(self):
+        self.dest_root = tempfile.mkdtemp()
+        source = PILImage.open(os.path.join(settings.TEST_ROOT, 
+                                            TEST_IMAGE_LANDSCAPE)).convert('RGB')
+        creator = deepzoom.ImageCreator(tile_size=256, tile_overlap=0, 
+                                        tile_format='png')
+        self.items = []
+        for i in range(3):
+            image_path = os.path.join(self.dest_root, 'item%s.png' % i)
+            source.rotate(i * 90).resize((300, 200)).save(image_path)
+            dzi_path = os.path.join(self.dest_root, 'item%s.dzi' % i)
+            creator.create(image_path, dzi_path)
+            self.items.append(dzi_path)
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.dest_root, ignore_errors=True)
+    
+    
+    def get_thumbnail(self, _item, _level):
+        '''
+        Returns the thumbnail of an item at a level of a collection.
+        '''
+        return PILImage.open(os.path.join(os.path.splitext(_item)[0] + '_files', 
+                                          str(_level), '0_0.png'))
+    
+    
+    def test_collection_tiles_are_composited_once(self):
+        '''
+        15.1) Tests every collection tile is encoded once and holds the 
+            thumbnails of its items, pasted in Z-order.
+        '''
+        images = [self.items[i % len(self.items)] for i in range(20)]
+        dxc_path = os.path.join(self.dest_root, 'collection.dxc')
+        creator = deepzoom.CollectionCreator(tile_format='png')
+        creator.create(images, dxc_path)
+        files_dir = os.path.join(self.dest_root, 'collection_files')
+        tiles = list_tiles(files_dir)
+        self.assertEqual(creator.tile_writer.tiles_written, len(tiles))
+        self.assertEqual(len([tile for tile in tiles 
+                              if tile.startswith('8' + os.sep)]), 20)
+        
+        for level in (3, 6, 8):
+            expected = {}
+            for (i, path) in enumerate(images):
+                position = creator._get_tile_position(i, level, 256)
+                column, row = creator._get_position(i)
+                per_tile = 256 // 2 ** level
+                tile = expected.setdefault(position, 
+                                           PILImage.new('RGB', (256, 256)))
+                tile.paste(self.get_thumbnail(path, level), 
+                           ((column % per_tile) * 2 ** level, 
+                            (row % per_tile) * 2 ** level))
+            for ((column, row), tile) in expected.items():
+                created = PILImage.open(os.path.join(
+                    files_dir, str(level), '%s_%s.png' % (column, row)))
+                self.assertEqual(created.tobytes(), tile.tobytes())
+        
+        with open(dxc_path, 'rb') as dxc_file:
+            collection = dxc_file.read()
+        self.assertTrue(b'NextItemId="20"' in collection)
+        self.assertEqual(collection.count(b'<I '), 20)
+    # /test_collection_tiles_are_composited_once
+    
+    
+    def test_morton_codec(self):
+        '''
+        15.2) Tests Z-orders (Morton numbers) are encoded and decoded through 
+            the lookup tables, one at a time or in a batch, and collections 
+            are laid out the same either way.
+        '''
+        self.assertEqual(deepzoom.morton_decode(0), (0, 0))
+        self.assertEqual(deepzoom.morton_decode(0b1110), (2, 3))
+        self.assertEqual(deepzoom.morton_encode(2, 3), 0b1110)
+        self.assertEqual(deepzoom.morton_encode(0xffff, 0), 
+                         0x55555555)
+        for z_order in (1, 255, 256, 65537, 2 ** 31 + 12345, 2 ** 40 - 1):
+            column, row = deepzoom.morton_decode(z_order)
+            self.assertEqual(deepzoom.morton_encode(column, row), z_order)
+        
+        z_orders = list(range(5000)) + [2 ** 40 - 1]
+        if deepzoom.numpy is not None:
+            columns, rows = deepzoom.morton_decode_array(z_orders)
+            self.assertEqual(list(zip(columns.tolist(), rows.tolist())), 
+                             [deepzoom.morton_decode(z) for z in z_orders])
+        
+        creator = deepzoom.CollectionCreator()
+        items = list(range(5000))
+        batch = creator._get_positions(items)
+        creator.batch_positions = len(items) + 1
+        scalar = creator._get_positions(items)
+        self.assertEqual(list(scalar[0]), list(batch[0]))
+        self.assertEqual(list(scalar[1]), list(batch[1]))
+        for level in (0, 4, 8):
+            self.assertEqual(creator._get_level_tiles(level, items, batch), 
+                             creator._get_level_tiles(level, items, scalar))
+    # /test_morton_codec
+    
+    
+    def test_parallel_collection_is_deterministic(self):
+        '''
+        15.3) Tests a collection built by a pool of workers, in shards, is 
+            the same, tile for tile, as one built by a single worker.
+        '''
+        images = [self.items[i % len(self.items)] for i in range(40)]
+        built = []
+        for workers in (1, 4):
+            dxc_path = os.path.join(self.dest_root, 'collection%s.dxc' % workers)
+            creator = deepzoom.CollectionCreator(tile_format='png', 
+                                                 workers=workers)
+            creator.shard_items = 3
+            creator.create(images, dxc_path)
+            files_dir = os.path.splitext(dxc_path)[0] + '_files'
+            tiles = {}
+            for tile in list_tiles(files_dir):
+                with open(os.path.join(files_dir, tile), 'rb') as tile_file:
+                    tiles[tile] = tile_file.read()
+            self.assertEqual(creator.tile_writer.tiles_written, len(tiles))
+            built.append(tiles)
+        self.assertEqual(built[0], built[1])
+        self.assertEqual(deepzoom.CollectionCreator(workers=0).workers, 1)
+    # /test_parallel_collection_is_deterministic
+    
+    
+    def test_append_to_collection(self):
+        '''
+        15.4) Tests appending images to a collection only composites the 
+            tiles of the new items, and ends up with the same tiles and 
+            descriptor as creating the collection in one go.
+        '''
+        images = [self.items[i % len(self.items)] for i in range(12)]
+        built = []
+        for name in ('created', 'appended'):
+            dxc_path = os.path.join(self.dest_root, '%s.dxc' % name)
+            if name == 'created':
+                deepzoom.CollectionCreator(tile_format='png').create(images, 
+                                                                     dxc_path)
+            else:
+                deepzoom.CollectionCreator(tile_format='png').create(images[:5], 
+                                                                     dxc_path)
+                creator = deepzoom.CollectionCreator(tile_format='png')
+                creator.append(images[5:], dxc_path)
+            files_dir = os.path.splitext(dxc_path)[0] + '_files'
+            tiles = {}
+            for tile in list_tiles(files_dir):
+                with open(os.path.join(files_dir, tile), 'rb') as tile_file:
+                    tiles[tile] = tile_file.read()
+            with open(dxc_path, 'rb') as dxc_file:
+                built.append((dxc_file.read(), tiles))
+        self.assertEqual(built[0], built[1])
+        # items 5-11 fall in 7 tiles at level 8, of 1 item each, in 2 at 
+        # level 7, of 4 items each, and in 1 at every level below
+        self.assertEqual(creator.tile_writer.tiles_written, 7 + 2 + 7)
+        self.assertTrue(b'NextItemId="12"' in built[1][0])
+        
+        empty_path = os.path.join(self.dest_root, 'empty.dxc')
+        deepzoom.CollectionCreator(tile_format='png').create([], empty_path)
+        deepzoom.CollectionCreator(tile_format='png').append(images, empty_path)
+        with open(empty_path, 'rb') as dxc_file:
+            self.assertEqual(dxc_file.read(), built[0][0])
+        
+        self.assertRaises(ValueError, 
+                          deepzoom.CollectionCreator(tile_format='jpg').append, 
+                          images, empty_path)
+    # /test_append_to_collection
+    
+    
+    def suite():
+        tests = ['test_collection_tiles_are_composited_once', 
+                 'test_morton_codec', 
+                 'test_parallel_collection_is_deterministic', 
+                 'test_append_to_collection']
+
+        return unittest.TestSuite(list(map(CollectionCreatorTestCase, tests)))
+# /CollectionCreatorTestCase
+
+
 #EOF - django-deepzoom tests
\ No newline at end of file
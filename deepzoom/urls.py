@@ -0,0 +1,24 @@
+'''django-deepzoom urls'''
+
+try:
+    from django.urls import re_path as url
+except ImportError:
+    from django.conf.urls import url
+
+from .views import deepzoom_tile, deepzoom_descriptor
+
+
+
+#Matches `<slug>/<slug>.dzi` and `<slug>/<slug>_files/<level>/<column>_<row>.<format>` 
+#below the deep zoom root, the same paths the files are saved to.
+urlpatterns = [
+    url(r'^(?P<passed_slug>[-\w]+)/[-\w]+\.dzi$', 
+        deepzoom_descriptor, 
+        name="deepzoom_descriptor"), 
+    url(r'^(?P<passed_slug>[-\w]+)/[-\w]+_files/(?P<level>\d+)/(?P<column>\d+)_(?P<row>\d+)\.(?P<tile_format>jpg|png)$', 
+        deepzoom_tile, 
+        name="deepzoom_tile"), 
+]
+
+
+#EOF - django-deepzoom urls
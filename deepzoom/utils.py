@@ -2,6 +2,8 @@
 
 from django import get_version
 
+import threading
+
 
 
 def is_django_version_greater_than(major=1, minor=4):
@@ -43,4 +45,56 @@ def receiver_subclasses(signal, sender, _dispatch_uid, **kwargs):
     return _decorator
 
 
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key into a single call.  The 
+    first caller runs the function; callers arriving while it runs wait for 
+    it and share its result, or its exception.
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, func, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), running it only if no call for key is 
+        already running.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call(object):
+    """
+    A call in flight in a SingleFlight.
+    """
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 #EOF - django-deepzoom utils
\ No newline at end of file
@@ -0,0 +1,303 @@
+'''django-deepzoom views'''
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import hashlib
+import mimetypes
+import os
+
+import six
+
+from .models import DeepZoom
+from .cache import get_tile_cache, get_shared_cache, get_tile_pack
+
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+SENDFILE_HEADERS = {'x-sendfile': 'X-Sendfile', 
+                    'x-accel-redirect': 'X-Accel-Redirect'}
+
+
+def get_sendfile_header():
+    """
+    Returns the header `DEEPZOOM_SENDFILE` names for handing files to the 
+    front-end server, or None if files are served by Django.
+    """
+    header = getattr(settings, 'DEEPZOOM_SENDFILE', None)
+    if not isinstance(header, six.string_types):
+        return None
+    return SENDFILE_HEADERS.get(header.lower())
+
+
+@require_http_methods(["GET", "HEAD"])
+def deepzoom_tile(request, passed_slug=None, level=None, column=None, row=None, 
+                  tile_format=None):
+    """
+    Serves a deepzoom tile, creating it from the associated uploaded image 
+    the first time it is requested.  Later requests are served from the 
+    in-process tile cache, the shared tile cache, the tile pack or the saved 
+    tile file, or the saved tile file is handed to the front-end server.
+    """
+    _content_type = mimetypes.guess_type('tile.' + tile_format)[0]
+    _level, _column, _row = int(level), int(column), int(row)
+    _tile_name = "%s/%s_%s.%s" % (_level, _column, _row, tile_format)
+    
+    if get_sendfile_header() is not None:
+        _deepzoom_obj = _get_deepzoom(passed_slug)
+        #Tiles in a tile pack are no files the front-end server could send.
+        if get_tile_pack(_deepzoom_obj.get_deepzoom_pack_path()) is None:
+            _tile_path = _deepzoom_obj.get_deepzoom_tile(_level, _column, 
+                                                         _row, tile_format)
+            if _tile_path is None:
+                raise Http404
+            return _serve_file(request, _tile_path, _content_type, 
+                               _deepzoom_obj.get_fingerprint(), _tile_name)
+    
+    _content, _fingerprint, _modified = _get_tile(passed_slug, _level, 
+                                                  _column, _row, tile_format)
+    return _serve(request, _content_type, len(_content), _modified, 
+                  _get_etag(_fingerprint, _tile_name, _content), 
+                  _is_versioned(request, _fingerprint), content=_content)
+
+
+@require_http_methods(["GET", "HEAD"])
+def deepzoom_descriptor(request, passed_slug=None):
+    """
+    Serves a deepzoom descriptor file.
+    """
+    _deepzoom_obj = _get_deepzoom(passed_slug)
+    _descriptor_path = os.path.join(settings.MEDIA_ROOT, 
+                                    _deepzoom_obj.deepzoom_image)
+    if not os.path.isfile(_descriptor_path):
+        raise Http404
+    return _serve_file(request, _descriptor_path, 'application/xml', 
+                       _deepzoom_obj.get_fingerprint(), 'dzi')
+
+
+def _get_deepzoom(slug):
+    """
+    Returns the deepzoom with the slug, or raises Http404.
+    """
+    try:
+        return DeepZoom.objects.get(slug=slug)
+    except DeepZoom.DoesNotExist:
+        raise Http404
+
+
+def _get_etag(fingerprint, name, content=None):
+    """
+    Returns a strong entity tag for a deepzoom file, derived from the 
+    fingerprint of its pyramid, or from its content if there is none.
+    """
+    if fingerprint is not None:
+        digest = hashlib.sha1(("%s:%s" % (fingerprint, name)).encode("utf-8"))
+    elif content is not None:
+        digest = hashlib.sha1(content)
+    else:
+        return None
+    return '"%s"' % digest.hexdigest()
+
+
+def _is_versioned(request, fingerprint):
+    """
+    Returns whether the request names the current pyramid as its version, 
+    i.e. the response never changes.
+    """
+    return fingerprint is not None and request.GET.get('v') == fingerprint
+
+
+def _is_not_modified(request, etag, modified):
+    """
+    Returns whether the client's copy, per the request's conditional headers, 
+    is current.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return etag is not None and ('*' in etags or etag in etags)
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return (if_modified_since is not None and modified is not None and 
+            int(modified) <= if_modified_since)
+
+
+def _serve(request, content_type, length, modified, etag, versioned, 
+           content=None, path=None):
+    """
+    Returns a response for a deepzoom file with validators and caching 
+    headers, answering conditional requests with 304 Not Modified and HEAD 
+    requests without a body.  The body is given as content, or as the path 
+    of a file to hand to the front-end server.
+    """
+    if _is_not_modified(request, etag, modified):
+        response = HttpResponseNotModified()
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(length)
+    elif content is not None:
+        response = HttpResponse(content, content_type=content_type)
+    else:
+        response = HttpResponse(content_type=content_type)
+        header = get_sendfile_header()
+        if header == 'X-Accel-Redirect':
+            relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+            response[header] = (urlparse(settings.MEDIA_URL).path + 
+                                relative_path.replace(os.sep, '/'))
+        else:
+            response[header] = path
+    if etag is not None:
+        response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified)
+    if versioned:
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response
+
+
+def _serve_file(request, path, content_type, fingerprint, name):
+    """
+    Returns a response for a deepzoom file, handing its body to the front-end 
+    server if `DEEPZOOM_SENDFILE` is set.
+    """
+    stat = os.stat(path)
+    if get_sendfile_header() is not None:
+        return _serve(request, content_type, stat.st_size, stat.st_mtime, 
+                      _get_etag(fingerprint, name), 
+                      _is_versioned(request, fingerprint), path=path)
+    with open(path, 'rb') as _file:
+        content = _file.read()
+    return _serve(request, content_type, len(content), stat.st_mtime, 
+                  _get_etag(fingerprint, name, content), 
+                  _is_versioned(request, fingerprint), content=content)
+
+
+def _get_tile(slug, level, column, row, tile_format):
+    """
+    Returns (tile, fingerprint, modified) of the encoded tile, the fingerprint 
+    of its pyramid and the time its file was modified, looking in the 
+    in-process tile cache, then the shared tile cache and then the tile pack 
+    or tile file.  Tiles read from disk are cached in the shared tile cache 
+    along with their neighbours, which are likely requested next.  Both 
+    caches are keyed by the fingerprint of the current pyramid, taken from 
+    the shared cache or else worked out afresh, so no process serves tiles 
+    of a pyramid since replaced.  Tiles of a pyramid being created or 
+    updated, which has no fingerprint yet, are not cached at all.
+    """
+    _shared_cache = get_shared_cache()
+    _deepzoom_obj = _fingerprint = _descriptor = None
+    if _shared_cache is not None:
+        _fingerprint = _shared_cache.get_generation(slug)
+    if _fingerprint is None:
+        _deepzoom_obj = _get_deepzoom(slug)
+        _fingerprint = _deepzoom_obj.get_fingerprint()
+        if _shared_cache is not None and _fingerprint is not None:
+            _shared_cache.set_generation(slug, _fingerprint)
+    
+    _tile_cache = get_tile_cache() if _fingerprint is not None else None
+    _tile_key = (slug, _fingerprint, level, column, row, tile_format)
+    if _tile_cache is not None:
+        _tile = _tile_cache.get(_tile_key)
+        if _tile is not None:
+            return _tile
+    
+    if _shared_cache is not None and _fingerprint is not None:
+        _shared_tile, _descriptor = _shared_cache.get_tile(slug, _fingerprint, 
+                                                           level, column, row, 
+                                                           tile_format)
+        if _shared_tile is not None:
+            _tile = (_shared_tile[0], _fingerprint, _shared_tile[1])
+            _tile_cache.set(_tile_key, _tile, len(_tile[0]))
+            return _tile
+        if (_descriptor is not None and 
+                not _has_tile(_descriptor, level, column, row, tile_format)):
+            raise Http404
+    
+    if _deepzoom_obj is None:
+        _deepzoom_obj = _get_deepzoom(slug)
+    _pack = get_tile_pack(_deepzoom_obj.get_deepzoom_pack_path())
+    if _pack is not None:
+        if tile_format != _pack.tile_format:
+            raise Http404
+        _modified = os.path.getmtime(_pack.path)
+        def _read(_column, _row):
+            _content = _pack.get_tile(level, _column, _row)
+            if _content is None:
+                return None
+            return (_content.tobytes(), _modified)
+    else:
+        _tile_path = _deepzoom_obj.get_deepzoom_tile(level, column, row, 
+                                                     tile_format)
+        if _tile_path is None:
+            raise Http404
+        _level_path = os.path.dirname(_tile_path)
+        def _read(_column, _row):
+            return _read_tile(os.path.join(
+                _level_path, "%s_%s.%s" % (_column, _row, tile_format)))
+    
+    _tile = _read(column, row)
+    if _tile is None:
+        raise Http404
+    _content, _modified = _tile
+    _tile = (_content, _fingerprint, _modified)
+    if _tile_cache is not None:
+        _tile_cache.set(_tile_key, _tile, len(_content))
+    
+    if _shared_cache is not None and _fingerprint is not None:
+        if _descriptor is None:
+            _descriptor = _deepzoom_obj.get_deepzoom_descriptor()
+        _tiles = {}
+        for (_column, _row) in _get_neighbours(column, row):
+            _neighbour = _read(_column, _row)
+            if _neighbour is not None:
+                _tiles[(level, _column, _row, tile_format)] = _neighbour
+        _tiles[(level, column, row, tile_format)] = (_content, _modified)
+        _shared_cache.set_tiles(slug, _fingerprint, _tiles, _descriptor)
+    return _tile
+
+
+def _has_tile(descriptor, level, column, row, tile_format):
+    """
+    Returns whether the deepzoom descriptor describes the tile.
+    """
+    if tile_format != descriptor.tile_format:
+        return False
+    if level >= descriptor.num_levels:
+        return False
+    columns, rows = descriptor.get_num_tiles(level)
+    return column < columns and row < rows
+
+
+def _read_tile(tile_path):
+    """
+    Returns (tile, modified) of a tile file, or None if it does not exist.
+    """
+    try:
+        with open(tile_path, 'rb') as _tile_file:
+            return (_tile_file.read(), os.fstat(_tile_file.fileno()).st_mtime)
+    except (IOError, OSError):
+        return None
+
+
+def _get_neighbours(column, row):
+    """
+    Returns the positions, (column, row), surrounding a tile.
+    """
+    return [(_column, _row) 
+            for _column in range(max(column - 1, 0), column + 2) 
+            for _row in range(max(row - 1, 0), row + 2) 
+            if (_column, _row) != (column, row)]
+
+
+#EOF - django-deepzoom views
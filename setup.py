@@ -55,6 +55,9 @@ setup(
                       'pillow>=1.7.8',
                       'six>=1.9.0',
     ],
+    extras_require={
+                    'numpy': ['numpy'],
+    },
     keywords='imaging zoomable images deepzoom openseadragon',
     zip_safe=False,
 )